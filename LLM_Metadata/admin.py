@@ -1,10 +1,115 @@
 from django.contrib import admin
-from .models import Conversation
+from .models import Conversation, Thread, UploadedDocument, LLMJob, UsageRollup, JSONDocument, MetadataSchema, ExtractionResult, SemanticCacheEntry, SemanticCacheHit, KeepAlive, JobModelLock
 
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('id', 'role', 'content', 'model_name', 'token_usage', 'elapsed_time', 'timestamp', 'username', 'conversation_id')
-    list_filter = ('role', 'model_name', 'timestamp')
+    list_display = ('id', 'role', 'content', 'model_name', 'token_usage', 'elapsed_time', 'cache_hit', 'timestamp', 'username', 'conversation_id')
+    list_filter = ('role', 'model_name', 'cache_hit', 'timestamp')
     search_fields = ('content', 'username__username')
     ordering = ('-timestamp',)
 
-admin.site.register(Conversation, ConversationAdmin)
\ No newline at end of file
+admin.site.register(Conversation, ConversationAdmin)
+
+
+class ThreadAdmin(admin.ModelAdmin):
+    list_display = ('conversation_id', 'username', 'turn_count', 'total_tokens', 'created_at', 'last_activity')
+    search_fields = ('username', 'conversation_id')
+    ordering = ('-last_activity',)
+
+admin.site.register(Thread, ThreadAdmin)
+
+
+class UploadedDocumentAdmin(admin.ModelAdmin):
+    list_display = ('name', 'kind', 'encoding', 'size', 'chunk_count', 'total_tokens', 'uploaded_by', 'created_at')
+    search_fields = ('name', 'uploaded_by', 'sha256')
+    ordering = ('-created_at',)
+
+admin.site.register(UploadedDocument, UploadedDocumentAdmin)
+
+
+class LLMJobAdmin(admin.ModelAdmin):
+    list_display = ('job_id', 'username', 'model_name', 'status', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'model_name')
+    search_fields = ('job_id', 'username', 'question')
+    ordering = ('-created_at',)
+
+admin.site.register(LLMJob, LLMJobAdmin)
+
+
+class UsageRollupAdmin(admin.ModelAdmin):
+    list_display = ('period', 'bucket', 'username', 'model_name', 'requests', 'tokens', 'cache_hits')
+    list_filter = ('period', 'model_name')
+    search_fields = ('username',)
+    ordering = ('-bucket',)
+
+admin.site.register(UsageRollup, UsageRollupAdmin)
+
+
+class JSONDocumentAdmin(admin.ModelAdmin):
+    list_display = ('name', 'root_type', 'size', 'uploaded_by', 'created_at')
+    search_fields = ('name', 'uploaded_by', 'sha256')
+    ordering = ('-created_at',)
+
+admin.site.register(JSONDocument, JSONDocumentAdmin)
+
+
+class MetadataSchemaAdmin(admin.ModelAdmin):
+    list_display = ('name', 'version', 'description', 'created_by', 'created_at')
+    search_fields = ('name', 'description')
+    ordering = ('name', '-version')
+    exclude = ('version', 'created_by')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Versions are immutable; add the changed schema as a new version instead
+        return ('name', 'version', 'schema', 'created_by', 'created_at') if obj else ()
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            latest = MetadataSchema.objects.filter(name=obj.name).order_by('-version').first()
+            obj.version = latest.version + 1 if latest else 1
+            obj.created_by = request.user.username
+        super().save_model(request, obj, form, change)
+
+admin.site.register(MetadataSchema, MetadataSchemaAdmin)
+
+
+class ExtractionResultAdmin(admin.ModelAdmin):
+    list_display = ('schema', 'username', 'model_name', 'status', 'attempts', 'elapsed_time', 'timestamp')
+    list_filter = ('status', 'model_name', 'schema__name')
+    search_fields = ('username', 'source')
+    ordering = ('-timestamp',)
+
+admin.site.register(ExtractionResult, ExtractionResultAdmin)
+
+
+class SemanticCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('question', 'model_name', 'username', 'hits', 'created_at', 'last_hit_at')
+    list_filter = ('model_name',)
+    search_fields = ('question', 'username')
+    ordering = ('-created_at',)
+    exclude = ('embedding',)
+
+admin.site.register(SemanticCacheEntry, SemanticCacheEntryAdmin)
+
+
+class SemanticCacheHitAdmin(admin.ModelAdmin):
+    list_display = ('message', 'model_name', 'username', 'score', 'false_hit', 'timestamp')
+    list_filter = ('false_hit', 'model_name')
+    search_fields = ('username',)
+    ordering = ('-timestamp',)
+    raw_id_fields = ('message', 'entry')
+
+admin.site.register(SemanticCacheHit, SemanticCacheHitAdmin)
+
+
+class KeepAliveAdmin(admin.ModelAdmin):
+    list_display = ('name', 'pings', 'touched_at')
+    ordering = ('name',)
+
+admin.site.register(KeepAlive, KeepAliveAdmin)
+
+
+class JobModelLockAdmin(admin.ModelAdmin):
+    list_display = ('model_name',)
+    ordering = ('model_name',)
+
+admin.site.register(JobModelLock, JobModelLockAdmin)
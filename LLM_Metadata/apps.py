@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LlmMetadataConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'LLM_Metadata'
+
+    def ready(self):
+        # Connect the cache invalidation signal receivers
+        from . import auth_backends, page_cache  # noqa: F401
@@ -0,0 +1,43 @@
+from allauth.account.auth_backends import AuthenticationBackend
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+def _user_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+class CachedUserMixin:
+    """
+    Serve the signed-in user of each request from the default cache for
+    AUTH_USER_CACHE_TTL seconds instead of querying it. The cached user is
+    dropped whenever it is saved or deleted, e.g. on a password change.
+    """
+
+    def get_user(self, user_id):
+        ttl = settings.AUTH_USER_CACHE_TTL
+        if not ttl:
+            return super().get_user(user_id)
+        user = cache.get(_user_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(_user_key(user_id), user, ttl)
+        return user
+
+
+class CachedModelBackend(CachedUserMixin, ModelBackend):
+    pass
+
+
+class CachedAuthenticationBackend(CachedUserMixin, AuthenticationBackend):
+    pass
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def forget_cached_user(sender, instance, **kwargs):
+    cache.delete(_user_key(instance.pk))
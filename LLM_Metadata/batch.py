@@ -0,0 +1,156 @@
+import itertools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .forms import QuestionForm
+from .ingestion import document_context_message
+from .models import Conversation, Thread, Turn, UploadedDocument
+from .page_cache import invalidate_user_history
+from .rollups import record_usage
+from .router import default_model
+from .services import telemetry_fields
+from .utils import query_api
+
+# Request key -> QuestionForm field, for the parameters that can be given as a grid
+GRID_FIELDS = {
+    'questions': 'question',
+    'models': 'model',
+    'max_tokens': 'max_tokens',
+    'temperatures': 'temperature',
+    'top_k': 'top_k',
+    'top_p': 'top_p',
+}
+
+
+class BatchError(ValueError):
+    pass
+
+
+def expand_grid(spec, username):
+    """
+    Validate a batch request and expand it into one item per combination
+    of its questions, parameter values and documents. Every combination is
+    checked with QuestionForm, so a batch accepts exactly what /ask/ does.
+    """
+    if not spec.get('questions'):
+        raise BatchError("'questions' must be a non-empty list.")
+
+    initial = {name: field.initial for name, field in QuestionForm.base_fields.items()}
+    initial['model'] = default_model()
+    axes = []
+    for key, field in GRID_FIELDS.items():
+        values = spec.get(key, [initial[field]])
+        if not isinstance(values, list) or not values:
+            raise BatchError(f"'{key}' must be a non-empty list.")
+        axes.append([(field, value) for value in values])
+
+    documents = [None]
+    if spec.get('document_ids'):
+        document_ids = [int(pk) for pk in spec['document_ids']]
+        found = UploadedDocument.objects.filter(
+            Q(uploaded_by=username) | Q(messages__username=username), pk__in=document_ids
+        ).distinct().in_bulk()
+        missing = set(document_ids) - set(found)
+        if missing:
+            raise BatchError(f"Unknown documents: {sorted(missing)}")
+        documents = [found[pk] for pk in document_ids]
+
+    combinations = list(itertools.product(*axes, documents))
+    if len(combinations) > settings.LLM_BATCH_MAX_ITEMS:
+        raise BatchError(f"The batch expands to {len(combinations)} prompts; the limit is {settings.LLM_BATCH_MAX_ITEMS}.")
+
+    items = []
+    for combination in combinations:
+        *params, document = combination
+        form = QuestionForm(dict(params))
+        if not form.is_valid():
+            errors = '; '.join(f"{field}: {' '.join(messages)}" for field, messages in form.errors.items())
+            raise BatchError(f"Invalid combination {dict(params)}: {errors}")
+        items.append(dict(form.cleaned_data, document=document))
+    return items
+
+
+def _ask(item):
+    messages = [{"role": "user", "content": item['question']}]
+    if item['document']:
+        file_message = document_context_message(item['document'], item['question'])
+        if file_message:
+            messages.append(file_message)
+    try:
+        return query_api(messages, item['model'], item['temperature'], item['max_tokens'], item['top_k'], item['top_p'])
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def run_batch(items, concurrency=None):
+    """
+    Ask every item concurrently, at most ``concurrency`` (capped at
+    LLM_BATCH_CONCURRENCY) at a time. Returns the responses in item order.
+    """
+    concurrency = max(min(concurrency or settings.LLM_BATCH_CONCURRENCY, settings.LLM_BATCH_CONCURRENCY, len(items)), 1)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(_ask, items))
+
+
+def save_batch(username, items, responses):
+    """
+    Store every answered item as its own conversation with a few bulk
+    inserts, whatever the batch size. Returns the assistant rows, with None
+    for failed items.
+    """
+    now = timezone.now()
+    answered = [(item, response) for item, response in zip(items, responses) if 'error' not in response]
+
+    rows = []
+    for item, response in answered:
+        conversation_id = uuid.uuid4()
+        common = dict(
+            username=username, conversation_id=conversation_id, timestamp=now, model_name=item['model'],
+            token_usage=response['response_tokens'], elapsed_time=round(response['elapsed_time'], 2),
+            temperature=item['temperature'], top_k=item['top_k'], top_p=item['top_p'],
+            document=item['document'], cache_hit=response.get('cache_hit', False)
+        )
+        rows.append(Conversation(role='user', content=item['question'], **common))
+        rows.append(Conversation(role='assistant', content=response['content'], **common, **telemetry_fields(response)))
+
+    with transaction.atomic():
+        # Primary keys are set on the objects by backends that return them (PostgreSQL, SQLite 3.35+)
+        Conversation.objects.bulk_create(rows)
+        pairs = list(zip(rows[::2], rows[1::2]))
+        threads = Thread.objects.bulk_create([
+            Thread(conversation_id=question.conversation_id, username=username, turn_count=1,
+                   total_tokens=answer.token_usage or 0, created_at=now, last_activity=now)
+            for question, answer in pairs
+        ])
+        Turn.objects.bulk_create([
+            Turn(thread=thread, user_message=question, assistant_message=answer,
+                 username=username, timestamp=now, tokens=answer.token_usage or 0)
+            for thread, (question, answer) in zip(threads, pairs)
+        ])
+        record_usage([answer for _, answer in pairs])
+        # bulk_create sends no save signals
+        invalidate_user_history(username)
+
+    answers = iter(answer for _, answer in pairs)
+    return [next(answers) if 'error' not in response else None for response in responses]
+
+
+def results_table(items, responses, answers):
+    columns = ['question', 'model', 'temperature', 'max_tokens', 'top_k', 'top_p', 'document',
+               'status', 'answer', 'response_tokens', 'elapsed_time', 'cache_hit', 'message_id']
+    rows = []
+    for item, response, answer in zip(items, responses, answers):
+        rows.append([
+            item['question'], item['model'], item['temperature'], item['max_tokens'], item['top_k'], item['top_p'],
+            item['document'].name if item['document'] else None,
+            'error' if answer is None else 'ok',
+            answer.content if answer else response.get('error'),
+            answer.token_usage if answer else None,
+            answer.elapsed_time if answer else None,
+            answer.cache_hit if answer else None,
+            answer.pk if answer else None,
+        ])
+    return columns, rows
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.core.cache import cache
+from .models import Conversation
+
+try:
+    import tiktoken
+except ImportError:  # optional; token counts fall back to an estimate
+    tiktoken = None
+
+# Tokens the chat template adds around every message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(settings.LLM_TOKENIZER_ENCODING)
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    """
+    Approximate number of tokens in ``text``. Uses tiktoken when it is
+    installed and about four characters per token otherwise; neither is the
+    backend model's own tokenizer.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _message(role, content):
+    return {"role": role, "content": content, "tokens": count_tokens(content) + MESSAGE_OVERHEAD_TOKENS}
+
+
+def _cache_key(conversation_id):
+    return f"llm-context:{conversation_id}"
+
+
+def load_history(conversation_id):
+    """
+    Stored messages of a conversation with their token counts. The list is
+    cached per conversation together with the id of the last row it
+    contains, so each turn only reads the rows saved since the last call.
+    """
+    key = _cache_key(conversation_id)
+    try:
+        entry = cache.get(key)
+    except Exception:
+        entry = None
+    entry = entry or {"last_id": 0, "messages": []}
+
+    new_rows = Conversation.objects.filter(
+        conversation_id=conversation_id, pk__gt=entry["last_id"]
+    ).order_by('timestamp', 'pk').values_list('pk', 'role', 'content')
+
+    if new_rows:
+        for pk, role, content in new_rows:
+            entry["messages"].append(_message(role, content))
+            entry["last_id"] = max(entry["last_id"], pk)
+        try:
+            cache.set(key, entry, settings.LLM_CONTEXT_CACHE_TTL)
+        except Exception:
+            pass
+    return entry["messages"]
+
+
+def invalidate_history(conversation_id):
+    try:
+        cache.delete(_cache_key(conversation_id))
+    except Exception:
+        pass
+
+
+def _newest_that_fit(history, remaining):
+    kept = []
+    for message in reversed(history):
+        if message["tokens"] > remaining:
+            break
+        kept.append(message)
+        remaining -= message["tokens"]
+    kept.reverse()
+    # Don't start the window with a reply whose question was cut off
+    while kept and kept[0]["role"] == 'assistant':
+        kept.pop(0)
+    return kept
+
+
+def fit_to_budget(history, new_messages, budget):
+    """
+    Keep the newest history that fits in ``budget`` tokens next to
+    ``new_messages``, which are always sent. Older turns are dropped and
+    replaced by a short note so the model knows context is missing.
+    """
+    remaining = budget - sum(message["tokens"] for message in new_messages)
+    if sum(message["tokens"] for message in history) <= remaining:
+        return list(history) + list(new_messages)
+
+    # Reserve room for the note before filling the window
+    note = _message('system', "Earlier messages of this conversation were omitted to fit the context window.")
+    kept = _newest_that_fit(history, remaining - note["tokens"])
+    return [note] + kept + list(new_messages)
+
+
+def build_context(conversation_id, new_messages, reply_tokens=0):
+    """
+    Message list for the LLM: as much of the stored conversation as fits in
+    LLM_CONTEXT_TOKEN_BUDGET after reserving ``reply_tokens`` for the answer,
+    followed by ``new_messages``.
+    """
+    budget = settings.LLM_CONTEXT_TOKEN_BUDGET - (reply_tokens or 0)
+    new_messages = [_message(message["role"], message["content"]) for message in new_messages]
+    messages = fit_to_budget(load_history(conversation_id), new_messages, budget)
+    return [{"role": message["role"], "content": message["content"]} for message in messages]
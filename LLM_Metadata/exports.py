@@ -0,0 +1,334 @@
+import json
+import uuid
+from datetime import datetime, time as datetime_time
+from itertools import islice
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Conversation, Thread, Turn, UploadedDocument
+from .page_cache import invalidate_user_history
+from .rollups import record_usage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional; without it only NDJSON can be exported and imported
+    pa = pq = None
+
+# Columns of an export, in order; the importer reads the same names
+EXPORT_FIELDS = (
+    'id', 'conversation_id', 'role', 'content', 'username', 'model_name', 'timestamp',
+    'token_usage', 'elapsed_time', 'temperature', 'top_k', 'top_p', 'cache_hit',
+    'prompt_tokens', 'completion_tokens', 'ttfb', 'queue_wait', 'backend', 'file_upload', 'document_id',
+)
+FORMATS = ('ndjson', 'parquet')
+_TIMESTAMP = EXPORT_FIELDS.index('timestamp')
+_CONVERSATION_ID = EXPORT_FIELDS.index('conversation_id')
+_FILE_UPLOAD = EXPORT_FIELDS.index('file_upload')
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def parquet_available():
+    return pa is not None
+
+
+def parse_bound(value):
+    """
+    A date range bound given as an ISO date or datetime; a date means its
+    midnight. Naive values are in the current time zone. Raises ValueError.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Not a date or datetime: {value!r}")
+        moment = datetime.combine(day, datetime_time())
+    if settings.USE_TZ and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(username=None, model=None, since=None, until=None):
+    # Messages from ``since`` up to, but not including, ``until``
+    messages = Conversation.objects.all()
+    if username:
+        messages = messages.filter(username=username)
+    if model:
+        messages = messages.filter(model_name=model)
+    if since:
+        messages = messages.filter(timestamp__gte=since)
+    if until:
+        messages = messages.filter(timestamp__lt=until)
+    return messages
+
+
+def iter_rows(messages, chunk_size=None):
+    """
+    The EXPORT_FIELDS tuples of ``messages`` in primary key order, fetched
+    ``chunk_size`` rows at a time, so memory use doesn't grow with the
+    export. Uses a server-side cursor where the database has one; behind a
+    transaction-mode pooler (DISABLE_SERVER_SIDE_CURSORS) .iterator() would
+    read the whole result, so rows are paged by primary key instead.
+    """
+    chunk_size = chunk_size or settings.CONVERSATION_EXPORT_CHUNK_SIZE
+    rows = messages.order_by('pk').values_list(*EXPORT_FIELDS)
+    if not connections[rows.db].settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        yield from rows.iterator(chunk_size=chunk_size)
+        return
+    last = None
+    while True:
+        page = list((rows.filter(pk__gt=last) if last is not None else rows)[:chunk_size])
+        yield from page
+        if len(page) < chunk_size:
+            return
+        last = page[-1][0]
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _json_record(row):
+    record = dict(zip(EXPORT_FIELDS, row))
+    record['conversation_id'] = str(row[_CONVERSATION_ID])
+    record['timestamp'] = row[_TIMESTAMP].isoformat()
+    record['file_upload'] = row[_FILE_UPLOAD] or None
+    return record
+
+
+def iter_ndjson(rows, chunk_size=None):
+    # One JSON object per line; yields a string per chunk of rows
+    chunk_size = chunk_size or settings.CONVERSATION_EXPORT_CHUNK_SIZE
+    for chunk in _chunks(rows, chunk_size):
+        yield ''.join(json.dumps(_json_record(row), ensure_ascii=False) + '\n' for row in chunk)
+
+
+def parquet_schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('conversation_id', pa.string()),
+        ('role', pa.string()),
+        ('content', pa.string()),
+        ('username', pa.string()),
+        ('model_name', pa.string()),
+        ('timestamp', pa.timestamp('us', tz='UTC' if settings.USE_TZ else None)),
+        ('token_usage', pa.int64()),
+        ('elapsed_time', pa.float64()),
+        ('temperature', pa.float64()),
+        ('top_k', pa.int64()),
+        ('top_p', pa.float64()),
+        ('cache_hit', pa.bool_()),
+        ('prompt_tokens', pa.int64()),
+        ('completion_tokens', pa.int64()),
+        ('ttfb', pa.float64()),
+        ('queue_wait', pa.float64()),
+        ('backend', pa.string()),
+        ('file_upload', pa.string()),
+        ('document_id', pa.int64()),
+    ])
+
+
+class _Drain:
+    # Write-only file object that hands out what was written since the last drain
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def iter_parquet(rows, row_group_size=None):
+    """
+    A Parquet file of ``rows``, yielded as bytes one row group of
+    ``row_group_size`` rows at a time; only the current row group is held
+    in memory. Requires pyarrow.
+    """
+    row_group_size = row_group_size or settings.CONVERSATION_EXPORT_ROW_GROUP_SIZE
+    schema = parquet_schema()
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for chunk in _chunks(rows, row_group_size):
+            columns = [list(column) for column in zip(*chunk)]
+            columns[_CONVERSATION_ID] = [str(value) for value in columns[_CONVERSATION_ID]]
+            columns[_FILE_UPLOAD] = [value or None for value in columns[_FILE_UPLOAD]]
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    # The footer
+    yield sink.drain()
+
+
+def export_stream(messages, output_format, chunk_size=None):
+    # Bytes or strings of ``messages`` exported as ``output_format``
+    rows = iter_rows(messages, chunk_size)
+    if output_format == 'parquet':
+        return iter_parquet(rows)
+    return iter_ndjson(rows, chunk_size)
+
+
+def read_ndjson(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise InvalidRecord(f"Line {number}: {e}")
+        if not isinstance(record, dict):
+            raise InvalidRecord(f"Line {number}: not a JSON object")
+        yield record
+
+
+def read_parquet(source, batch_size=None):
+    # Records of a Parquet file, read a batch at a time
+    batch_size = batch_size or settings.CONVERSATION_IMPORT_BATCH_SIZE
+    parquet_file = pq.ParquetFile(source)
+    columns = [name for name in parquet_file.schema_arrow.names if name in EXPORT_FIELDS]
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield from batch.to_pylist()
+
+
+def _message(record, number):
+    # The Conversation row of an imported record; its id isn't kept
+    if record.get('role') not in ('user', 'assistant'):
+        raise InvalidRecord(f"Record {number}: role must be 'user' or 'assistant'")
+    if not record.get('username') or record.get('content') is None:
+        raise InvalidRecord(f"Record {number}: username and content are required")
+    try:
+        conversation_id = uuid.UUID(str(record['conversation_id']))
+        moment = record.get('timestamp')
+        if isinstance(moment, str):
+            moment = parse_datetime(moment)
+        if not isinstance(moment, datetime):
+            raise ValueError("timestamp is missing or invalid")
+    except (KeyError, ValueError) as e:
+        raise InvalidRecord(f"Record {number}: {e}")
+    if settings.USE_TZ and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    fields = {
+        name: record.get(name) for name in EXPORT_FIELDS
+        if name not in ('id', 'conversation_id', 'timestamp', 'cache_hit', 'file_upload')
+    }
+    return Conversation(
+        conversation_id=conversation_id, timestamp=moment, cache_hit=bool(record.get('cache_hit')),
+        file_upload=record.get('file_upload') or None, **fields
+    )
+
+
+def _link_turns(pairs):
+    # Turns for (question, answer or None) pairs, creating or updating their threads
+    if not pairs:
+        return
+    totals = {}
+    for question, answer in pairs:
+        reply = answer or question
+        tokens = (answer.token_usage or 0) if answer else 0
+        total = totals.setdefault(question.conversation_id, {
+            'username': question.username, 'created_at': question.timestamp,
+            'turn_count': 0, 'total_tokens': 0, 'last_activity': reply.timestamp,
+        })
+        total['turn_count'] += 1
+        total['total_tokens'] += tokens
+        total['last_activity'] = max(total['last_activity'], reply.timestamp)
+
+    threads = Thread.objects.in_bulk(list(totals), field_name='conversation_id')
+    for conversation_id, total in totals.items():
+        if conversation_id in threads:
+            Thread.objects.filter(pk=threads[conversation_id].pk).update(
+                turn_count=F('turn_count') + total['turn_count'],
+                total_tokens=F('total_tokens') + total['total_tokens'],
+                last_activity=Greatest(F('last_activity'), total['last_activity']),
+            )
+    created = Thread.objects.bulk_create([
+        Thread(conversation_id=conversation_id, **total)
+        for conversation_id, total in totals.items() if conversation_id not in threads
+    ])
+    threads.update({thread.conversation_id: thread for thread in created})
+
+    Turn.objects.bulk_create([
+        Turn(thread=threads[question.conversation_id], user_message=question, assistant_message=answer,
+             username=question.username, timestamp=(answer or question).timestamp,
+             tokens=(answer.token_usage or 0) if answer else 0)
+        for question, answer in pairs
+    ])
+
+
+def import_records(records, batch_size=None):
+    """
+    Bulk insert exported messages, ``batch_size`` at a time in one
+    transaction each, with new primary keys. Each question is linked to the
+    answer that follows it in the same conversation (the order of an
+    export) by a Turn, and answers are added to the usage rollups. Returns
+    {'messages': ..., 'turns': ...}; raises InvalidRecord, after committing
+    the batches before the bad record.
+    """
+    batch_size = batch_size or settings.CONVERSATION_IMPORT_BATCH_SIZE
+    counts = {'messages': 0, 'turns': 0}
+    # A saved question whose answer may open the next batch
+    question = None
+    for chunk in _chunks(records, batch_size):
+        messages = [_message(record, counts['messages'] + number) for number, record in enumerate(chunk, 1)]
+        document_ids = {message.document_id for message in messages if message.document_id}
+        if document_ids:
+            # Documents of another database aren't carried over
+            existing = set(UploadedDocument.objects.filter(pk__in=document_ids).values_list('pk', flat=True))
+            for message in messages:
+                if message.document_id not in existing:
+                    message.document_id = None
+
+        pairs = []
+        with transaction.atomic():
+            # Primary keys are set on the objects by backends that return them (PostgreSQL, SQLite 3.35+)
+            Conversation.objects.bulk_create(messages)
+            for message in messages:
+                if message.role == 'user':
+                    if question is not None:
+                        pairs.append((question, None))
+                    question = message
+                elif question is not None and question.conversation_id == message.conversation_id:
+                    pairs.append((question, message))
+                    question = None
+            _link_turns(pairs)
+            record_usage([message for message in messages if message.role == 'assistant'])
+            # bulk_create sends no save signals
+            for username in {message.username for message in messages}:
+                invalidate_user_history(username)
+        counts['messages'] += len(messages)
+        counts['turns'] += len(pairs)
+
+    if question is not None:
+        with transaction.atomic():
+            _link_turns([(question, None)])
+        counts['turns'] += 1
+    return counts
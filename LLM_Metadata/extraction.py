@@ -0,0 +1,330 @@
+import json
+import re
+from django.conf import settings
+from .ingestion import document_context_message
+from .metrics import record_extraction
+from .models import ExtractionResult
+from .schemas import FORBIDDEN, get_validator
+from .utils import query_api
+
+# Violations listed when the model is asked to correct its reply
+REASK_ERRORS = 20
+
+_FENCED = re.compile(r'```[a-zA-Z]*\s*\n(.*?)(?:\n\s*```|\Z)', re.DOTALL)
+_NUMBER = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null', 'NaN': 'null', 'undefined': 'null'}
+# Closing quote(s) of each opening quote
+_QUOTES = {'"': '"', "'": "'", '“': '”“', '”': '”“'}
+_NOT_CONVERTED = object()
+
+
+class ExtractionError(ValueError):
+    pass
+
+
+def extraction_messages(metadata_schema, text, document=None, instructions=''):
+    schema = json.dumps(metadata_schema.schema, separators=(',', ':'))
+    system = (
+        "You extract structured metadata from the user's text. Reply with a single JSON value that "
+        "conforms to the JSON Schema below and nothing else: no explanations and no code fences. "
+        "Leave out optional properties the text says nothing about.\n"
+        f"Schema: {schema}"
+    )
+    if instructions:
+        system += f"\n{instructions}"
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": text}]
+    if document:
+        context = document_context_message(document, text)
+        if context:
+            messages.append(context)
+    return messages
+
+
+def response_format(metadata_schema):
+    # What LLM_EXTRACTION_RESPONSE_FORMAT asks the backend for, or None
+    kind = settings.LLM_EXTRACTION_RESPONSE_FORMAT
+    if kind == 'json_schema':
+        name = re.sub(r'[^a-zA-Z0-9_-]', '_', metadata_schema.name)[:64]
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": metadata_schema.schema}}
+    if kind == 'json_object':
+        return {"type": "json_object"}
+    return None
+
+
+def repair_json(text):
+    """
+    Parse the JSON in a model reply, fixing what models commonly get wrong
+    on the way: code fences or prose around it, comments, single or curly
+    quotes, Python literals, unquoted keys, trailing commas and output cut
+    off by max_tokens. Returns (value, kinds of repairs applied); raises
+    ValueError when even the repaired text doesn't parse.
+    """
+    try:
+        return json.loads(text), []
+    except ValueError:
+        pass
+
+    repairs = []
+    body = text.strip()
+    fenced = _FENCED.search(body)
+    if fenced:
+        body = fenced.group(1).strip()
+        repairs.append('fence')
+    starts = [position for position in (body.find('{'), body.find('[')) if position >= 0]
+    if starts:
+        start = min(starts)
+        end = max(body.rfind('}'), body.rfind(']'))
+        # Prose after the JSON is cut, but not the tail of a reply cut off mid-value
+        if end <= start or '"' in body[end:] or ':' in body[end:]:
+            end = len(body) - 1
+        if (start, end) != (0, len(body) - 1):
+            body = body[start:end + 1]
+            repairs.append('prose')
+    try:
+        return json.loads(body), repairs
+    except ValueError:
+        pass
+
+    body = _normalize(body, repairs)
+    return json.loads(body), repairs
+
+
+def _normalize(text, repairs):
+    # One pass over the text that rewrites the lenient syntax into JSON
+    out = []
+    closers = []
+    position, length = 0, len(text)
+
+    def repaired(kind):
+        if kind not in repairs:
+            repairs.append(kind)
+
+    def drop_trailing_comma():
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ',':
+            out.pop()
+            repaired('trailing_comma')
+
+    while position < length:
+        char = text[position]
+        if char in _QUOTES:
+            if char != '"':
+                repaired('quotes')
+            closing = _QUOTES[char]
+            out.append('"')
+            position += 1
+            while position < length and text[position] not in closing:
+                if text[position] == '\\' and position + 1 < length:
+                    if text[position + 1] == "'":
+                        out.append("'")
+                    else:
+                        out.append(text[position:position + 2])
+                    position += 2
+                    continue
+                if text[position] == '"':
+                    out.append('\\"')
+                elif text[position] == '\n':
+                    out.append('\\n')
+                else:
+                    out.append(text[position])
+                position += 1
+            if position >= length:
+                repaired('truncated')
+            out.append('"')
+            position += 1
+        elif text.startswith('//', position) or text.startswith('/*', position):
+            end = text.find('\n' if text[position + 1] == '/' else '*/', position + 2)
+            position = length if end < 0 else end + (1 if text[position + 1] == '/' else 2)
+            repaired('comments')
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+            out.append(char)
+            position += 1
+        elif char in '}]':
+            drop_trailing_comma()
+            if closers:
+                closers.pop()
+            out.append(char)
+            position += 1
+        elif char == '-' or char.isdigit() or char == '.':
+            match = _NUMBER.match(text, position)
+            if match is None:
+                out.append(char)
+                position += 1
+            else:
+                out.append(match.group())
+                position = match.end()
+        elif char.isalpha() or char in '_$':
+            end = position
+            while end < length and (text[end].isalnum() or text[end] in '_$'):
+                end += 1
+            word = text[position:end]
+            if word in ('true', 'false', 'null'):
+                out.append(word)
+            elif word in _LITERALS:
+                out.append(_LITERALS[word])
+                repaired('literals')
+            else:
+                out.append(json.dumps(word))
+                repaired('unquoted_keys')
+            position = end
+        else:
+            out.append(char)
+            position += 1
+
+    if closers:
+        # Cut off mid-value: finish what is open
+        drop_trailing_comma()
+        if out and out[-1] == ':':
+            out.append('null')
+        out.extend(reversed(closers))
+        repaired('truncated')
+    return ''.join(out)
+
+
+def coerce(value, node, repairs):
+    """
+    Bring a parsed reply closer to its schema where the intent is clear:
+    numbers and booleans given as strings, enum values in the wrong case,
+    properties the schema forbids and a record wrapped in, or missing, a
+    one-item array. Changes dicts and lists in place; returns the value.
+    """
+    if node is None or node is FORBIDDEN:
+        return value
+    types = node.types or ()
+
+    if isinstance(value, list) and 'object' in types and 'array' not in types and len(value) == 1 and isinstance(value[0], dict):
+        value = value[0]
+        repairs.append('unwrapped')
+    elif isinstance(value, dict) and 'array' in types and 'object' not in types:
+        value = [value]
+        repairs.append('wrapped')
+
+    if isinstance(value, dict) and node.has_object:
+        for key in list(value):
+            children = node.property_nodes(key, None, [])
+            if not children and node.additional_properties is FORBIDDEN:
+                del value[key]
+                repairs.append('dropped_property')
+            for child in children:
+                value[key] = coerce(value[key], child, repairs)
+    elif isinstance(value, list) and node.has_array:
+        for index, item in enumerate(value):
+            value[index] = coerce(item, node.item_node(index), repairs)
+    elif isinstance(value, str) and types and 'string' not in types:
+        converted = _from_string(value.strip(), types)
+        if converted is not _NOT_CONVERTED:
+            value = converted
+            repairs.append('coerced_type')
+    elif isinstance(value, (int, float)) and not isinstance(value, bool) and types == ['string']:
+        value = str(value)
+        repairs.append('coerced_type')
+
+    if node.enum is not None and isinstance(value, str) and value not in node.enum:
+        matches = [option for option in node.enum if isinstance(option, str) and option.casefold() == value.strip().casefold()]
+        if len(matches) == 1:
+            value = matches[0]
+            repairs.append('enum_case')
+    return value
+
+
+def _from_string(text, types):
+    # The string as one of ``types``, or _NOT_CONVERTED when it isn't one
+    lowered = text.lower()
+    if 'boolean' in types and lowered in ('true', 'false', 'yes', 'no'):
+        return lowered in ('true', 'yes')
+    if 'null' in types and lowered in ('', 'null', 'none', 'n/a'):
+        return None
+    if ('number' in types or 'integer' in types) and _NUMBER.fullmatch(text.replace(',', '')):
+        number = float(text.replace(',', ''))
+        if number.is_integer() and ('integer' in types or 'e' not in lowered and '.' not in text):
+            return int(number)
+        return number if 'number' in types else _NOT_CONVERTED
+    return _NOT_CONVERTED
+
+
+def _check(validator, content):
+    # (data, errors, repairs) for a reply; data is None when it isn't JSON
+    try:
+        data, repairs = repair_json(content)
+    except ValueError as e:
+        return None, [{'path': '', 'keyword': 'json', 'message': f"Not valid JSON: {e}"}], []
+    errors = validator.errors(data)
+    if errors:
+        data = coerce(data, validator.root, repairs)
+        errors = validator.errors(data)
+    return data, errors, list(dict.fromkeys(repairs))
+
+
+def _reask_message(errors):
+    problems = '\n'.join(f"- {error['path'] or '/'}: {error['message']}" for error in errors[:REASK_ERRORS])
+    return {
+        "role": "user",
+        "content": f"Your reply does not conform to the schema:\n{problems}\nReply with the corrected JSON only.",
+    }
+
+
+def extract(username, metadata_schema, text, model, document=None, instructions='',
+            temperature=None, max_tokens=None, max_reasks=None):
+    """
+    Extract metadata matching ``metadata_schema`` from ``text`` (and the
+    relevant parts of an uploaded document). The reply is parsed, locally
+    repaired and coerced if needed, and validated; only when it is still
+    invalid is the model asked again, with the violations, up to
+    ``max_reasks`` times. Saves and returns an ExtractionResult.
+    """
+    validator = get_validator(metadata_schema)
+    temperature = settings.LLM_EXTRACTION_TEMPERATURE if temperature is None else temperature
+    max_tokens = max_tokens or settings.LLM_EXTRACTION_MAX_TOKENS
+    max_reasks = settings.LLM_EXTRACTION_MAX_REASKS if max_reasks is None else max_reasks
+    messages = extraction_messages(metadata_schema, text, document, instructions)
+    result = ExtractionResult(
+        username=username, schema=metadata_schema, model_name=model, source=text, document=document, attempts=0
+    )
+
+    repairs = []
+    while True:
+        response = query_api(messages, model, temperature, max_tokens, response_format=response_format(metadata_schema))
+        result.attempts += 1
+        if 'error' in response:
+            result.status = result.status or 'failed'
+            result.errors = result.errors or [{'path': '', 'keyword': 'backend', 'message': str(response['error'])}]
+            break
+        result.elapsed_time += response.get('elapsed_time') or 0.0
+        for field in ('prompt_tokens', 'completion_tokens'):
+            if response.get(field) is not None:
+                setattr(result, field, (getattr(result, field) or 0) + response[field])
+        result.backend = 'cache' if response.get('cache_hit') else response.get('backend') or ''
+        result.raw_content = response['content']
+
+        result.data, result.errors, repairs = _check(validator, response['content'])
+        result.status = 'invalid' if result.errors else 'valid'
+        if not result.errors or result.attempts > max_reasks:
+            break
+        messages = messages + [{"role": "assistant", "content": response['content']}, _reask_message(result.errors)]
+
+    result.repairs = repairs
+    result.save()
+    if result.status == 'valid':
+        outcome = 'reasked' if result.attempts > 1 else 'repaired' if repairs else 'direct'
+    else:
+        outcome = result.status
+    record_extraction(model, metadata_schema.name, outcome, repairs)
+    return result
+
+
+def extraction_summary(result):
+    return {
+        'id': result.pk,
+        'schema': result.schema.name,
+        'version': result.schema.version,
+        'model': result.model_name,
+        'status': result.status,
+        'data': result.data,
+        'errors': result.errors,
+        'repairs': result.repairs,
+        'attempts': result.attempts,
+        'elapsed_time': result.elapsed_time,
+        'timestamp': result.timestamp.isoformat(),
+    }
@@ -0,0 +1,119 @@
+"""
+A small stand-in for the LLM backend, used by the load-test and benchmark
+management commands. It answers OpenAI-style chat completion requests after a
+configurable delay and records how many requests it is serving at once.
+"""
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; don't let Nagle delay them
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = {}
+
+        server._enter()
+        try:
+            time.sleep(server.latency)
+            if body.get('stream'):
+                self._stream(server.reply, server.chunk_delay)
+            else:
+                self._complete(body, server.reply)
+        finally:
+            server._exit()
+
+    def _complete(self, body, reply):
+        prompt = ' '.join(str(m.get('content', '')) for m in body.get('messages', []))
+        data = json.dumps({
+            'choices': [{'message': {'role': 'assistant', 'content': reply}}],
+            'usage': {
+                'prompt_tokens': len(prompt.split()),
+                'completion_tokens': len(reply.split()),
+            },
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, reply, chunk_delay):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for word in reply.split(' '):
+            time.sleep(chunk_delay)
+            event = {'choices': [{'delta': {'content': word + ' '}}]}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class FakeLLMServer:
+    """
+    Threaded HTTP server that replies to every POST after ``latency`` seconds.
+    Streamed replies send one word every ``chunk_delay`` seconds.
+    ``peak_in_flight`` is the largest number of requests it held at once.
+    """
+
+    def __init__(self, latency=1.0, reply='This is a canned answer from the fake LLM server.', host='127.0.0.1', port=0,
+                 chunk_delay=0):
+        self.latency = latency
+        self.reply = reply
+        self.chunk_delay = chunk_delay
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def reset_stats(self):
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.total_requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def start(self):
+        # A deep listen backlog so bursts of connections are not refused
+        self._httpd.socket.listen(1024)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -1,6 +1,7 @@
 from django import forms
 from .models import Conversation
 from django.core.exceptions import ValidationError
+from .router import model_choices
 
 class ConversationForm(forms.ModelForm):
     content = forms.CharField(widget=forms.Textarea(attrs={'placeholder': 'Type your question here...'}))
@@ -16,20 +17,8 @@ class QuestionForm(forms.Form):
         label="Your Question"
     )
     model = forms.ChoiceField(
-        choices=[
-            ('mistral-small3.1:latest' , 'mistral-small3.1'),
-            # ('llama3.3:70b-instruct-q8_0', 'llama3.3:70b instruct'),
-            # ('qwen3:32b-q8_0', 'qwen3:32b'),
-            # ('phi4-reasoning:14b-plus-fp16', 'phi4-reasoning:14b'),
-            # ('llama3.1:latest', 'Llama 3.1'),
-            # ('llama3.3:latest', 'Llama 3.3'),
-            # ('mixtral:latest', 'Mixtral'),
-            # ('deepseek-v2:latest', 'DeepSeek v2 16b'),
-            # ('nemotron:latest', 'Nemotron'),
-            # ('mistral-large:latest', 'Mistral Large'),
-            # ('deepseek-coder:6.7b', 'DeepSeek Coder 6.7b'),
-            # ('deepseek-r1:70b', 'DeepSeek r1 70b'),
-        ],
+        # Models are configured in LLM_MODELS and served by the LLM_BACKENDS registry
+        choices=model_choices,
         widget=forms.Select(attrs={'class': 'form-select'}),
         label="Select Model"
     )
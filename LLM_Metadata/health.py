@@ -0,0 +1,121 @@
+import threading
+import time
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from .models import Conversation, KeepAlive
+from .router import get_router
+
+_probes = {}
+_probes_lock = threading.Lock()
+
+
+def check_database():
+    # One round trip, no table access
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+def estimated_row_count(model):
+    """
+    Approximate row count of ``model``'s table without scanning it: the
+    planner's estimate on PostgreSQL, elsewhere an exact count cached for
+    HEALTH_STATS_TTL seconds. Returns (count, source).
+    """
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [table])
+            row = cursor.fetchone()
+        # -1 until the table is first vacuumed or analyzed
+        if row and row[0] >= 0:
+            return row[0], 'estimate'
+    key = f"health:row-count:{table}"
+    count = cache.get(key)
+    if count is None:
+        count = model.objects.count()
+        cache.set(key, count, settings.HEALTH_STATS_TTL)
+    return count, 'cached'
+
+
+def latest_conversation_time():
+    # The newest row by primary key, which is indexed; ordering by timestamp isn't
+    return Conversation.objects.order_by('-pk').values_list('timestamp', flat=True).first()
+
+
+def touch_keepalive(name):
+    """
+    Record a keep-alive ping by updating ``name``'s row in place; the row is
+    created on the first ping.
+    """
+    now = timezone.now()
+    if not KeepAlive.objects.filter(pk=name).update(pings=F('pings') + 1, touched_at=now):
+        KeepAlive.objects.get_or_create(name=name, defaults={'pings': 1, 'touched_at': now})
+    return now
+
+
+def _probe_url(url):
+    # The OpenAI-compatible model list next to the chat completions endpoint
+    suffix = '/chat/completions'
+    return url[:-len(suffix)] + '/models' if url.endswith(suffix) else url
+
+
+def _probe(backend):
+    start = time.monotonic()
+    try:
+        response = requests.get(
+            _probe_url(backend.url), headers=backend.headers(), timeout=settings.HEALTH_LLM_TIMEOUT
+        )
+    except requests.exceptions.RequestException as e:
+        return {'reachable': False, 'error': type(e).__name__, 'elapsed_time': round(time.monotonic() - start, 3)}
+    # Any answer below 500 means the server is up, even if it doesn't list models
+    return {
+        'reachable': response.status_code < 500,
+        'status_code': response.status_code,
+        'elapsed_time': round(time.monotonic() - start, 3),
+    }
+
+
+def probe_backends():
+    """
+    Reachability of every configured LLM backend, probed with a
+    HEALTH_LLM_TIMEOUT-second GET and remembered for HEALTH_LLM_PROBE_TTL
+    seconds, merged with the router's circuit-breaker state.
+    """
+    router = get_router()
+    now = time.monotonic()
+    results = []
+    for backend, state in zip(router.backends, router.snapshot()):
+        if not backend.url:
+            results.append(dict(state, reachable=False, error='No URL configured'))
+            continue
+        with _probes_lock:
+            cached = _probes.get(backend.name)
+        if cached is None or now - cached[0] >= settings.HEALTH_LLM_PROBE_TTL:
+            cached = (now, _probe(backend))
+            with _probes_lock:
+                _probes[backend.name] = cached
+        results.append(dict(state, **cached[1]))
+    return results
+
+
+def readiness():
+    """
+    Whether this worker can serve requests: the database answers and, when
+    HEALTH_READY_REQUIRES_LLM is set, at least one LLM backend is reachable
+    and not cut off by its circuit breaker. Returns (ready, details).
+    """
+    details = {}
+    try:
+        check_database()
+        details['database'] = 'ok'
+    except Exception as e:
+        details['database'] = f'error: {e}'
+    backends = probe_backends()
+    details['llm_backends'] = backends
+    llm_ready = any(backend['reachable'] and backend['state'] != 'open' for backend in backends)
+    ready = details['database'] == 'ok' and (llm_ready or not settings.HEALTH_READY_REQUIRES_LLM)
+    return ready, details
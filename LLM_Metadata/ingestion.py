@@ -0,0 +1,293 @@
+import codecs
+import csv
+import hashlib
+import heapq
+import io
+import json
+import re
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from .context import count_tokens
+from .models import DocumentChunk, UploadedDocument
+
+try:
+    from charset_normalizer import from_bytes as detect_charset
+except ImportError:  # optional; without it non-UTF-8 files are read as cp1252
+    detect_charset = None
+
+SNIFF_BYTES = 64 * 1024
+CHUNK_INSERT_BATCH = 200
+
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+_WORD_RE = re.compile(r'\w+')
+
+
+def ingest_upload(file_upload, username):
+    """
+    Store an uploaded file as token-bounded chunks and return its
+    UploadedDocument. The file is read in chunks and never held in memory
+    as a whole; a file whose content was ingested before is not parsed again.
+    """
+    digest = hashlib.sha256()
+    sample = b''
+    for block in file_upload.chunks():
+        digest.update(block)
+        if len(sample) < SNIFF_BYTES:
+            sample += block[:SNIFF_BYTES - len(sample)]
+    sha256 = digest.hexdigest()
+
+    existing = UploadedDocument.objects.filter(sha256=sha256).first()
+    if existing:
+        return existing
+
+    encoding = detect_encoding(sample)
+    kind = _kind(file_upload.name)
+    units = _parse(kind, decode_chunks(file_upload, encoding))
+
+    try:
+        with transaction.atomic():
+            document = UploadedDocument.objects.create(
+                sha256=sha256, name=file_upload.name[:255], kind=kind, encoding=encoding,
+                size=file_upload.size or 0, uploaded_by=username
+            )
+            _store_chunks(document, units)
+    except IntegrityError:
+        # The same file was ingested concurrently by another request
+        return UploadedDocument.objects.get(sha256=sha256)
+    return document
+
+
+def detect_encoding(sample):
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # The sample may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    if detect_charset is not None:
+        match = detect_charset(sample).best()
+        if match is not None:
+            return match.encoding
+    return 'cp1252'
+
+
+def _kind(name):
+    ext = name.rsplit('.', 1)[-1].lower()
+    return ext if ext in ('csv', 'json') else 'text'
+
+
+def decode_chunks(file_upload, encoding):
+    # The upload as text, one decoded block at a time
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for block in file_upload.chunks():
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def _lines(pieces):
+    pending = ''
+    for piece in pieces:
+        pending += piece
+        lines = pending.splitlines(keepends=True)
+        # The last line may continue in the next piece
+        pending = lines.pop() if lines and not lines[-1].endswith(('\n', '\r')) else ''
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _parse(kind, pieces):
+    """
+    Yield (prefix, unit) pairs: the smallest pieces of text that are kept
+    together in a chunk, plus a prefix repeated at the start of every chunk
+    (the CSV header) so each chunk can be read on its own.
+    """
+    if kind == 'csv':
+        return _csv_units(pieces)
+    if kind == 'json':
+        return _json_units(pieces)
+    return (('', line) for line in _lines(pieces))
+
+
+def _csv_units(pieces):
+    reader = csv.reader(_lines(pieces))
+    header = next(reader, None)
+    if header is None:
+        return
+    prefix = _csv_line(header)
+    for row in reader:
+        if row:
+            yield prefix, _csv_line(row)
+
+
+def _csv_line(row):
+    # Re-quote fields so commas and newlines inside values survive
+    output = io.StringIO()
+    csv.writer(output, lineterminator='\n').writerow(row)
+    return output.getvalue()
+
+
+def _json_units(pieces):
+    """
+    Top-level array elements (or concatenated/NDJSON values) decoded one at a
+    time with raw_decode, so only the value being parsed is buffered.
+    Content that isn't valid JSON is chunked as plain text.
+    """
+    decoder = json.JSONDecoder()
+    pieces = iter(pieces)
+    state = {'buffer': '', 'position': 0, 'in_array': None}
+
+    def values(final):
+        buffer = state['buffer']
+        position = state['position']
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer):
+                break
+            if state['in_array'] is None:
+                state['in_array'] = buffer[position] == '['
+                if state['in_array']:
+                    position += 1
+                    continue
+            if state['in_array'] and buffer[position] == ']':
+                position += 1
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break  # Incomplete value (or not JSON)
+            if end == len(buffer) and not final:
+                break  # A number or literal may continue in the next piece
+            position = end
+            yield '', json.dumps(value, ensure_ascii=False) + '\n'
+        state['position'] = position
+
+    for piece in pieces:
+        state['buffer'] = state['buffer'][state['position']:] + piece
+        state['position'] = 0
+        yield from values(final=False)
+        if len(state['buffer']) - state['position'] > settings.LLM_UPLOAD_JSON_VALUE_LIMIT:
+            yield from _text_fallback(state['buffer'][state['position']:], pieces)
+            return
+
+    yield from values(final=True)
+    rest = state['buffer'][state['position']:]
+    if rest.strip(' \t\r\n,]'):
+        yield from _text_fallback(rest, pieces)
+
+
+def _text_fallback(rest, pieces):
+    def remaining():
+        yield rest
+        yield from pieces
+    return (('', line) for line in _lines(remaining()))
+
+
+def _split(text, max_tokens):
+    # Cut an oversized unit at roughly max_tokens worth of characters
+    step = max(max_tokens * 4, 1)
+    for start in range(0, len(text), step):
+        yield text[start:start + step]
+
+
+def _chunks(units, max_tokens):
+    parts, tokens, chunk_prefix = [], 0, ''
+    for prefix, unit in units:
+        unit_tokens = count_tokens(unit)
+        if parts and tokens + unit_tokens > max_tokens:
+            yield chunk_prefix + ''.join(parts)
+            parts, tokens = [], 0
+        if not parts:
+            chunk_prefix = prefix
+            tokens = count_tokens(prefix)
+        if unit_tokens > max_tokens:
+            pieces = list(_split(unit, max_tokens))
+            for piece in pieces[:-1]:
+                yield chunk_prefix + piece
+            unit = pieces[-1]
+            unit_tokens = count_tokens(unit)
+        parts.append(unit)
+        tokens += unit_tokens
+    if parts:
+        yield chunk_prefix + ''.join(parts)
+
+
+def _store_chunks(document, units):
+    batch = []
+    count = total = 0
+    for content in _chunks(units, settings.LLM_UPLOAD_CHUNK_TOKENS):
+        tokens = count_tokens(content)
+        batch.append(DocumentChunk(document=document, index=count, content=content, tokens=tokens))
+        count += 1
+        total += tokens
+        if len(batch) >= CHUNK_INSERT_BATCH:
+            DocumentChunk.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_create(batch)
+    UploadedDocument.objects.filter(pk=document.pk).update(chunk_count=count, total_tokens=total)
+    document.chunk_count, document.total_tokens = count, total
+
+
+def _terms(text):
+    return {word for word in _WORD_RE.findall(text.lower()) if len(word) > 2}
+
+
+def relevant_chunks(document, question, budget_tokens=None):
+    """
+    The chunks of ``document`` that best match ``question`` and fit in
+    ``budget_tokens``, in document order. A chunk's score is the number of
+    question terms it contains; when no chunk matches, the file is taken
+    from the start.
+    """
+    budget = settings.LLM_UPLOAD_CONTEXT_TOKENS if budget_tokens is None else budget_tokens
+    terms = _terms(question)
+
+    # Keep only the best candidates in memory while scanning the chunks
+    candidates = []
+    limit = max(budget // max(settings.LLM_UPLOAD_CHUNK_TOKENS // 4, 1), 1)
+    for chunk in document.chunks.only('index', 'content', 'tokens').iterator(chunk_size=CHUNK_INSERT_BATCH):
+        score = len(terms & _terms(chunk.content)) if terms else 0
+        entry = (score, -chunk.index, chunk)
+        if len(candidates) < limit:
+            heapq.heappush(candidates, entry)
+        elif entry[:2] > candidates[0][:2]:
+            heapq.heapreplace(candidates, entry)
+
+    if any(score for score, _, _ in candidates):
+        candidates = [entry for entry in candidates if entry[0]]
+
+    selected, used = [], 0
+    for score, _, chunk in sorted(candidates, key=lambda entry: entry[:2], reverse=True):
+        if used + chunk.tokens > budget:
+            continue
+        selected.append(chunk)
+        used += chunk.tokens
+    return sorted(selected, key=lambda chunk: chunk.index)
+
+
+def document_context_message(document, question):
+    chunks = relevant_chunks(document, question)
+    if not chunks:
+        return None
+    excerpts = "\n...\n".join(chunk.content for chunk in chunks)
+    if len(chunks) == document.chunk_count:
+        intro = f"Here is some additional context from the uploaded file {document.name}:"
+    else:
+        intro = (f"Here are the parts of the uploaded file {document.name} most relevant to the question "
+                 f"({len(chunks)} of {document.chunk_count} sections):")
+    return {"role": "user", "content": f"{intro}\n{excerpts}"}
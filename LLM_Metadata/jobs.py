@@ -0,0 +1,155 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from .metrics import record_queue_wait
+from .models import JobModelLock, LLMJob
+from .services import save_exchange
+from .utils import query_api
+
+
+class QueueFull(Exception):
+    pass
+
+
+def enqueue_job(username, conversation_id, question, api_messages, model, max_tokens, temperature, top_k, top_p, document=None):
+    """
+    Queue a question for the workers. Raises QueueFull when
+    LLM_JOB_MAX_QUEUE_DEPTH jobs are already waiting.
+    """
+    if LLMJob.objects.filter(status='queued').count() >= settings.LLM_JOB_MAX_QUEUE_DEPTH:
+        raise QueueFull()
+    return LLMJob.objects.create(
+        username=username,
+        conversation_id=conversation_id,
+        question=question,
+        api_messages=api_messages,
+        model_name=model,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        document=document
+    )
+
+
+def model_concurrency(model):
+    return settings.LLM_JOB_MODEL_CONCURRENCY.get(model, settings.LLM_JOB_DEFAULT_CONCURRENCY)
+
+
+def claim_job(worker):
+    """
+    Mark the oldest runnable job as running and return it, or None. Models
+    are tried in the order of their oldest runnable job. Each claim holds
+    the model's JobModelLock row while it counts the model's running jobs
+    and claims one, so concurrent workers never exceed its concurrency
+    limit; jobs are locked with SKIP LOCKED so no two claim the same one.
+    """
+    now = timezone.now()
+    models = LLMJob.objects.filter(status='queued', run_after__lte=now).values('model_name').annotate(
+        oldest=Min('created_at')
+    ).order_by('oldest').values_list('model_name', flat=True)
+    for model in models:
+        job = _claim_model_job(worker, model, now)
+        if job is not None:
+            record_queue_wait(job.model_name, (job.started_at - job.created_at).total_seconds())
+            return job
+    return None
+
+
+def _claim_model_job(worker, model, now):
+    JobModelLock.objects.get_or_create(model_name=model)
+    with transaction.atomic():
+        # Another worker claiming this model holds the row; try the next model
+        if JobModelLock.objects.select_for_update(skip_locked=True).filter(pk=model).first() is None:
+            return None
+        if LLMJob.objects.filter(model_name=model, status='running').count() >= model_concurrency(model):
+            return None
+        job = LLMJob.objects.select_for_update(skip_locked=True).filter(
+            model_name=model, status='queued', run_after__lte=now
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.worker = worker
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'worker', 'started_at'])
+    return job
+
+
+def run_job(job):
+    """
+    Ask the model and store the answer like ask_question_view does. Failed
+    attempts are retried with exponential backoff up to LLM_JOB_MAX_ATTEMPTS.
+    """
+    try:
+        response = query_api(
+            job.api_messages, job.model_name, job.temperature, job.max_tokens, job.top_k, job.top_p,
+            username=job.username
+        )
+    except Exception as e:
+        response = {"error": str(e)}
+
+    if 'error' in response:
+        _fail(job, str(response['error']))
+        return job
+
+    queue_wait = (job.started_at - job.created_at).total_seconds()
+    _, assistant_message = save_exchange(
+        job.username, job.conversation_id, job.question, response,
+        job.model_name, job.temperature, job.top_k, job.top_p, document=job.document, queue_wait=queue_wait
+    )
+    job.status = 'succeeded'
+    job.assistant_message = assistant_message
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'assistant_message', 'error', 'finished_at'])
+    return job
+
+
+def abandon_job(job, error):
+    """
+    Put back a job whose run raised, e.g. on a database error while saving
+    the answer: it is retried like a failed request, or failed after
+    LLM_JOB_MAX_ATTEMPTS. Jobs no longer running are left alone.
+    """
+    job.refresh_from_db()
+    if job.status == 'running':
+        _fail(job, error)
+    return job
+
+
+def _fail(job, error):
+    job.error = error
+    if job.attempts < settings.LLM_JOB_MAX_ATTEMPTS:
+        delay = settings.LLM_JOB_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+        job.status = 'queued'
+        job.run_after = timezone.now() + timedelta(seconds=delay)
+    else:
+        job.status = 'failed'
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'run_after', 'finished_at'])
+
+
+def requeue_stale_jobs():
+    """
+    Put back jobs whose worker died mid-request: anything running for longer
+    than LLM_JOB_STALE_AFTER seconds. Like _fail, jobs that have used their
+    LLM_JOB_MAX_ATTEMPTS are failed instead, so a job that keeps killing its
+    worker isn't retried forever. Returns the number requeued.
+    """
+    now = timezone.now()
+    stale = LLMJob.objects.filter(status='running', started_at__lt=now - timedelta(seconds=settings.LLM_JOB_STALE_AFTER))
+    stale.filter(attempts__gte=settings.LLM_JOB_MAX_ATTEMPTS).update(
+        status='failed', worker='', error='The worker running this job stopped responding.', finished_at=now
+    )
+    return stale.update(status='queued', worker='')
+
+
+def queue_position(job):
+    # Number of runnable jobs ahead of this one
+    if job.status != 'queued':
+        return 0
+    return LLMJob.objects.filter(status='queued', created_at__lt=job.created_at).count()
@@ -0,0 +1,557 @@
+import hashlib
+import itertools
+import json
+import re
+import shutil
+import struct
+import tempfile
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError
+from django.db.models import Sum
+from django.template.defaultfilters import filesizeformat
+from .ingestion import SNIFF_BYTES, decode_chunks, detect_encoding
+from .models import JSONDocument
+
+# One index record per child: key offset (-1 in arrays), value start, value end
+RECORD = struct.Struct('<qqq')
+# Records read from the index at a time when scanning an object's keys
+RECORD_BATCH = 1000
+# Largest read when loading a batch of children at once
+BLOCK_BYTES = 8 * 1024 * 1024
+# Children up to this size are loaded to describe them in a node listing
+PREVIEW_BYTES = 64 * 1024
+# Longer strings are cut in node listings
+PREVIEW_CHARS = 200
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+_decoder = json.JSONDecoder()
+
+
+class InvalidJSON(ValueError):
+    def __init__(self, message, line, column, path):
+        super().__init__(f"{message}: line {line} column {column} (at {path or '/'})")
+        self.line = line
+        self.column = column
+        self.path = path
+
+
+class NodeNotFound(LookupError):
+    pass
+
+
+class QuotaExceeded(ValueError):
+    pass
+
+
+def escape_pointer(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def parse_pointer(path):
+    # JSON pointer (RFC 6901) -> list of reference tokens; '' is the whole document
+    if not path:
+        return []
+    if not path.startswith('/'):
+        raise NodeNotFound(path)
+    return [token.replace('~1', '/').replace('~0', '~') for token in path[1:].split('/')]
+
+
+def json_type(value):
+    if isinstance(value, dict):
+        return 'object'
+    if isinstance(value, list):
+        return 'array'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, bool):
+        return 'boolean'
+    if value is None:
+        return 'null'
+    return 'number'
+
+
+def store_json_document(file_upload, username):
+    """
+    Validate an uploaded JSON file in a single streaming pass and store it
+    with its index, owned by ``username``. Raises InvalidJSON with the line,
+    column and path of the first error, and QuotaExceeded when the user's
+    documents would exceed JSON_VIEWER_USER_QUOTA_BYTES. A file the user
+    uploaded before is returned without parsing it again.
+    """
+    digest = hashlib.sha256()
+    sample = b''
+    for block in file_upload.chunks():
+        digest.update(block)
+        if len(sample) < SNIFF_BYTES:
+            sample += block[:SNIFF_BYTES - len(sample)]
+    sha256 = digest.hexdigest()
+
+    documents = JSONDocument.objects.filter(uploaded_by=username)
+    existing = documents.filter(sha256=sha256).first()
+    if existing:
+        return existing
+    quota = settings.JSON_VIEWER_USER_QUOTA_BYTES
+    if quota:
+        used = documents.aggregate(total=Sum('size'))['total'] or 0
+        if used + file_upload.size > quota:
+            raise QuotaExceeded(f"This upload would take your JSON documents past their {filesizeformat(quota)} quota.")
+
+    text = decode_chunks(file_upload, detect_encoding(sample))
+    with tempfile.TemporaryFile() as output, tempfile.TemporaryFile() as index:
+        indexer = _Indexer(text, output, index, settings.JSON_VIEWER_NODE_BYTES)
+        root_type = indexer.run()
+        document = JSONDocument(
+            sha256=sha256, name=file_upload.name[:255], size=output.tell(), root_type=root_type,
+            containers=indexer.containers, uploaded_by=username
+        )
+        document.file.save(f'{sha256}.json', File(output), save=False)
+        document.index.save(f'{sha256}.index', File(index), save=False)
+
+    try:
+        document.save()
+    except IntegrityError:
+        # The same file was stored concurrently by another request
+        document.file.delete(save=False)
+        document.index.delete(save=False)
+        return documents.get(sha256=sha256)
+    return document
+
+
+def delete_json_document(document):
+    # The row and its stored file and index
+    document.file.delete(save=False)
+    document.index.delete(save=False)
+    document.delete()
+
+
+class _Frame:
+    # An indexed container that is still being parsed
+    def __init__(self, kind, path, start, key_start):
+        self.kind = kind  # 'array' or 'object'
+        self.path = path
+        self.start = start
+        self.key_start = key_start  # Where this container's key starts in its parent, -1 in arrays
+        self.records = tempfile.TemporaryFile()
+        self.length = 0
+        self.tabular = True  # Every child so far is an object
+        self.expect = 'first'
+        self.key = None  # Key of the child being parsed
+        self.child_key_start = -1
+
+
+class _Indexer:
+    """
+    Parses JSON text arriving in pieces, writing it to ``output`` as UTF-8.
+    Values are decoded whole with the C decoder unless they are containers
+    larger than ``node_bytes``; those (and the root) are walked child by
+    child instead, and where each child starts and ends is written to
+    ``index``. Memory use is bounded by ``node_bytes``, not by the file size.
+    """
+
+    def __init__(self, pieces, output, index, node_bytes):
+        self.pieces = iter(pieces)
+        self.output = output
+        self.index = index
+        self.node_bytes = node_bytes
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.offset = 0  # Byte offset of self.pos in the output
+        self.line = 1
+        self.column = 1
+        self.stack = []
+        self.containers = {}
+        self.index_records = 0
+
+    def run(self):
+        char = self.peek()
+        if char in ('[', '{'):
+            root_type = 'array' if char == '[' else 'object'
+            self.open(char, '', -1)
+            self.parse_containers()
+        elif char:
+            value, end = self.value('')
+            self.advance(end)
+            root_type = json_type(value)
+        else:
+            self.error('Expecting value', '')
+        if self.peek():
+            self.error('Extra data', '')
+        return root_type
+
+    def fill(self):
+        # Read the next piece of text; False at the end of the input
+        for piece in self.pieces:
+            if piece:
+                self.output.write(piece.encode('utf-8'))
+                self.buffer = self.buffer[self.pos:] + piece
+                self.pos = 0
+                return True
+        self.eof = True
+        return False
+
+    def advance(self, end):
+        segment = self.buffer[self.pos:end]
+        self.offset += len(segment) if segment.isascii() else len(segment.encode('utf-8'))
+        newlines = segment.count('\n')
+        if newlines:
+            self.line += newlines
+            self.column = len(segment) - segment.rfind('\n')
+        else:
+            self.column += len(segment)
+        self.pos = end
+
+    def peek(self):
+        # The next non-whitespace character, or '' at the end of the input
+        while True:
+            self.advance(_WHITESPACE.match(self.buffer, self.pos).end())
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def error(self, message, path):
+        raise InvalidJSON(message, self.line, self.column, path)
+
+    def _incomplete(self, error):
+        # Whether decoding may have failed only because the value continues in the next piece
+        return not self.eof and (error.pos >= len(self.buffer) - 16 or error.msg.startswith('Unterminated string'))
+
+    def value(self, path):
+        """
+        Decode the value at the current position. Returns (value, end), or
+        None for a container too large to load, which is then indexed.
+        """
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A number cut at the end of the buffer may continue in the next piece
+                if isinstance(value, (dict, list)) and end - self.pos > self.node_bytes:
+                    return None
+                if self.eof or not (json_type(value) == 'number' and _NUMBER_TAIL.match(self.buffer, end)):
+                    return value, end
+            except json.JSONDecodeError as e:
+                if not self._incomplete(e):
+                    self.advance(max(e.pos, self.pos))
+                    self.error(e.msg, path)
+            if len(self.buffer) - self.pos > self.node_bytes and self.buffer[self.pos] in '[{':
+                return None
+            self.fill()
+
+    def string(self, path):
+        while True:
+            try:
+                return json.decoder.scanstring(self.buffer, self.pos + 1)
+            except json.JSONDecodeError as e:
+                if not self._incomplete(e):
+                    self.advance(max(e.pos, self.pos))
+                    self.error(e.msg, path)
+            self.fill()
+
+    def open(self, char, path, key_start):
+        self.stack.append(_Frame('array' if char == '[' else 'object', path, self.offset, key_start))
+        self.advance(self.pos + 1)
+
+    def close(self):
+        frame = self.stack.pop()
+        self.containers[frame.path] = {
+            'type': frame.kind,
+            'length': frame.length,
+            'start': frame.start,
+            'end': self.offset,
+            'records': self.index_records,  # Position of the first child in the index
+            'tabular': frame.kind == 'array' and frame.tabular and frame.length > 0,
+        }
+        frame.records.seek(0)
+        shutil.copyfileobj(frame.records, self.index)
+        frame.records.close()
+        self.index_records += frame.length
+        if self.stack:
+            self.add_child(self.stack[-1], frame.key_start, frame.start, frame.kind == 'object')
+
+    def add_child(self, frame, key_start, start, is_object):
+        frame.records.write(RECORD.pack(key_start, start, self.offset))
+        frame.length += 1
+        frame.tabular = frame.tabular and is_object
+        frame.expect = 'comma'
+
+    def parse_containers(self):
+        while self.stack:
+            frame = self.stack[-1]
+            char = self.peek()
+            closing = ']' if frame.kind == 'array' else '}'
+            if not char:
+                self.error('Unexpected end of file', frame.path)
+            elif frame.expect in ('first', 'comma') and char == closing:
+                self.advance(self.pos + 1)
+                self.close()
+            elif frame.expect == 'comma':
+                if char != ',':
+                    self.error(f"Expecting ',' or '{closing}'", frame.path)
+                self.advance(self.pos + 1)
+                frame.expect = 'key' if frame.kind == 'object' else 'value'
+            elif frame.kind == 'object' and frame.expect in ('first', 'key'):
+                if char != '"':
+                    self.error('Expecting property name enclosed in double quotes', frame.path)
+                frame.child_key_start = self.offset
+                frame.key, end = self.string(frame.path)
+                self.advance(end)
+                frame.expect = 'colon'
+            elif frame.expect == 'colon':
+                if char != ':':
+                    self.error("Expecting ':' delimiter", frame.path)
+                self.advance(self.pos + 1)
+                frame.expect = 'value'
+            else:
+                if frame.kind == 'array':
+                    frame.key = frame.length
+                path = f"{frame.path}/{escape_pointer(frame.key)}"
+                start = self.offset
+                result = self.value(path)
+                if result is None:
+                    self.open(char, path, frame.child_key_start)
+                else:
+                    value, end = result
+                    self.advance(end)
+                    self.add_child(frame, frame.child_key_start, start, isinstance(value, dict))
+
+
+def describe(value):
+    # How a value is listed as a child in a node listing
+    kind = json_type(value)
+    if kind in ('object', 'array'):
+        return {'type': kind, 'length': len(value)}
+    if kind == 'string' and len(value) > PREVIEW_CHARS:
+        return {'type': kind, 'value': value[:PREVIEW_CHARS], 'truncated': True}
+    return {'type': kind, 'value': value}
+
+
+_TYPES_BY_FIRST_BYTE = {ord('{'): 'object', ord('['): 'array', ord('"'): 'string',
+                        ord('t'): 'boolean', ord('f'): 'boolean', ord('n'): 'null'}
+
+
+class JSONReader:
+    """
+    Random access to a stored JSONDocument: a value by JSON pointer, pages
+    of a container's children and pages of table rows, reading only the
+    bytes they cover. Use as a context manager.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.data = document.file.storage.open(document.file.name, 'rb')
+        self.index = document.index.storage.open(document.index.name, 'rb')
+        # Paths of the containers that have indexed children, computed on first use
+        self._parents = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def _read(self, start, end):
+        self.data.seek(start)
+        return self.data.read(end - start)
+
+    def _load(self, start, end):
+        return json.loads(self._read(start, end))
+
+    def _records(self, info, offset, count):
+        count = max(min(count, info['length'] - offset), 0)
+        self.index.seek((info['records'] + offset) * RECORD.size)
+        return list(RECORD.iter_unpack(self.index.read(count * RECORD.size)))
+
+    def _children(self, info, offset=0, count=None):
+        # (key, start, end) of the children of an indexed container
+        remaining = max(info['length'] - offset, 0)
+        count = remaining if count is None else min(count, remaining)
+        for batch_start in range(offset, offset + count, RECORD_BATCH):
+            records = self._records(info, batch_start, min(RECORD_BATCH, offset + count - batch_start))
+            for position, (key_start, start, end) in enumerate(records, start=batch_start):
+                if key_start < 0:
+                    yield position, start, end
+                else:
+                    yield json.decoder.scanstring(self._read(key_start, start).decode('utf-8'), 1)[0], start, end
+
+    def _child_items(self, info, offset, count):
+        # (key, value) of the children of an indexed container, one read per batch of records
+        for batch_start in range(offset, offset + count, RECORD_BATCH):
+            records = self._records(info, batch_start, min(RECORD_BATCH, offset + count - batch_start))
+            if not records:
+                return
+            base = records[0][0] if records[0][0] >= 0 else records[0][1]
+            if records[-1][2] - base > BLOCK_BYTES:
+                # Large children (indexed ones among them): read one at a time
+                for key, start, end in self._children(info, batch_start, len(records)):
+                    yield key, self._load(start, end)
+                continue
+            block = self._read(base, records[-1][2])
+            for position, (key_start, start, end) in enumerate(records, start=batch_start):
+                if key_start >= 0:
+                    key = json.decoder.scanstring(block[key_start - base:start - base].decode('utf-8'), 1)[0]
+                else:
+                    key = position
+                yield key, json.loads(block[start - base:end - base])
+
+    def _locate(self, path):
+        """
+        Find the value at ``path``: returns (canonical path, container info,
+        None) for an indexed container and (canonical path, None, value)
+        otherwise. Raises NodeNotFound.
+        """
+        containers = self.document.containers
+        tokens = parse_pointer(path)
+        if '' not in containers:
+            return path, None, _walk(self._load(0, self.document.size), tokens, path)
+
+        current = ''
+        for position, token in enumerate(tokens):
+            key, start, end = self._find(containers[current], token, path)
+            current = f"{current}/{escape_pointer(key)}"
+            if current not in containers:
+                value = _walk(self._load(start, end), tokens[position + 1:], path)
+                return '/'.join([current] + [escape_pointer(token) for token in tokens[position + 1:]]), None, value
+        return current, containers[current], None
+
+    def _find(self, info, token, path):
+        if info['type'] == 'array':
+            if not token.isdigit() or int(token) >= info['length']:
+                raise NodeNotFound(path)
+            return next(self._children(info, int(token), 1))
+        for child in self._children(info):
+            if child[0] == token:
+                return child
+        raise NodeNotFound(path)
+
+    def _describe_child(self, path, start, end):
+        info = self.document.containers.get(path)
+        if info is not None:
+            return {'type': info['type'], 'length': info['length']}
+        if end - start <= PREVIEW_BYTES:
+            return describe(self._load(start, end))
+        return {'type': _TYPES_BY_FIRST_BYTE.get(self._read(start, start + 1)[0], 'number'), 'size': end - start}
+
+    def node(self, path, offset=0, limit=100):
+        """
+        The value at ``path`` for the tree view: a scalar's value, or one
+        page of a container's children, each with its type and either its
+        value or its length.
+        """
+        path, info, value = self._locate(path)
+        if info is None and json_type(value) not in ('object', 'array'):
+            return {'path': path, **describe(value)}
+
+        if info is not None:
+            kind, length, tabular = info['type'], info['length'], info['tabular']
+            children = [
+                {'key': key, 'path': f"{path}/{escape_pointer(key)}",
+                 **self._describe_child(f"{path}/{escape_pointer(key)}", start, end)}
+                for key, start, end in self._children(info, offset, limit)
+            ]
+        else:
+            kind, length = json_type(value), len(value)
+            tabular = kind == 'array' and length > 0 and all(isinstance(item, dict) for item in value)
+            items = value.items() if kind == 'object' else enumerate(value)
+            children = [
+                {'key': key, 'path': f"{path}/{escape_pointer(key)}", **describe(child)}
+                for key, child in itertools.islice(items, offset, offset + limit)
+            ]
+
+        return {
+            'path': path, 'type': kind, 'length': length, 'tabular': tabular, 'offset': offset,
+            'children': children, 'next_offset': offset + limit if offset + limit < length else None,
+        }
+
+    def _container(self, path, kind=None):
+        path, info, value = self._locate(path)
+        found = info['type'] if info is not None else json_type(value)
+        if found not in ((kind,) if kind else ('object', 'array')):
+            raise ValueError(f"{path or '/'} is not {'an ' + kind if kind else 'an array or object'}.")
+        return path, info, value
+
+    def length(self, path, kind=None):
+        _, info, value = self._container(path, kind)
+        return info['length'] if info is not None else len(value)
+
+    def items(self, path, offset=0, limit=None, kind=None):
+        """
+        Iterate over (key, value) for the children of the container at
+        ``path`` (which must be of ``kind`` if given), loading one child at
+        a time when it is indexed.
+        """
+        _, info, value = self._container(path, kind)
+        return self._items(info, value, offset, limit)
+
+    def _items(self, info, value, offset, limit):
+        if info is not None:
+            count = info['length'] - offset if limit is None else min(limit, info['length'] - offset)
+            return self._child_items(info, offset, max(count, 0))
+        items = value.items() if isinstance(value, dict) else enumerate(value)
+        return itertools.islice(items, offset, None if limit is None else offset + limit)
+
+    def value(self, path):
+        # The whole value at ``path``, however large
+        path, info, value = self._locate(path)
+        return self._load(info['start'], info['end']) if info is not None else value
+
+    def children(self, path):
+        """
+        Iterate over (key, path, value) for the children of the container
+        at ``path``. Children that are indexed containers themselves come
+        with their path instead of their value (None), so a document of any
+        size can be walked without loading more than one unindexed child.
+        """
+        path, info, value = self._container(path)
+        if info is None:
+            for key, child in self._items(None, value, 0, None):
+                yield key, None, child
+            return
+        if self._parents is None:
+            self._parents = {pointer.rsplit('/', 1)[0] for pointer in self.document.containers if pointer}
+        if path not in self._parents:
+            for key, child in self._child_items(info, 0, info['length']):
+                yield key, None, child
+            return
+        for key, start, end in self._children(info):
+            child_path = f"{path}/{escape_pointer(key)}"
+            if child_path in self.document.containers:
+                yield key, child_path, None
+            else:
+                yield key, None, self._load(start, end)
+
+    def rows(self, path, offset=0, limit=100):
+        """
+        One page of the array at ``path`` as a table: the columns are the
+        keys of the page's objects in order of appearance, and items that
+        aren't objects are shown in a 'value' column.
+        """
+        path, info, value = self._container(path, 'array')
+        total = info['length'] if info is not None else len(value)
+        records = [
+            item if isinstance(item, dict) else {'value': item}
+            for _, item in self._items(info, value, offset, limit)
+        ]
+        columns = list(dict.fromkeys(key for record in records for key in record))
+        return {
+            'path': path, 'total': total, 'offset': offset, 'columns': columns,
+            'rows': [[record.get(column) for column in columns] for record in records],
+            'next_offset': offset + limit if offset + limit < total else None,
+        }
+
+
+def _walk(value, tokens, path):
+    for token in tokens:
+        if isinstance(value, dict) and token in value:
+            value = value[token]
+        elif isinstance(value, list) and token.isdigit() and int(token) < len(value):
+            value = value[int(token)]
+        else:
+            raise NodeNotFound(path)
+    return value
@@ -0,0 +1,375 @@
+import bisect
+import json
+import math
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from django.conf import settings
+from .json_documents import JSONReader, json_type
+
+try:
+    import numpy as np
+except ImportError:  # optional; without it tables are sorted and filtered in pure Python
+    np = None
+
+FILTER_OPERATORS = ('eq', 'ne', 'lt', 'le', 'gt', 'ge', 'contains', 'exists', 'missing')
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max')
+# Where each type sorts within a column; nulls and missing values go last
+_TYPE_ORDER = {'number': 0, 'string': 1, 'boolean': 2, 'array': 3, 'object': 4, 'null': 5}
+_NULL_KEY = (_TYPE_ORDER['null'], 0)
+
+
+class TableError(ValueError):
+    pass
+
+
+_TYPES = {str: 'string', bool: 'boolean', int: 'number', float: 'number', list: 'array', dict: 'object'}
+_encode = json.JSONEncoder(sort_keys=True).encode
+
+
+def _sort_key(value):
+    # Exact types first: this runs once per cell while a table is built
+    kind = _TYPES.get(type(value)) or json_type(value)
+    if kind == 'null' or (kind == 'number' and value != value):
+        return _NULL_KEY
+    if kind in ('array', 'object'):
+        return (_TYPE_ORDER[kind], _encode(value))
+    return (_TYPE_ORDER[kind], value)
+
+
+def _key_value(key):
+    if key == _NULL_KEY:
+        return None
+    if key[0] in (_TYPE_ORDER['array'], _TYPE_ORDER['object']):
+        return json.loads(key[1])
+    return key[1]
+
+
+class Column:
+    """
+    One column of a Table, stored as its sorted distinct values plus, per
+    row, the rank of the row's value among them (nulls and missing keys
+    rank last). Sorting and filtering compare the integer ranks, so they
+    run as vectorized NumPy operations whatever the value types, and each
+    distinct value is held only once.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # While the table is built: first-seen ids of the values and the id of each row's value
+        self._ids = {}
+        self._row_ids = array('q')
+
+    def append(self, row, value):
+        # Store ``value`` for ``row``, filling the rows before it that lack this key
+        if len(self._row_ids) < row:
+            null_id = self._ids.setdefault(_NULL_KEY, len(self._ids))
+            self._row_ids.extend(array('q', [null_id]) * (row - len(self._row_ids)))
+        self._row_ids.append(self._ids.setdefault(_sort_key(value), len(self._ids)))
+
+    def finish(self, length):
+        if len(self._row_ids) < length:
+            self.append(length - 1, None)
+        keys = list(self._ids)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.distinct = [keys[value_id] for value_id in order]
+        ranks = [0] * len(keys)
+        for rank, value_id in enumerate(order):
+            ranks[value_id] = rank
+        if np is not None:
+            self.codes = np.asarray(ranks, dtype=np.int32)[np.frombuffer(self._row_ids, dtype=np.int64)]
+        else:
+            self.codes = [ranks[value_id] for value_id in self._row_ids]
+        del self._ids, self._row_ids
+        # Memory held by the distinct values (key tuples and the values in them)
+        self.distinct_bytes = sys.getsizeof(self.distinct) + sum(
+            sys.getsizeof(key) + sys.getsizeof(key[1]) for key in self.distinct
+        )
+
+        # Ranks from here on are nulls
+        self.null_start = bisect.bisect_left(self.distinct, _NULL_KEY)
+        types = sorted({key[0] for key in self.distinct[:self.null_start]})
+        names = {position: kind for kind, position in _TYPE_ORDER.items()}
+        self.kind = names[types[0]] if len(types) == 1 else ('mixed' if types else 'null')
+        self._numbers = None
+
+    def value(self, row):
+        return _key_value(self.distinct[self.codes[row]])
+
+    @property
+    def nbytes(self):
+        # Approximate memory of the column: codes and distinct values, plus the
+        # float copy that aggregates build on first use
+        per_row = (self.codes.itemsize if np is not None else 8) + 8
+        return self.distinct_bytes + per_row * len(self.codes)
+
+    @property
+    def numbers(self):
+        # The values as floats for aggregates, NaN where they aren't numbers
+        if self._numbers is None:
+            distinct = [float(key[1]) if key[0] == _TYPE_ORDER['number'] else math.nan for key in self.distinct]
+            if np is not None:
+                self._numbers = np.asarray(distinct, dtype=np.float64)[self.codes]
+            else:
+                self._numbers = [distinct[code] for code in self.codes]
+        return self._numbers
+
+    def _selection(self, operator, value):
+        # Ranks matching the filter, as a range or set, and whether to invert the match
+        if operator == 'exists':
+            return range(0, self.null_start), False
+        if operator == 'missing':
+            return range(self.null_start, len(self.distinct)), False
+        if operator == 'contains':
+            needle = str(value).lower()
+            return {rank for rank, key in enumerate(self.distinct[:self.null_start]) if needle in str(key[1]).lower()}, False
+
+        key = _sort_key(value)
+        position = bisect.bisect_left(self.distinct, key)
+        found = position < len(self.distinct) and self.distinct[position] == key
+        if operator in ('eq', 'ne'):
+            return ({position} if found else set()), operator == 'ne'
+
+        # Comparisons only match values of the same type
+        type_start = bisect.bisect_left(self.distinct, (key[0],))
+        type_stop = bisect.bisect_left(self.distinct, (key[0] + 1,))
+        after = position + 1 if found else position
+        return {
+            'lt': range(type_start, position),
+            'le': range(type_start, after),
+            'gt': range(after, type_stop),
+            'ge': range(position, type_stop),
+        }[operator], False
+
+    def mask(self, operator, value):
+        """
+        Which rows match ``operator value``: a boolean array, or a list
+        without NumPy.
+        """
+        if operator not in FILTER_OPERATORS:
+            raise TableError(f"Unknown filter operator '{operator}'; use one of {', '.join(FILTER_OPERATORS)}.")
+        selection, invert = self._selection(operator, value)
+        if np is not None:
+            if isinstance(selection, range):
+                matched = (self.codes >= selection.start) & (self.codes < selection.stop)
+            else:
+                matched = np.isin(self.codes, list(selection))
+            return ~matched if invert else matched
+        return [(code in selection) != invert for code in self.codes]
+
+
+class Table:
+    """
+    An array of JSON records held column by column. The columns are the
+    union of the records' keys in order of first appearance; items that
+    aren't objects go in a 'value' column.
+    """
+
+    def __init__(self, records):
+        columns = {}
+        count = 0
+        for record in records:
+            if not isinstance(record, dict):
+                record = {'value': record}
+            for key, value in record.items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = Column(key)
+                column.append(count, value)
+            count += 1
+        for column in columns.values():
+            column.finish(count)
+
+        self.length = count
+        self.columns = list(columns.values())
+        self._by_name = columns
+
+    @property
+    def nbytes(self):
+        # Approximate memory of the table, for sizing the per-worker cache
+        return sum(column.nbytes for column in self.columns)
+
+    def column(self, name):
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise TableError(f"Unknown column '{name}'.")
+
+    def select(self, filters=()):
+        """
+        Indices of the rows matching every (column, operator, value) filter,
+        in table order.
+        """
+        mask = None
+        for name, operator, value in filters:
+            matched = self.column(name).mask(operator, value)
+            if mask is None:
+                mask = matched
+            elif np is not None:
+                mask &= matched
+            else:
+                mask = [a and b for a, b in zip(mask, matched)]
+        if np is not None:
+            return np.arange(self.length) if mask is None else np.flatnonzero(mask)
+        return list(range(self.length)) if mask is None else [row for row, keep in enumerate(mask) if keep]
+
+    def sort(self, rows, name, descending=False):
+        # Stable, with nulls and missing values last in either direction
+        column = self.column(name)
+        if np is not None:
+            codes = column.codes[rows]
+            if descending:
+                codes = np.where(codes >= column.null_start, 1, -codes)
+            return rows[np.argsort(codes, kind='stable')]
+        codes = column.codes
+        if descending:
+            return sorted(rows, key=lambda row: 1 if codes[row] >= column.null_start else -codes[row])
+        return sorted(rows, key=codes.__getitem__)
+
+    def page(self, rows, offset, limit):
+        rows = rows[offset:offset + limit]
+        if np is not None:
+            rows = rows.tolist()
+        return [[column.value(row) for column in self.columns] for row in rows]
+
+    def aggregate(self, rows, aggregates, group_by=None):
+        """
+        Compute (function, column) aggregates over the given rows, per
+        distinct value of ``group_by`` if set. 'count' without a column
+        counts rows, with a column its non-null values; the other functions
+        use the numeric values only. Returns the result columns and one row
+        per group, in group order.
+        """
+        for function, name in aggregates:
+            if function not in AGGREGATES:
+                raise TableError(f"Unknown aggregate '{function}'; use one of {', '.join(AGGREGATES)}.")
+            if name is None and function != 'count':
+                raise TableError(f"'{function}' needs a column.")
+            if name is not None:
+                self.column(name)
+
+        names = [f"{function}({name})" if name else function for function, name in aggregates]
+        group_column = self.column(group_by) if group_by else None
+        if np is not None:
+            groups, results = self._aggregate_numpy(rows, aggregates, group_column)
+        else:
+            groups, results = self._aggregate_python(rows, aggregates, group_column)
+
+        columns = ([group_by] if group_by else []) + names
+        result_rows = [
+            ([group] if group_by else []) + [None if value is None or value != value else value for value in values]
+            for group, values in zip(groups, zip(*results))
+        ]
+        return columns, result_rows
+
+    def _aggregate_numpy(self, rows, aggregates, group_column):
+        if group_column is not None:
+            codes, first, inverse = np.unique(group_column.codes[rows], return_index=True, return_inverse=True)
+            groups = [group_column.value(row) for row in rows[first].tolist()]
+        else:
+            groups, inverse = [None], np.zeros(len(rows), dtype=np.int64)
+        size = len(groups)
+
+        results = []
+        for function, name in aggregates:
+            if function == 'count':
+                valid = None if name is None else self.column(name).codes[rows] < self.column(name).null_start
+                results.append(np.bincount(inverse, weights=valid, minlength=size).astype(np.int64).tolist())
+                continue
+            numbers = self.column(name).numbers[rows]
+            valid = ~np.isnan(numbers)
+            counts = np.bincount(inverse[valid], minlength=size)
+            if function in ('sum', 'mean'):
+                sums = np.bincount(inverse[valid], weights=numbers[valid], minlength=size)
+                values = sums if function == 'sum' else np.divide(sums, counts, out=np.full(size, np.nan), where=counts > 0)
+            else:
+                values = np.full(size, np.inf if function == 'min' else -np.inf)
+                (np.minimum if function == 'min' else np.maximum).at(values, inverse[valid], numbers[valid])
+                values[counts == 0] = np.nan
+            results.append(values.tolist())
+        return groups, results
+
+    def _aggregate_python(self, rows, aggregates, group_column):
+        if group_column is not None:
+            first = {}
+            for row in rows:
+                first.setdefault(group_column.codes[row], row)
+            order = sorted(first)
+            position = {code: index for index, code in enumerate(order)}
+            inverse = [position[group_column.codes[row]] for row in rows]
+            groups = [group_column.value(first[code]) for code in order]
+        else:
+            groups, inverse = [None], [0] * len(rows)
+
+        results = []
+        for function, name in aggregates:
+            values = [[] for _ in groups]
+            for group, row in zip(inverse, rows):
+                if name is None:
+                    values[group].append(1)
+                elif function == 'count':
+                    if self.column(name).codes[row] < self.column(name).null_start:
+                        values[group].append(1)
+                elif not math.isnan(self.column(name).numbers[row]):
+                    values[group].append(self.column(name).numbers[row])
+            if function == 'count':
+                results.append([len(group) for group in values])
+            elif function == 'sum':
+                results.append([math.fsum(group) for group in values])
+            elif function == 'mean':
+                results.append([math.fsum(group) / len(group) if group else None for group in values])
+            else:
+                results.append([(min if function == 'min' else max)(group) if group else None for group in values])
+        return groups, results
+
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def get_table(document, path):
+    """
+    The array at ``path`` of a stored JSONDocument as a Table, built on
+    first use. Each process keeps the most recently used tables up to
+    JSON_VIEWER_TABLE_CACHE_BYTES in total; a larger table isn't kept.
+    """
+    key = (document.pk, path)
+    with _tables_lock:
+        entry = _tables.pop(key, None)
+        if entry is not None:
+            _tables[key] = entry
+            return entry[0]
+
+    with JSONReader(document) as reader:
+        if reader.length(path, 'array') > settings.JSON_VIEWER_TABLE_MAX_ROWS:
+            raise TableError(f"The table view is limited to {settings.JSON_VIEWER_TABLE_MAX_ROWS} rows.")
+        table = Table(value for _, value in reader.items(path, kind='array'))
+
+    size = table.nbytes
+    if size > settings.JSON_VIEWER_TABLE_CACHE_BYTES:
+        return table
+    with _tables_lock:
+        _tables[key] = (table, size)
+        while sum(cached_size for _, cached_size in _tables.values()) > settings.JSON_VIEWER_TABLE_CACHE_BYTES:
+            _tables.popitem(last=False)
+    return table
+
+
+def parse_filter(text):
+    # 'column:operator:value', where the value is read as JSON when it parses
+    name, _, rest = text.partition(':')
+    operator, _, value = rest.partition(':')
+    if not name or not operator:
+        raise TableError(f"Invalid filter '{text}'; use column:operator:value.")
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return name, operator, value
+
+
+def parse_aggregate(text):
+    # 'function' or 'function:column'
+    function, _, name = text.partition(':')
+    return function, name or None
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import caches
+from .retrieval import CONTEXT_HEADER
+
+
+def _cache():
+    return caches[settings.LLM_CACHE_ALIAS]
+
+
+def _is_retrieval_context(message):
+    return str(message.get("content", "")).startswith(CONTEXT_HEADER)
+
+
+def _normalize_messages(messages, drop_retrieval=False):
+    # Trailing whitespace and line-ending style don't change the prompt
+    return [
+        {
+            "role": str(message.get("role", "")).strip().lower(),
+            "content": str(message.get("content", "")).replace("\r\n", "\n").strip(),
+        }
+        for message in messages
+        if not (drop_retrieval and _is_retrieval_context(message))
+    ]
+
+
+def sampling_params(temperature, max_tokens, top_k, top_p):
+    # The sampling settings of a request, normalized for cache keys
+    return {
+        "temperature": round(float(temperature), 4),
+        "max_tokens": int(max_tokens),
+        "top_k": int(top_k),
+        "top_p": round(float(top_p), 4),
+    }
+
+
+def response_cache_key(messages, model, temperature, max_tokens, top_k, top_p, response_format=None, username=None):
+    """
+    Hash of the normalized messages plus every parameter that affects the
+    completion. Identical questions with identical settings share one key.
+
+    Passages retrieved from the user's files and conversations change with
+    every message they save, so when ``username`` is given they are left out
+    of the hash and the key is scoped to that user instead: a repeated
+    question still finds its answer, but an answer built from one user's
+    private passages is never served to another. Without a username the
+    passages stay in the hash.
+    """
+    scoped = bool(username) and any(_is_retrieval_context(message) for message in messages)
+    key_data = {
+        "messages": _normalize_messages(messages, drop_retrieval=scoped),
+        "model": model,
+        **sampling_params(temperature, max_tokens, top_k, top_p),
+    }
+    if scoped:
+        key_data["user"] = username
+    if response_format:
+        # Only when set, so plain requests keep their existing keys
+        key_data["response_format"] = response_format
+    digest = hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+    return f"llm-response:{digest}"
+
+
+def _hit(cached, start):
+    return {
+        "content": cached["content"],
+        "elapsed_time": time.monotonic() - start,
+        "response_tokens": cached["response_tokens"],
+        "cache_hit": True,
+    }
+
+
+def _entry(response):
+    return {"content": response["content"], "response_tokens": response["response_tokens"]}
+
+
+# A broken cache backend must never take the ask page down, so cache errors count as misses.
+
+def get_cached_response(key):
+    start = time.monotonic()
+    try:
+        cached = _cache().get(key)
+    except Exception:
+        return None
+    return _hit(cached, start) if cached else None
+
+
+def cache_response(key, response):
+    try:
+        _cache().set(key, _entry(response))
+    except Exception:
+        pass
+
+
+async def aget_cached_response(key):
+    start = time.monotonic()
+    try:
+        cached = await _cache().aget(key)
+    except Exception:
+        return None
+    return _hit(cached, start) if cached else None
+
+
+async def acache_response(key, response):
+    try:
+        await _cache().aset(key, _entry(response))
+    except Exception:
+        pass
@@ -0,0 +1,120 @@
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from LLM_Metadata.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed N conversation rows and report latency and EXPLAIN plans of the app's "
+        "main Conversation queries with and without the composite indexes. "
+        "Everything runs in one transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Number of rows to seed.')
+        parser.add_argument('--users', type=int, default=100, help='Number of distinct usernames.')
+        parser.add_argument('--turns', type=int, default=10, help='User/assistant turns per conversation.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_create batch size.')
+        parser.add_argument('--no-explain', action='store_true', help='Skip printing EXPLAIN plans.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            sample = self._seed(options)
+            self._analyze()
+
+            after = self._measure(sample, options)
+            self._drop_indexes()
+            self._analyze()
+            before = self._measure(sample, options)
+
+            self.stdout.write('')
+            self.stdout.write(f"{'query':<28}{'no indexes (ms)':>18}{'indexes (ms)':>16}")
+            for name in after:
+                self.stdout.write(f"{name:<28}{before[name]['median_ms']:>18.2f}{after[name]['median_ms']:>16.2f}")
+
+            if not options['no_explain']:
+                for name in after:
+                    self.stdout.write(f"\n== {name} (no indexes)\n{before[name]['plan']}")
+                    self.stdout.write(f"== {name} (indexes)\n{after[name]['plan']}")
+
+            # Leave neither the seeded rows nor the dropped indexes behind
+            transaction.set_rollback(True)
+
+    def _seed(self, options):
+        rows, users, turns = options['rows'], options['users'], options['turns']
+        now = timezone.now()
+        batch = []
+        created = 0
+        sample = None
+        self.stdout.write(f"Seeding {rows} rows for {users} users...")
+
+        while created < rows:
+            conversation_id = uuid.uuid4()
+            username = f"bench-user-{(created // (turns * 2)) % users}"
+            if sample is None:
+                sample = {'username': username, 'conversation_id': conversation_id}
+            for turn in range(turns):
+                for role in ('user', 'assistant'):
+                    if created >= rows:
+                        break
+                    batch.append(Conversation(
+                        role=role,
+                        content=f"Benchmark {role} message {created}",
+                        username=username,
+                        conversation_id=conversation_id,
+                        timestamp=now - timedelta(seconds=rows - created),
+                        model_name='benchmark-model',
+                    ))
+                    created += 1
+            if len(batch) >= options['batch_size']:
+                Conversation.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Conversation.objects.bulk_create(batch)
+        return sample
+
+    def _queries(self, sample):
+        # The querysets the views and template filter actually run
+        return {
+            'history by username': Conversation.objects.filter(
+                username=sample['username']).order_by('-timestamp'),
+            'conversation by id': Conversation.objects.filter(
+                conversation_id=sample['conversation_id']).order_by('timestamp'),
+            'assistant by id and role': Conversation.objects.filter(
+                conversation_id=sample['conversation_id'], role='assistant')[:1],
+        }
+
+    def _measure(self, sample, options):
+        results = {}
+        for name, queryset in self._queries(sample).items():
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = {
+                'median_ms': statistics.median(timings),
+                'plan': '' if options['no_explain'] else queryset.explain(),
+            }
+        return results
+
+    def _drop_indexes(self):
+        with connection.cursor() as cursor:
+            for index in Conversation._meta.indexes:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(index.name)}")
+
+    def _analyze(self):
+        # Refresh planner statistics so the plans reflect the seeded data
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(Conversation._meta.db_table)}")
+            elif connection.vendor == 'sqlite':
+                cursor.execute("ANALYZE")
@@ -0,0 +1,79 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the database overhead of simulated requests: a new connection per "
+        "request (CONN_MAX_AGE=0) against reused connections with and without health "
+        "checks. Each request runs the same signals as a real one and a single query."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Simulated requests per mode.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to measure.')
+        parser.add_argument('--query', default='SELECT 1', help='SQL each request runs.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        configured = dict(connection.settings_dict)
+        reuse_age = configured['CONN_MAX_AGE'] or 60
+        modes = [
+            ('new connection per request', 0, False),
+            (f'reuse, health checks (max age {reuse_age})', reuse_age, True),
+            (f'reuse, no health checks (max age {reuse_age})', reuse_age, False),
+        ]
+        self.stdout.write(
+            f"Database {connection.vendor} {configured.get('HOST') or configured.get('NAME')}; configured "
+            f"CONN_MAX_AGE={configured['CONN_MAX_AGE']}, CONN_HEALTH_CHECKS={configured['CONN_HEALTH_CHECKS']}, "
+            f"DB_POOL_MODE={settings.DB_POOL_MODE}"
+        )
+
+        results = []
+        try:
+            for label, max_age, health_checks in modes:
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                connection.settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+                results.append((label, self._measure(connection, options)))
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = configured['CONN_MAX_AGE']
+            connection.settings_dict['CONN_HEALTH_CHECKS'] = configured['CONN_HEALTH_CHECKS']
+
+        self.stdout.write('')
+        self.stdout.write(f"{'mode':<44}{'median (ms)':>13}{'p95 (ms)':>11}{'connects':>10}")
+        for label, (timings, connects) in results:
+            self.stdout.write(
+                f"{label:<44}{statistics.median(timings) * 1000:>13.2f}"
+                f"{_percentile(timings, 0.95) * 1000:>11.2f}{connects:>10}"
+            )
+        baseline = statistics.median(results[0][1][0])
+        reused = statistics.median(results[1][1][0])
+        self.stdout.write(f"\nConnection reuse saves {(baseline - reused) * 1000:.2f} ms per request.")
+
+    def _measure(self, connection, options):
+        timings, connects = [], 0
+        for _ in range(options['requests']):
+            start = time.perf_counter()
+            # close_old_connections runs on both signals, as around a real request
+            request_started.send(sender=self.__class__)
+            if connection.connection is None:
+                connects += 1
+            with connection.cursor() as cursor:
+                cursor.execute(options['query'])
+                cursor.fetchall()
+            request_finished.send(sender=self.__class__)
+            timings.append(time.perf_counter() - start)
+        return timings, connects
+
+
+def _percentile(values, fraction):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
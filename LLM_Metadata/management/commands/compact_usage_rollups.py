@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from LLM_Metadata.models import Conversation
+from LLM_Metadata.rollups import prune_hourly_rollups, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the recent usage rollups from the stored answers and drop hourly "
+        "rollups past LLM_ROLLUP_HOURLY_RETENTION_DAYS. Run it periodically, e.g. hourly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='Rebuild the rollups of the last N days.')
+        parser.add_argument('--all', action='store_true', help='Rebuild from the oldest answer, e.g. to backfill.')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            oldest = Conversation.objects.filter(role='assistant').order_by('timestamp').values_list('timestamp', flat=True).first()
+            start = oldest or timezone.now()
+        else:
+            start = timezone.now() - timedelta(days=options['days'])
+
+        written = rebuild_rollups(start)
+        pruned = prune_hourly_rollups()
+        self.stdout.write(f"Rebuilt {written} rollups since {start:%Y-%m-%d}, pruned {pruned} hourly rollups.")
@@ -0,0 +1,53 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LLM_Metadata.exports import FORMATS, export_queryset, export_stream, parquet_available, parse_bound
+
+
+class Command(BaseCommand):
+    help = (
+        "Export conversation messages as NDJSON (one JSON object per line) or Parquet, "
+        "streamed in primary key order so memory use stays flat however many rows there are."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--output', '-o', help='File to write (default stdout, NDJSON only).')
+        parser.add_argument('--user', help='Only this username.')
+        parser.add_argument('--model', help='Only this model.')
+        parser.add_argument('--since', help='From this ISO date or datetime.')
+        parser.add_argument('--until', help='Up to, but not including, this ISO date or datetime.')
+        parser.add_argument('--chunk-size', type=int, help='Rows per query (default CONVERSATION_EXPORT_CHUNK_SIZE).')
+
+    def handle(self, *args, **options):
+        output_format = options['format']
+        if output_format == 'parquet':
+            if not parquet_available():
+                raise CommandError("Parquet export needs pyarrow (pip install pyarrow).")
+            if not options['output']:
+                raise CommandError("Parquet export needs --output.")
+        try:
+            since = parse_bound(options['since']) if options['since'] else None
+            until = parse_bound(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        messages = export_queryset(options['user'], options['model'], since, until)
+        started = time.monotonic()
+        written = 0
+        if options['output']:
+            mode, encoding = ('wb', None) if output_format == 'parquet' else ('w', 'utf-8')
+            with open(options['output'], mode, encoding=encoding) as f:
+                for part in export_stream(messages, output_format, options['chunk_size']):
+                    f.write(part)
+                    written += len(part)
+            self.stderr.write(
+                f"Wrote {written} {'bytes' if output_format == 'parquet' else 'characters'} to "
+                f"{options['output']} in {time.monotonic() - started:.1f}s"
+            )
+        else:
+            # Straight to stdout, bypassing the command's line-ending handling
+            for part in export_stream(messages, output_format, options['chunk_size']):
+                sys.stdout.write(part)
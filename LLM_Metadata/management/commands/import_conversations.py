@@ -0,0 +1,42 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LLM_Metadata.exports import import_records, parquet_available, read_ndjson, read_parquet
+
+
+class Command(BaseCommand):
+    help = (
+        "Import conversation messages from an export_conversations file (NDJSON, or Parquet "
+        "by its .parquet extension) with batched bulk inserts. Messages get new ids and are "
+        "added, not merged: importing the same file twice stores it twice."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Exported file, or '-' to read NDJSON from stdin.")
+        parser.add_argument('--format', choices=('ndjson', 'parquet'), help='Default: from the file extension.')
+        parser.add_argument('--batch-size', type=int, help='Messages per transaction (default CONVERSATION_IMPORT_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        path = options['file']
+        input_format = options['format'] or ('parquet' if path.endswith('.parquet') else 'ndjson')
+        if input_format == 'parquet' and not parquet_available():
+            raise CommandError("Parquet import needs pyarrow (pip install pyarrow).")
+
+        started = time.monotonic()
+        try:
+            if input_format == 'parquet':
+                counts = import_records(read_parquet(path, options['batch_size']), options['batch_size'])
+            elif path == '-':
+                counts = import_records(read_ndjson(sys.stdin), options['batch_size'])
+            else:
+                with open(path, encoding='utf-8') as f:
+                    counts = import_records(read_ndjson(f), options['batch_size'])
+        except (OSError, ValueError) as e:  # Includes InvalidRecord and unreadable Parquet
+            # Batches before the failing one are already committed
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"Imported {counts['messages']} messages and {counts['turns']} turns "
+            f"in {time.monotonic() - started:.1f}s"
+        )
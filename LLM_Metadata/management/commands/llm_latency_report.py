@@ -0,0 +1,69 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from LLM_Metadata.models import Conversation
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return None
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Report p50/p95/p99 latency, time to first byte and queue wait per model and "
+        "backend from the stored answers. Unlike /metrics this covers every worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Only answers from the last N days.')
+        parser.add_argument('--model', help='Only this model.')
+
+    def handle(self, *args, **options):
+        answers = Conversation.objects.filter(
+            role='assistant', timestamp__gte=timezone.now() - timedelta(days=options['days'])
+        )
+        if options['model']:
+            answers = answers.filter(model_name=options['model'])
+
+        groups = defaultdict(lambda: defaultdict(list))
+        rows = answers.values_list(
+            'model_name', 'backend', 'elapsed_time', 'ttfb', 'queue_wait', 'prompt_tokens', 'completion_tokens'
+        ).iterator(chunk_size=5000)
+        for model, backend, elapsed, ttfb, queue_wait, prompt_tokens, completion_tokens in rows:
+            group = groups[(model or '-', backend or '-')]
+            for name, value in (('latency', elapsed), ('ttfb', ttfb), ('queue', queue_wait),
+                                ('prompt', prompt_tokens), ('completion', completion_tokens)):
+                if value is not None:
+                    group[name].append(value)
+
+        if not groups:
+            self.stdout.write("No answers in the selected period.")
+            return
+
+        header = f"{'model':<28}{'backend':<14}{'count':>7}"
+        for name in ('latency', 'ttfb', 'queue'):
+            header += f"{name + ' p50/p95/p99 (s)':>26}"
+        header += f"{'avg tokens in/out':>20}"
+        self.stdout.write(header)
+
+        for (model, backend), group in sorted(groups.items()):
+            line = f"{model[:27]:<28}{backend[:13]:<14}{len(group['latency']):>7}"
+            for name in ('latency', 'ttfb', 'queue'):
+                values = sorted(group[name])
+                if values:
+                    line += f"{'/'.join(f'{percentile(values, p):.2f}' for p in (0.5, 0.95, 0.99)):>26}"
+                else:
+                    line += f"{'-':>26}"
+            averages = [
+                f"{sum(group[name]) / len(group[name]):.0f}" if group[name] else '-'
+                for name in ('prompt', 'completion')
+            ]
+            line += f"{'/'.join(averages):>20}"
+            self.stdout.write(line)
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from LLM_Metadata.fake_llm import FakeLLMServer
+from LLM_Metadata.utils import aquery_api, get_async_client, query_api
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the LLM client against a local fake LLM server and report how "
+        "many requests a single worker keeps in flight with the sync and async paths."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Number of async requests to send.')
+        parser.add_argument('--concurrency', type=int, default=200, help='Maximum concurrent async requests.')
+        parser.add_argument('--latency', type=float, default=1.0, help='Seconds the fake server takes per answer.')
+        parser.add_argument('--sync-requests', type=int, default=5, help='Number of requests for the sync baseline (0 to skip).')
+
+    def handle(self, *args, **options):
+        server = FakeLLMServer(latency=options['latency']).start()
+        os.environ['API_URL'] = server.url
+        self.stdout.write(f"Fake LLM server at {server.url} (latency {options['latency']:.2f}s)")
+
+        try:
+            if options['sync_requests']:
+                self._report('sync  query_api', server, self._run_sync(options['sync_requests']))
+            server.reset_stats()
+            self._report('async aquery_api', server, asyncio.run(
+                self._run_async(options['requests'], options['concurrency'])
+            ))
+        finally:
+            server.stop()
+
+    def _run_sync(self, count):
+        # A sync worker handles one request at a time, so the calls are sequential
+        latencies = []
+        errors = 0
+        start = time.monotonic()
+        for _ in range(count):
+            t0 = time.monotonic()
+            response = query_api([{'role': 'user', 'content': 'ping'}], 'fake-model')
+            latencies.append(time.monotonic() - t0)
+            errors += 'error' in response
+        return latencies, errors, time.monotonic() - start
+
+    async def _run_async(self, count, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                t0 = time.monotonic()
+                try:
+                    response = await aquery_api([{'role': 'user', 'content': 'ping'}], 'fake-model')
+                    errors += 'error' in response
+                except Exception:
+                    errors += 1
+                latencies.append(time.monotonic() - t0)
+
+        start = time.monotonic()
+        await asyncio.gather(*(one() for _ in range(count)))
+        wall = time.monotonic() - start
+        await get_async_client().aclose()
+        return latencies, errors, wall
+
+    def _report(self, label, server, result):
+        latencies, errors, wall = result
+        latencies = sorted(latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{label}: {len(latencies)} requests, {errors} errors, "
+            f"peak in flight {server.peak_in_flight}, {wall:.2f}s wall, "
+            f"{len(latencies) / wall:.1f} req/s, "
+            f"p50 {statistics.median(latencies):.3f}s, p95 {p95:.3f}s"
+        )
@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LLM_Metadata.schemas import SchemaError, add_schema_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Save a JSON Schema file as the next version of a named metadata schema, "
+        "e.g. `load_metadata_schema tensile-test media/file_uploads/sch.json`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name')
+        parser.add_argument('file')
+        parser.add_argument('--description', default='')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['file'], encoding='utf-8') as f:
+                schema = json.load(f)
+            metadata_schema = add_schema_version(options['name'], schema, description=options['description'])
+        except (OSError, ValueError, SchemaError) as e:  # ValueError covers JSONDecodeError
+            raise CommandError(str(e))
+        self.stdout.write(f"{metadata_schema.name} is at version {metadata_schema.version}.")
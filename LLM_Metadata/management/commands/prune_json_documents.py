@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from LLM_Metadata.json_documents import delete_json_document
+from LLM_Metadata.models import JSONDocument
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete JSON viewer documents uploaded more than JSON_VIEWER_RETENTION_DAYS ago, "
+        "with their stored files and indexes. Run it periodically, e.g. daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Keep documents of the last N days (default JSON_VIEWER_RETENTION_DAYS).')
+        parser.add_argument('--user', help='Only documents uploaded by this username.')
+
+    def handle(self, *args, **options):
+        days = settings.JSON_VIEWER_RETENTION_DAYS if options['days'] is None else options['days']
+        if days < 0:
+            raise CommandError("--days can't be negative.")
+
+        documents = JSONDocument.objects.filter(created_at__lt=timezone.now() - timedelta(days=days))
+        if options['user']:
+            documents = documents.filter(uploaded_by=options['user'])
+        deleted = freed = 0
+        for document in documents.iterator():
+            freed += document.size
+            delete_json_document(document)
+            deleted += 1
+        self.stdout.write(f"Deleted {deleted} JSON documents ({freed} bytes) older than {days} days.")
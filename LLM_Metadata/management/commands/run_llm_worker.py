@@ -0,0 +1,79 @@
+import os
+import socket
+import threading
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from LLM_Metadata.jobs import abandon_job, claim_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued LLM jobs. Each thread claims one job at a time from the database, "
+        "so several worker processes can share the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Jobs run concurrently by this process.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale jobs")
+        self.stdout.write(f"Worker {worker_name} running {options['threads']} threads")
+
+        threads = [
+            threading.Thread(target=self._loop, args=(f"{worker_name}/{i}", options), daemon=True)
+            for i in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping; running jobs will be requeued when they go stale")
+
+    def _loop(self, name, options):
+        idle_since = None
+        while True:
+            close_old_connections()
+            try:
+                job = claim_job(name)
+            except Exception as e:
+                self.stderr.write(f"{name}: could not claim a job: {e}")
+                time.sleep(options['poll_interval'])
+                continue
+
+            if job is None:
+                if options['burst']:
+                    return
+                if idle_since is None:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since > 60:
+                    # Cheap housekeeping while idle
+                    requeue_stale_jobs()
+                    idle_since = time.monotonic()
+                time.sleep(options['poll_interval'])
+                continue
+
+            idle_since = None
+            try:
+                job = run_job(job)
+            except Exception as e:
+                self.stderr.write(f"{name}: job {job.job_id} raised:\n{traceback.format_exc()}")
+                # A broken connection is replaced before the job is put back
+                close_old_connections()
+                try:
+                    job = abandon_job(job, f"{type(e).__name__}: {e}")
+                except Exception as e:
+                    # Requeued once it goes stale
+                    self.stderr.write(f"{name}: could not put back job {job.job_id}: {e}")
+                    continue
+            self.stdout.write(f"{name}: job {job.job_id} {job.status} (attempt {job.attempts})")
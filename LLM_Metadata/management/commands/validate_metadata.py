@@ -0,0 +1,102 @@
+import json
+import re
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from LLM_Metadata.models import Conversation, JSONDocument, MetadataSchema
+from LLM_Metadata.schemas import find_schema, get_validator, validate_document
+
+# A ```json fenced block in a model answer
+FENCED_JSON = re.compile(r'```(?:json)?\s*\n(.*?)\n\s*```', re.DOTALL)
+
+
+def parse_answer(content):
+    # The JSON in a model answer: the whole answer or its first fenced block
+    try:
+        return json.loads(content)
+    except ValueError:
+        match = FENCED_JSON.search(content)
+        if match is None:
+            raise
+        return json.loads(match.group(1))
+
+
+class Command(BaseCommand):
+    help = (
+        "Validate JSON files, stored JSON viewer documents or model answers against a "
+        "metadata schema and report every violation with its JSON path."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema', help='Name of the metadata schema.')
+        parser.add_argument('files', nargs='*', help='JSON files; a file holding a list is validated record by record.')
+        parser.add_argument('--schema-version', type=int, help='Schema version (default the latest).')
+        parser.add_argument('--document', action='append', default=[], help='Key of a stored JSON document.')
+        parser.add_argument('--answers', action='store_true', help='Validate the JSON in recent assistant answers.')
+        parser.add_argument('--days', type=int, default=7, help='With --answers, the last N days.')
+        parser.add_argument('--model', help='With --answers, only this model.')
+        parser.add_argument('--max-errors', type=int, default=20, help='Violations printed per record or document.')
+
+    def handle(self, *args, **options):
+        try:
+            metadata_schema = find_schema(options['schema'], options['schema_version'])
+        except MetadataSchema.DoesNotExist:
+            raise CommandError(f"No schema {options['schema']}" + (f" v{options['schema_version']}" if options['schema_version'] else ''))
+        validator = get_validator(metadata_schema)
+        self.max_errors = options['max_errors']
+        self.stdout.write(f"Validating against {metadata_schema}")
+        started = time.monotonic()
+        self.checked = self.invalid = 0
+
+        for path in options['files']:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    value = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"{path}: {e}")
+            records = enumerate(value) if isinstance(value, list) else [(None, value)]
+            for index, record in records:
+                self.report(path if index is None else f"{path}[{index}]", validator.errors(record))
+
+        for key in options['document']:
+            document = JSONDocument.objects.filter(key=key).first()
+            if document is None:
+                raise CommandError(f"No JSON document {key}")
+            result = validate_document(document, validator, max_errors=self.max_errors)
+            self.report(document.name, result['errors'], result['error_count'])
+
+        if options['answers']:
+            answers = Conversation.objects.filter(
+                role='assistant', timestamp__gte=timezone.now() - timedelta(days=options['days'])
+            )
+            if options['model']:
+                answers = answers.filter(model_name=options['model'])
+            not_json = 0
+            for answer_id, content in answers.values_list('id', 'content').iterator(chunk_size=2000):
+                try:
+                    value = parse_answer(content)
+                except ValueError:
+                    not_json += 1
+                    continue
+                self.report(f"answer {answer_id}", validator.errors(value))
+            self.stdout.write(f"{not_json} answers held no JSON.")
+
+        self.stdout.write(
+            f"{self.checked} checked, {self.checked - self.invalid} valid, {self.invalid} invalid "
+            f"in {time.monotonic() - started:.1f}s."
+        )
+        if self.invalid:
+            raise CommandError("Validation failed.", returncode=2)
+
+    def report(self, label, errors, count=None):
+        count = len(errors) if count is None else count
+        self.checked += 1
+        if not count:
+            return
+        self.invalid += 1
+        self.stdout.write(f"{label}: {count} problem(s)")
+        for error in errors[:self.max_errors]:
+            self.stdout.write(f"  {error['path'] or '/'}: {error['message']}")
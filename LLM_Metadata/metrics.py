@@ -0,0 +1,175 @@
+import bisect
+import threading
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+# Upper bounds of the semantic cache's cosine-similarity buckets
+SCORE_BUCKETS = (0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.875, 0.9, 0.925, 0.95, 0.975, 0.99, 1.0)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        series = self.series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+        position = bisect.bisect_left(self.buckets, value)
+        if position < len(self.buckets):
+            series[position] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(labels, le=_number(bound))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(labels, le="+Inf")} {series[-1]}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {_number(series[-2])}')
+            lines.append(f'{self.name}_count{_labels(labels)} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{_labels(labels)} {_number(value)}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def set(self, labels, value):
+        self.series[labels] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{_labels(labels)} {_number(value)}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_lock = threading.Lock()
+REQUESTS = Counter('llm_requests_total', 'LLM requests by model, backend and outcome.')
+DURATION = Histogram('llm_request_duration_seconds', 'Total time to a complete answer.')
+TTFB = Histogram('llm_time_to_first_byte_seconds', 'Time until the backend started answering.')
+QUEUE_WAIT = Histogram('llm_queue_wait_seconds', 'Time a job waited in the queue before a worker took it.')
+PROMPT_TOKENS = Counter('llm_prompt_tokens_total', 'Prompt tokens reported by the backends.')
+COMPLETION_TOKENS = Counter('llm_completion_tokens_total', 'Completion tokens reported by the backends.')
+EXTRACTIONS = Counter(
+    'llm_extractions_total',
+    'Metadata extractions by model, schema and outcome: direct, repaired (fixed locally), reasked, invalid or failed.'
+)
+EXTRACTION_REPAIRS = Counter('llm_extraction_repairs_total', 'Local repairs applied to extraction replies, by kind.')
+SEMANTIC_LOOKUPS = Counter('llm_semantic_cache_lookups_total', 'Semantic cache lookups by model and outcome (hit or miss).')
+SEMANTIC_SCORES = Histogram(
+    'llm_semantic_cache_score', 'Similarity of the nearest cached question, by model and outcome.', SCORE_BUCKETS
+)
+SEMANTIC_FALSE_HITS = Histogram(
+    'llm_semantic_cache_false_hit_score', 'Similarity of semantic cache hits that users reported as false.', SCORE_BUCKETS
+)
+SEMANTIC_INDEX_ENTRIES = Gauge('llm_semantic_cache_index_entries', 'Questions in this worker\'s semantic cache indexes.')
+SEMANTIC_INDEX_BYTES = Gauge('llm_semantic_cache_index_bytes', 'Memory held by this worker\'s semantic cache indexes.')
+METRICS = (
+    REQUESTS, DURATION, TTFB, QUEUE_WAIT, PROMPT_TOKENS, COMPLETION_TOKENS, EXTRACTIONS, EXTRACTION_REPAIRS,
+    SEMANTIC_LOOKUPS, SEMANTIC_SCORES, SEMANTIC_FALSE_HITS, SEMANTIC_INDEX_ENTRIES, SEMANTIC_INDEX_BYTES,
+)
+
+
+def record_request(model, backend, result):
+    """
+    Record one finished LLM request. ``result`` is what query_api and
+    friends return; failures only count towards llm_requests_total.
+    """
+    labels = (('model', model), ('backend', backend or 'none'))
+    with _lock:
+        REQUESTS.inc(labels + (('status', 'error' if 'error' in result else 'ok'),))
+        if 'error' in result:
+            return
+        DURATION.observe(labels, result.get('elapsed_time') or 0.0)
+        if result.get('ttfb') is not None:
+            TTFB.observe(labels, result['ttfb'])
+        if result.get('prompt_tokens'):
+            PROMPT_TOKENS.inc(labels, result['prompt_tokens'])
+        if result.get('completion_tokens'):
+            COMPLETION_TOKENS.inc(labels, result['completion_tokens'])
+
+
+def record_queue_wait(model, seconds):
+    with _lock:
+        QUEUE_WAIT.observe((('model', model),), seconds)
+
+
+def record_extraction(model, schema, outcome, repairs=()):
+    with _lock:
+        EXTRACTIONS.inc((('model', model), ('schema', schema), ('outcome', outcome)))
+        for kind in repairs:
+            EXTRACTION_REPAIRS.inc((('model', model), ('kind', kind)))
+
+
+def record_semantic_lookup(model, hit, score=None):
+    labels = (('model', model),)
+    outcome = (('outcome', 'hit' if hit else 'miss'),)
+    with _lock:
+        SEMANTIC_LOOKUPS.inc(labels + outcome)
+        if score is not None:
+            SEMANTIC_SCORES.observe(labels + outcome, score)
+
+
+def record_semantic_false_hit(model, score):
+    with _lock:
+        SEMANTIC_FALSE_HITS.observe((('model', model),), score)
+
+
+def record_semantic_index(entries, nbytes):
+    with _lock:
+        SEMANTIC_INDEX_ENTRIES.set((), entries)
+        SEMANTIC_INDEX_BYTES.set((), nbytes)
+
+
+def render():
+    # Prometheus text exposition format
+    with _lock:
+        lines = []
+        for metric in METRICS:
+            lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        for metric in METRICS:
+            metric.series.clear()
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0002_alter_conversation_conversation_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='cache_hit',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0003_conversation_cache_hit'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['username', '-timestamp'], name='conversations_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['conversation_id', 'timestamp'], name='conversations_conv_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['conversation_id', 'role', '-timestamp'], name='conversations_conv_role_idx'),
+        ),
+    ]
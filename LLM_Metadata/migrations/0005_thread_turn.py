@@ -0,0 +1,59 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0004_conversation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Thread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation_id', models.UUIDField(unique=True)),
+                ('username', models.CharField(max_length=100)),
+                ('turn_count', models.IntegerField(default=0)),
+                ('total_tokens', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_activity', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'conversation_threads',
+                'ordering': ['-last_activity'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Turn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=100)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tokens', models.IntegerField(default=0)),
+                ('assistant_message', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='answered_turn', to='LLM_Metadata.conversation')),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='LLM_Metadata.thread')),
+                ('user_message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='turn', to='LLM_Metadata.conversation')),
+            ],
+            options={
+                'db_table': 'conversation_turns',
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['username', '-last_activity'], name='threads_user_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='turn',
+            index=models.Index(fields=['username', '-timestamp'], name='turns_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='turn',
+            index=models.Index(fields=['thread', '-timestamp'], name='turns_thread_ts_idx'),
+        ),
+    ]
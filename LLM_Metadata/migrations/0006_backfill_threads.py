@@ -0,0 +1,96 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def _pair_turns(rows):
+    # rows are one conversation in (timestamp, id) order; a user message is answered
+    # by the next assistant message. Assistant rows without a question are skipped.
+    turns = []
+    pending = None
+    for row in rows:
+        if row['role'] == 'user':
+            if pending is not None:
+                turns.append((pending, None))
+            pending = row
+        elif pending is not None:
+            turns.append((pending, row))
+            pending = None
+    if pending is not None:
+        turns.append((pending, None))
+    return turns
+
+
+def backfill_threads(apps, schema_editor):
+    Conversation = apps.get_model('LLM_Metadata', 'Conversation')
+    Thread = apps.get_model('LLM_Metadata', 'Thread')
+    Turn = apps.get_model('LLM_Metadata', 'Turn')
+
+    rows = Conversation.objects.order_by('conversation_id', 'timestamp', 'id').values(
+        'id', 'role', 'username', 'conversation_id', 'timestamp', 'token_usage'
+    ).iterator(chunk_size=BATCH_SIZE)
+
+    groups = []
+
+    def flush():
+        threads = []
+        thread_turns = []
+        for conversation_rows in groups:
+            turns = _pair_turns(conversation_rows)
+            if not turns:
+                continue
+            last = turns[-1][1] or turns[-1][0]
+            threads.append(Thread(
+                conversation_id=conversation_rows[0]['conversation_id'],
+                username=conversation_rows[0]['username'],
+                turn_count=len(turns),
+                total_tokens=sum((answer or {}).get('token_usage') or 0 for _, answer in turns),
+                created_at=conversation_rows[0]['timestamp'],
+                last_activity=last['timestamp'],
+            ))
+            thread_turns.append(turns)
+
+        Thread.objects.bulk_create(threads)
+        # bulk_create doesn't return primary keys on every backend, so look them up
+        thread_ids = dict(Thread.objects.filter(
+            conversation_id__in=[thread.conversation_id for thread in threads]
+        ).values_list('conversation_id', 'id'))
+
+        Turn.objects.bulk_create([
+            Turn(
+                thread_id=thread_ids[thread.conversation_id],
+                user_message_id=question['id'],
+                assistant_message_id=answer['id'] if answer else None,
+                username=question['username'],
+                timestamp=(answer or question)['timestamp'],
+                tokens=(answer or {}).get('token_usage') or 0,
+            )
+            for thread, turns in zip(threads, thread_turns)
+            for question, answer in turns
+        ], batch_size=BATCH_SIZE)
+        groups.clear()
+
+    for row in rows:
+        if groups and groups[-1][0]['conversation_id'] == row['conversation_id']:
+            groups[-1].append(row)
+            continue
+        if len(groups) >= BATCH_SIZE:
+            flush()
+        groups.append([row])
+    if groups:
+        flush()
+
+
+def remove_threads(apps, schema_editor):
+    apps.get_model('LLM_Metadata', 'Thread').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0005_thread_turn'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_threads, remove_threads),
+    ]
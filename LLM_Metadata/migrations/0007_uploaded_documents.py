@@ -0,0 +1,57 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0006_backfill_threads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadedDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('kind', models.CharField(max_length=10)),
+                ('encoding', models.CharField(max_length=40)),
+                ('size', models.BigIntegerField(default=0)),
+                ('chunk_count', models.IntegerField(default=0)),
+                ('total_tokens', models.IntegerField(default=0)),
+                ('uploaded_by', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'uploaded_documents',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('content', models.TextField()),
+                ('tokens', models.IntegerField(default=0)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='LLM_Metadata.uploadeddocument')),
+            ],
+            options={
+                'db_table': 'document_chunks',
+                'ordering': ['document', 'index'],
+            },
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='document',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='LLM_Metadata.uploadeddocument'),
+        ),
+        migrations.AddConstraint(
+            model_name='documentchunk',
+            constraint=models.UniqueConstraint(fields=('document', 'index'), name='document_chunks_unique_index'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0007_uploaded_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('username', models.CharField(max_length=100)),
+                ('conversation_id', models.UUIDField()),
+                ('question', models.TextField()),
+                ('api_messages', models.JSONField()),
+                ('model_name', models.CharField(max_length=100)),
+                ('max_tokens', models.IntegerField()),
+                ('temperature', models.FloatField()),
+                ('top_k', models.IntegerField()),
+                ('top_p', models.FloatField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('assistant_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='LLM_Metadata.conversation')),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='LLM_Metadata.uploadeddocument')),
+            ],
+            options={
+                'db_table': 'llm_jobs',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after', 'created_at'], name='llm_jobs_claim_idx'), models.Index(fields=['model_name', 'status'], name='llm_jobs_model_status_idx')],
+            },
+        ),
+    ]
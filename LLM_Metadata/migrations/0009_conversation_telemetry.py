@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0008_llm_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='backend',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='completion_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='prompt_tokens',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='queue_wait',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='ttfb',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0009_conversation_telemetry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('username', models.CharField(max_length=100)),
+                ('model_name', models.CharField(max_length=100)),
+                ('requests', models.IntegerField(default=0)),
+                ('cache_hits', models.IntegerField(default=0)),
+                ('tokens', models.BigIntegerField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('completion_tokens', models.BigIntegerField(default=0)),
+                ('elapsed_time', models.FloatField(default=0)),
+            ],
+            options={
+                'db_table': 'usage_rollups',
+                'ordering': ['period', 'bucket'],
+                'indexes': [models.Index(fields=['username', 'period', 'bucket'], name='usage_rollups_user_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usagerollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'username', 'model_name'), name='usage_rollups_unique_key'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:52
+
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0010_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JSONDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(default=0)),
+                ('file', models.FileField(upload_to='json_documents/')),
+                ('index', models.FileField(upload_to='json_documents/')),
+                ('root_type', models.CharField(max_length=10)),
+                ('containers', models.JSONField(default=dict)),
+                ('uploaded_by', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'json_documents',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
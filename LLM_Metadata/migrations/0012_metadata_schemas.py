@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0011_json_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetadataSchema',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('schema', models.JSONField()),
+                ('description', models.TextField(blank=True)),
+                ('created_by', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'metadata_schemas',
+                'ordering': ['name', '-version'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='metadataschema',
+            constraint=models.UniqueConstraint(fields=('name', 'version'), name='metadata_schemas_name_version'),
+        ),
+    ]
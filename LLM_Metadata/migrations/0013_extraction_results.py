@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0012_metadata_schemas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractionResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=100)),
+                ('model_name', models.CharField(max_length=100)),
+                ('backend', models.CharField(blank=True, max_length=100)),
+                ('source', models.TextField()),
+                ('status', models.CharField(choices=[('valid', 'Valid'), ('invalid', 'Invalid'), ('failed', 'Failed')], max_length=10)),
+                ('data', models.JSONField(blank=True, null=True)),
+                ('raw_content', models.TextField(blank=True)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('repairs', models.JSONField(blank=True, default=list)),
+                ('attempts', models.PositiveSmallIntegerField(default=1)),
+                ('prompt_tokens', models.IntegerField(blank=True, null=True)),
+                ('completion_tokens', models.IntegerField(blank=True, null=True)),
+                ('elapsed_time', models.FloatField(default=0.0)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='extractions', to='LLM_Metadata.uploadeddocument')),
+                ('schema', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='extractions', to='LLM_Metadata.metadataschema')),
+            ],
+            options={
+                'db_table': 'extraction_results',
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['schema', 'timestamp'], name='extractions_schema_idx'), models.Index(fields=['username', 'timestamp'], name='extractions_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0013_extraction_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SemanticCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(blank=True, max_length=100)),
+                ('model_name', models.CharField(max_length=100)),
+                ('embedder', models.CharField(max_length=200)),
+                ('question', models.TextField()),
+                ('content', models.TextField()),
+                ('response_tokens', models.IntegerField(default=0)),
+                ('embedding', models.BinaryField()),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'semantic_cache_entries',
+            },
+        ),
+        migrations.CreateModel(
+            name='SemanticCacheHit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=100)),
+                ('model_name', models.CharField(max_length=100)),
+                ('score', models.FloatField()),
+                ('false_hit', models.BooleanField(default=False)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('entry', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='served', to='LLM_Metadata.semanticcacheentry')),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='semantic_hit', to='LLM_Metadata.conversation')),
+            ],
+            options={
+                'db_table': 'semantic_cache_hits',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='semanticcacheentry',
+            index=models.Index(fields=['model_name', 'username', 'embedder'], name='semantic_cache_scope_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='semanticcachehit',
+            index=models.Index(fields=['model_name', 'timestamp'], name='semantic_hits_model_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:26
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0014_semantic_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeepAlive',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('pings', models.BigIntegerField(default=0)),
+                ('touched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'health_keepalive',
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0015_health_keepalive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobModelLock',
+            fields=[
+                ('model_name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+            ],
+            options={
+                'db_table': 'llm_job_model_locks',
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0016_job_model_locks'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='jsondocument',
+            name='sha256',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='jsondocument',
+            constraint=models.UniqueConstraint(fields=('uploaded_by', 'sha256'), name='json_documents_unique_upload'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LLM_Metadata', '0017_json_documents_per_user'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='semanticcacheentry',
+            name='semantic_cache_scope_idx',
+        ),
+        migrations.AddField(
+            model_name='semanticcacheentry',
+            name='sampling',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='semanticcacheentry',
+            index=models.Index(fields=['model_name', 'username', 'embedder', 'sampling'], name='semantic_cache_scope_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 # myapp/models.py
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 import uuid
@@ -23,12 +24,390 @@ class Conversation(models.Model):
     top_k = models.IntegerField(null=True, blank=True)
     top_p = models.FloatField(null=True, blank=True)
     file_upload = models.FileField(upload_to='file_uploads/', null=True, blank=True)
+    cache_hit = models.BooleanField(default=False)  # Answer served from the response cache
+    # Request telemetry; token counts come from the backend's usage report
+    prompt_tokens = models.IntegerField(null=True, blank=True)
+    completion_tokens = models.IntegerField(null=True, blank=True)
+    ttfb = models.FloatField(null=True, blank=True)  # Seconds until the backend started answering
+    queue_wait = models.FloatField(null=True, blank=True)  # Seconds spent in the job queue
+    backend = models.CharField(max_length=100, null=True, blank=True)
+    document = models.ForeignKey(
+        'UploadedDocument', on_delete=models.SET_NULL, null=True, blank=True, related_name='messages'
+    )  # Ingested content of file_upload
     # file_upload_url = models.URLField(null=True, blank=True)  # Changed to store URL
     
     class Meta:
         db_table = 'conversations'
         ordering = ['-timestamp']
+        indexes = [
+            # History page: filter(username=...).order_by('-timestamp')
+            models.Index(fields=['username', '-timestamp'], name='conversations_user_ts_idx'),
+            # Ask page and prompt building: filter(conversation_id=...).order_by('timestamp')
+            models.Index(fields=['conversation_id', 'timestamp'], name='conversations_conv_ts_idx'),
+            # get_assistant_for_user: filter(conversation_id=..., role=...).first()
+            models.Index(fields=['conversation_id', 'role', '-timestamp'], name='conversations_conv_role_idx'),
+        ]
 
     def __str__(self):
         return f"{self.role} - {self.timestamp} - {self.username}"
-    
\ No newline at end of file
+    
+
+class Thread(models.Model):
+    """
+    One row per conversation_id, with running aggregates so a user's
+    conversations can be listed without touching the message rows.
+    """
+    conversation_id = models.UUIDField(unique=True)
+    username = models.CharField(max_length=100)
+    turn_count = models.IntegerField(default=0)
+    total_tokens = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_activity = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'conversation_threads'
+        ordering = ['-last_activity']
+        indexes = [
+            models.Index(fields=['username', '-last_activity'], name='threads_user_activity_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.conversation_id} - {self.username} - {self.turn_count} turns"
+
+
+class Turn(models.Model):
+    """
+    Links a user question to the assistant reply it received.
+    """
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='turns')
+    user_message = models.OneToOneField(Conversation, on_delete=models.CASCADE, related_name='turn')
+    assistant_message = models.OneToOneField(
+        Conversation, on_delete=models.SET_NULL, null=True, blank=True, related_name='answered_turn'
+    )
+    username = models.CharField(max_length=100)
+    timestamp = models.DateTimeField(default=timezone.now)  # Time of the reply (or question if unanswered)
+    tokens = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'conversation_turns'
+        ordering = ['-timestamp']
+        indexes = [
+            # History page: filter(username=...) in (timestamp, id) keyset order
+            models.Index(fields=['username', '-timestamp'], name='turns_user_ts_idx'),
+            # Ask page: the turns of one thread
+            models.Index(fields=['thread', '-timestamp'], name='turns_thread_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"Turn {self.pk} of {self.thread_id} - {self.timestamp}"
+
+
+class UploadedDocument(models.Model):
+    """
+    An uploaded context file, stored once per distinct content (sha256) as
+    token-bounded chunks so prompts only carry the relevant parts.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=10)  # csv, json or text
+    encoding = models.CharField(max_length=40)
+    size = models.BigIntegerField(default=0)
+    chunk_count = models.IntegerField(default=0)
+    total_tokens = models.IntegerField(default=0)
+    uploaded_by = models.CharField(max_length=100)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'uploaded_documents'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} - {self.chunk_count} chunks"
+
+
+class DocumentChunk(models.Model):
+    document = models.ForeignKey(UploadedDocument, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    content = models.TextField()
+    tokens = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'document_chunks'
+        ordering = ['document', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'index'], name='document_chunks_unique_index'),
+        ]
+
+    def __str__(self):
+        return f"Chunk {self.index} of {self.document_id}"
+
+
+class LLMJob(models.Model):
+    """
+    A queued question, answered by a run_llm_worker process instead of the
+    HTTP request. The prompt is built when the job is enqueued.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    username = models.CharField(max_length=100)
+    conversation_id = models.UUIDField()
+    question = models.TextField()
+    api_messages = models.JSONField()
+    model_name = models.CharField(max_length=100)
+    max_tokens = models.IntegerField()
+    temperature = models.FloatField()
+    top_k = models.IntegerField()
+    top_p = models.FloatField()
+    document = models.ForeignKey(UploadedDocument, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    assistant_message = models.ForeignKey(
+        Conversation, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    run_after = models.DateTimeField(default=timezone.now)  # Delays a retry
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'llm_jobs'
+        ordering = ['created_at']
+        indexes = [
+            # Workers claim the oldest runnable job
+            models.Index(fields=['status', 'run_after', 'created_at'], name='llm_jobs_claim_idx'),
+            # Running jobs per model, for the concurrency limit
+            models.Index(fields=['model_name', 'status'], name='llm_jobs_model_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.job_id} - {self.model_name} - {self.status}"
+
+
+class JobModelLock(models.Model):
+    """
+    One row per model that workers lock while claiming one of its jobs, so
+    counting its running jobs and claiming the next one can't interleave.
+    """
+    model_name = models.CharField(max_length=100, primary_key=True)
+
+    class Meta:
+        db_table = 'llm_job_model_locks'
+
+    def __str__(self):
+        return self.model_name
+
+
+class UsageRollup(models.Model):
+    """
+    Pre-aggregated usage per hour or day, user and model, kept up to date as
+    answers are saved (see rollups.py) so the usage dashboard never scans
+    the conversations table.
+    """
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()  # Start of the hour or day (UTC)
+    username = models.CharField(max_length=100)
+    model_name = models.CharField(max_length=100)
+    requests = models.IntegerField(default=0)
+    cache_hits = models.IntegerField(default=0)
+    tokens = models.BigIntegerField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    completion_tokens = models.BigIntegerField(default=0)
+    elapsed_time = models.FloatField(default=0)  # Sum, divide by requests for the average
+
+    class Meta:
+        db_table = 'usage_rollups'
+        ordering = ['period', 'bucket']
+        constraints = [
+            # Also serves the dashboard's filter(period=..., bucket__gte=...)
+            models.UniqueConstraint(fields=['period', 'bucket', 'username', 'model_name'], name='usage_rollups_unique_key'),
+        ]
+        indexes = [
+            # Dashboard of a single user
+            models.Index(fields=['username', 'period', 'bucket'], name='usage_rollups_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.bucket} - {self.username} - {self.model_name}"
+
+
+class JSONDocument(models.Model):
+    """
+    A JSON file uploaded to the JSON viewer, stored as UTF-8 next to an index
+    of where the children of its large containers start and end, so parts of
+    it can be read without loading the whole file (see json_documents.py).
+    """
+    key = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    sha256 = models.CharField(max_length=64)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    file = models.FileField(upload_to='json_documents/')
+    index = models.FileField(upload_to='json_documents/')
+    root_type = models.CharField(max_length=10)  # object, array, string, number, boolean or null
+    # JSON pointer of each indexed container -> type, length, byte range and position in the index
+    containers = models.JSONField(default=dict)
+    uploaded_by = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'json_documents'
+        ordering = ['-created_at']
+        constraints = [
+            # Each user has their own copy of a file, readable only by them
+            models.UniqueConstraint(fields=['uploaded_by', 'sha256'], name='json_documents_unique_upload'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} - {self.size} bytes"
+
+
+class MetadataSchema(models.Model):
+    """
+    One version of a named JSON Schema that uploaded JSON documents and
+    model-generated metadata are validated against (see schemas.py).
+    Versions are not edited: a changed schema is saved as the next version.
+    """
+    name = models.CharField(max_length=100)
+    version = models.PositiveIntegerField(default=1)
+    schema = models.JSONField()
+    description = models.TextField(blank=True)
+    created_by = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'metadata_schemas'
+        ordering = ['name', '-version']
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'version'], name='metadata_schemas_name_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+    def clean(self):
+        from .schemas import SchemaError, Validator
+        try:
+            Validator(self.schema)
+        except SchemaError as e:
+            raise ValidationError({'schema': str(e)})
+
+
+class ExtractionResult(models.Model):
+    """
+    Structured metadata extracted from a text by a model against a
+    MetadataSchema version (see extraction.py): the parsed JSON, whether it
+    validated, and how it was obtained.
+    """
+    STATUS_CHOICES = [
+        ('valid', 'Valid'),
+        ('invalid', 'Invalid'),  # Still failed validation after the re-asks
+        ('failed', 'Failed'),  # The backend returned no usable reply
+    ]
+
+    username = models.CharField(max_length=100)
+    schema = models.ForeignKey(MetadataSchema, on_delete=models.PROTECT, related_name='extractions')
+    model_name = models.CharField(max_length=100)
+    backend = models.CharField(max_length=100, blank=True)
+    source = models.TextField()
+    document = models.ForeignKey(UploadedDocument, on_delete=models.SET_NULL, null=True, blank=True, related_name='extractions')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    data = models.JSONField(null=True, blank=True)
+    raw_content = models.TextField(blank=True)  # The last reply, before any repair
+    errors = models.JSONField(default=list, blank=True)  # Violations left in data
+    repairs = models.JSONField(default=list, blank=True)  # Kinds of local repairs applied
+    attempts = models.PositiveSmallIntegerField(default=1)  # Requests made, re-asks included
+    prompt_tokens = models.IntegerField(null=True, blank=True)
+    completion_tokens = models.IntegerField(null=True, blank=True)
+    elapsed_time = models.FloatField(default=0.0)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'extraction_results'
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['schema', 'timestamp'], name='extractions_schema_idx'),
+            models.Index(fields=['username', 'timestamp'], name='extractions_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.schema} by {self.model_name} - {self.status}"
+
+
+class SemanticCacheEntry(models.Model):
+    """
+    An answer the semantic cache (semantic_cache.py) can serve to later
+    questions similar to ``question``. ``username`` is empty for entries
+    shared by all users.
+    """
+    username = models.CharField(max_length=100, blank=True)
+    model_name = models.CharField(max_length=100)
+    embedder = models.CharField(max_length=200)  # Dotted path of the embedder that produced embedding
+    # Sampling settings the answer was generated with (semantic_cache.sampling_key); only requests
+    # with the same settings are served it
+    sampling = models.CharField(max_length=100, blank=True)
+    question = models.TextField()
+    content = models.TextField()
+    response_tokens = models.IntegerField(default=0)
+    embedding = models.BinaryField()  # Normalized float32 vector
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'semantic_cache_entries'
+        indexes = [
+            # Index loading: filter(model_name=..., username=..., embedder=..., sampling=..., pk__gt=...)
+            models.Index(fields=['model_name', 'username', 'embedder', 'sampling'], name='semantic_cache_scope_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name}: {self.question[:50]}"
+
+
+class SemanticCacheHit(models.Model):
+    """
+    An answer served from a SemanticCacheEntry, with the similarity of the
+    two questions and whether the user reported it as a false hit.
+    """
+    message = models.OneToOneField(Conversation, on_delete=models.CASCADE, related_name='semantic_hit')
+    entry = models.ForeignKey(SemanticCacheEntry, on_delete=models.SET_NULL, null=True, blank=True, related_name='served')
+    username = models.CharField(max_length=100)
+    model_name = models.CharField(max_length=100)
+    score = models.FloatField()
+    false_hit = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'semantic_cache_hits'
+        indexes = [
+            models.Index(fields=['model_name', 'timestamp'], name='semantic_hits_model_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} {self.score:.3f}{' (false hit)' if self.false_hit else ''}"
+
+
+class KeepAlive(models.Model):
+    """
+    One row per pinger that health_check's POST updates in place, so
+    keep-alive writes never touch the conversations table.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    pings = models.BigIntegerField(default=0)
+    touched_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'health_keepalive'
+
+    def __str__(self):
+        return f"{self.name} at {self.touched_at}"
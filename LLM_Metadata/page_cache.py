@@ -0,0 +1,34 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Conversation, Thread, Turn
+
+
+def _version_key(username):
+    return f"history-version:{username}"
+
+
+def history_version(username):
+    """
+    Version of a user's conversation history, part of the cache key of the
+    history fragment. A new version is drawn whenever the history changes,
+    so fragments of older versions are never read again and expire.
+    """
+    return cache.get_or_set(_version_key(username), lambda: uuid.uuid4().hex, None)
+
+
+def invalidate_user_history(username):
+    # After commit, so no request renders the old rows under the new version
+    if settings.HISTORY_FRAGMENT_TTL:
+        transaction.on_commit(lambda: cache.delete(_version_key(username)))
+
+
+@receiver([post_save, post_delete], sender=Conversation)
+@receiver([post_save, post_delete], sender=Turn)
+@receiver(post_delete, sender=Thread)
+def _history_changed(sender, instance, **kwargs):
+    # Conversation.username is sometimes assigned a User, which saves as its username
+    invalidate_user_history(str(instance.username))
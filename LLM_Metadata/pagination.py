@@ -0,0 +1,40 @@
+import base64
+import binascii
+from datetime import datetime
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj):
+    raw = f"{obj.timestamp.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise InvalidCursor(cursor)
+
+
+def keyset_page(queryset, cursor=None, size=20):
+    """
+    Return up to ``size`` rows of ``queryset`` that come after ``cursor`` in
+    newest-first (timestamp, id) order, and the cursor of the next page
+    (None on the last page). Each page is a single indexed range scan, so
+    its cost doesn't depend on how far back the user has scrolled.
+    """
+    queryset = queryset.order_by('-timestamp', '-pk')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(queryset[:size + 1])
+    next_cursor = encode_cursor(rows[size - 1]) if len(rows) > size else None
+    return rows[:size], next_cursor
@@ -0,0 +1,262 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .context import count_tokens
+from .models import Conversation, DocumentChunk, UploadedDocument
+
+try:
+    import numpy as np
+except ImportError:  # optional; the vector backend needs it
+    np = None
+
+_WORD_RE = re.compile(r'\w+')
+# First line of the retrieved-passages message; the response cache leaves that message out of its key
+CONTEXT_HEADER = "Here are passages from your files and earlier conversations that may help:"
+# Question words would otherwise match every earlier question
+STOPWORDS = frozenset('''
+    a an and are as at be but by can could did do does for from had has have how i if in into is it its
+    me my no not of on or our so that the their them then there these they this to was we what when
+    where which who why will with would you your
+'''.split())
+
+
+def tokenize(text):
+    return [word for word in _WORD_RE.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory BM25 (Okapi) index. Only term statistics are kept; passage
+    text stays in the database.
+    """
+    k1 = 1.5
+    b = 0.75
+
+    def min_score(self):
+        return settings.LLM_RETRIEVAL_MIN_SCORE
+
+    def __init__(self):
+        self.postings = {}
+        self.lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add_many(self, items):
+        for key, text in items:
+            terms = Counter(tokenize(text))
+            self.lengths[key] = sum(terms.values())
+            self.total_length += self.lengths[key]
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[key] = frequency
+
+    def search(self, query, k, skip=None):
+        if not self.lengths:
+            return []
+        count = len(self.lengths)
+        average_length = self.total_length / count or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        min_score = self.min_score()
+        hits = ((key, score) for key, score in scores.items() if score >= min_score and not (skip and skip(key)))
+        return heapq.nlargest(k, hits, key=lambda hit: hit[1])
+
+
+class VectorIndex:
+    """
+    Cosine-similarity index over embeddings from LLM_RETRIEVAL_EMBEDDER, a
+    callable taking a list of texts and returning one vector per text.
+    """
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.keys = []
+        self.blocks = []
+        self.matrix = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def min_score(self):
+        return settings.LLM_RETRIEVAL_MIN_SIMILARITY
+
+    def add_many(self, items, batch_size=64):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                self._add_batch(batch)
+                batch = []
+        if batch:
+            self._add_batch(batch)
+
+    def _add_batch(self, batch):
+        vectors = np.asarray(self.embedder([text for _, text in batch]), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.blocks.append(vectors / np.where(norms == 0, 1, norms))
+        self.keys.extend(key for key, _ in batch)
+        self.matrix = None
+
+    def search(self, query, k, skip=None):
+        if not self.keys:
+            return []
+        if self.matrix is None:
+            # Stack the blocks added since the last search into one matrix
+            self.matrix = np.vstack(self.blocks)
+            self.blocks = [self.matrix]
+        vector = np.asarray(self.embedder([query])[0], dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1
+        scores = self.matrix @ vector
+        min_score = self.min_score()
+        hits = []
+        for position in np.argsort(-scores):
+            if scores[position] < min_score:
+                break
+            key = self.keys[position]
+            if skip and skip(key):
+                continue
+            hits.append((key, float(scores[position])))
+            if len(hits) >= k:
+                break
+        return hits
+
+
+def _new_index():
+    if settings.LLM_RETRIEVAL_EMBEDDER and np is not None:
+        return VectorIndex(import_string(settings.LLM_RETRIEVAL_EMBEDDER))
+    return BM25Index()
+
+
+class UserIndex:
+    """
+    The passages one user can retrieve from: chunks of their uploaded files
+    and their stored messages. Rows saved since the last refresh are added
+    on the next search, so the index never has to be rebuilt.
+    """
+
+    def __init__(self, username):
+        self.username = username
+        self.index = _new_index()
+        self.document_ids = set()
+        self.last_message_id = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        document_ids = set(Conversation.objects.filter(
+            username=self.username, document__isnull=False
+        ).values_list('document_id', flat=True).distinct())
+        document_ids.update(UploadedDocument.objects.filter(
+            uploaded_by=self.username
+        ).values_list('pk', flat=True))
+
+        new_documents = document_ids - self.document_ids
+        if new_documents:
+            chunks = DocumentChunk.objects.filter(
+                document_id__in=new_documents
+            ).values_list('pk', 'document_id', 'content')
+            self.index.add_many(
+                (('chunk', pk, document_id), content) for pk, document_id, content in chunks.iterator(chunk_size=500)
+            )
+            self.document_ids |= new_documents
+
+        messages = Conversation.objects.filter(
+            username=self.username, pk__gt=self.last_message_id
+        ).order_by('pk').values_list('pk', 'conversation_id', 'content')
+        new_messages = []
+        for pk, conversation_id, content in messages.iterator(chunk_size=500):
+            self.last_message_id = pk
+            new_messages.append((('message', pk, str(conversation_id)), content))
+        self.index.add_many(new_messages)
+
+    def search(self, question, k, skip=None):
+        with self.lock:
+            self.refresh()
+            return self.index.search(question, k, skip)
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_user_index(username):
+    # Least recently used user indexes are dropped beyond LLM_RETRIEVAL_MAX_INDEXES
+    with _indexes_lock:
+        index = _indexes.pop(username, None) or UserIndex(username)
+        _indexes[username] = index
+        while len(_indexes) > settings.LLM_RETRIEVAL_MAX_INDEXES:
+            _indexes.popitem(last=False)
+        return index
+
+
+def is_duplicate(question, text):
+    # Whether ``text`` is mostly the question's own words, e.g. an earlier copy of it
+    question_terms, terms = set(tokenize(question)), set(tokenize(text))
+    if not question_terms or not terms:
+        return False
+    return len(question_terms & terms) / len(question_terms | terms) >= settings.LLM_RETRIEVAL_DUPLICATE_OVERLAP
+
+
+def retrieve(username, question, k=None, exclude_conversation=None, exclude_document=None):
+    """
+    The top-k passages for ``question`` from the user's uploaded files and
+    past conversations, best first, as dicts with source, text and score.
+    Messages of ``exclude_conversation`` and chunks of ``exclude_document``
+    are skipped because the prompt already carries them, and so are
+    passages scoring below the index's minimum or repeating the question.
+    """
+    k = k or settings.LLM_RETRIEVAL_TOP_K
+    excluded = {('message', str(exclude_conversation)), ('chunk', exclude_document and exclude_document.pk)}
+    # Extra hits make up for the duplicates dropped below
+    hits = get_user_index(username).search(question, 2 * k, lambda key: (key[0], key[2]) in excluded)
+
+    chunk_ids = [key[1] for key, _ in hits if key[0] == 'chunk']
+    message_ids = [key[1] for key, _ in hits if key[0] == 'message']
+    chunks = DocumentChunk.objects.select_related('document').in_bulk(chunk_ids) if chunk_ids else {}
+    messages = Conversation.objects.in_bulk(message_ids) if message_ids else {}
+
+    passages = []
+    for (kind, pk, _), score in hits:
+        if len(passages) >= k:
+            break
+        # Rows deleted since they were indexed are skipped
+        if kind == 'chunk' and pk in chunks:
+            chunk = chunks[pk]
+            if not is_duplicate(question, chunk.content):
+                passages.append({'source': f"{chunk.document.name}, section {chunk.index + 1}",
+                                 'text': chunk.content, 'score': score})
+        elif kind == 'message' and pk in messages and not is_duplicate(question, messages[pk].content):
+            message = messages[pk]
+            passages.append({'source': f"earlier conversation, {message.role} on {message.timestamp:%Y-%m-%d}",
+                             'text': message.content, 'score': score})
+    return passages
+
+
+def retrieval_context_message(username, question, conversation_id=None, document=None):
+    """
+    A prompt message with the retrieved passages that fit in
+    LLM_RETRIEVAL_CONTEXT_TOKENS, or None when nothing relevant was found.
+    """
+    budget = settings.LLM_RETRIEVAL_CONTEXT_TOKENS
+    parts, used = [], 0
+    for passage in retrieve(username, question, exclude_conversation=conversation_id, exclude_document=document):
+        part = f"[{passage['source']}]\n{passage['text']}"
+        tokens = count_tokens(part)
+        if used + tokens > budget:
+            continue
+        parts.append(part)
+        used += tokens
+    if not parts:
+        return None
+    return {"role": "user", "content": CONTEXT_HEADER + "\n\n" + "\n\n".join(parts)}
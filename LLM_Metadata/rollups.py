@@ -0,0 +1,166 @@
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncHour
+from django.utils import timezone
+from .models import Conversation, UsageRollup
+
+PERIODS = ('hour', 'day')
+KEY_FIELDS = ('period', 'bucket', 'username', 'model_name')
+COUNTERS = ('requests', 'cache_hits', 'tokens', 'prompt_tokens', 'completion_tokens', 'elapsed_time')
+# Rows per upsert statement: at 10 parameters a row, 6000 rows stay under
+# PostgreSQL's limit of 65535 parameters per statement
+UPSERT_BATCH_ROWS = 6000
+
+
+def bucket_start(timestamp, period):
+    # Start of the UTC hour or day containing timestamp
+    timestamp = timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0) if period == 'day' else timestamp
+
+
+def _counters(answer):
+    return {
+        'requests': 1,
+        'cache_hits': 1 if answer.cache_hit else 0,
+        'tokens': answer.token_usage or 0,
+        'prompt_tokens': answer.prompt_tokens or 0,
+        'completion_tokens': answer.completion_tokens or 0,
+        'elapsed_time': answer.elapsed_time or 0.0,
+    }
+
+
+def record_usage(answers):
+    """
+    Add saved assistant messages to their hourly and daily rollups.
+    Answers sharing a bucket, user and model are summed first, so a batch
+    costs one upsert per UPSERT_BATCH_ROWS rollups, not one per answer.
+    """
+    totals = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for answer in answers:
+        for period in PERIODS:
+            key = (period, bucket_start(answer.timestamp, period), answer.username, answer.model_name or '')
+            for name, value in _counters(answer).items():
+                totals[key][name] += value
+    if totals:
+        _upsert(totals)
+
+
+def _upsert(totals):
+    # INSERT ... ON CONFLICT DO UPDATE adding to the stored counters, which
+    # bulk_create(update_conflicts=True) can't express. PostgreSQL and SQLite.
+    connection = connections[router.db_for_write(UsageRollup)]
+    quote = connection.ops.quote_name
+    table = quote(UsageRollup._meta.db_table)
+    bucket_field = UsageRollup._meta.get_field('bucket')
+    columns = KEY_FIELDS + COUNTERS
+    row = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    increments = ', '.join(f"{quote(name)} = {table}.{quote(name)} + excluded.{quote(name)}" for name in COUNTERS)
+
+    # Within the backend's own parameter limit too (SQLite's may be lower)
+    items = list(totals.items())
+    fields = [UsageRollup._meta.get_field(name) for name in columns]
+    batch_size = max(min(UPSERT_BATCH_ROWS, connection.ops.bulk_batch_size(fields, items)), 1)
+    # A single statement is atomic already; several share a transaction, so a failure adds none of them
+    atomic = transaction.atomic(using=connection.alias) if len(items) > batch_size else nullcontext()
+    with atomic, connection.cursor() as cursor:
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            params = []
+            for (period, bucket, username, model_name), counters in batch:
+                params += [period, bucket_field.get_db_prep_value(bucket, connection), username, model_name]
+                params += [counters[name] for name in COUNTERS]
+            sql = (
+                f"INSERT INTO {table} ({', '.join(quote(name) for name in columns)}) "
+                f"VALUES {', '.join([row] * len(batch))} "
+                f"ON CONFLICT ({', '.join(quote(name) for name in KEY_FIELDS)}) DO UPDATE SET {increments}"
+            )
+            cursor.execute(sql, params)
+
+
+def _aggregate(answers, period):
+    truncate = TruncHour if period == 'hour' else TruncDay
+    return answers.annotate(
+        rollup_bucket=truncate('timestamp', tzinfo=dt_timezone.utc),
+        rollup_model=Coalesce('model_name', Value(''))
+    ).values('rollup_bucket', 'username', 'rollup_model').annotate(
+        total_requests=Count('id'),
+        total_cache_hits=Count('id', filter=Q(cache_hit=True)),
+        total_tokens=Coalesce(Sum('token_usage'), 0),
+        total_prompt_tokens=Coalesce(Sum('prompt_tokens'), 0),
+        total_completion_tokens=Coalesce(Sum('completion_tokens'), 0),
+        total_elapsed_time=Coalesce(Sum('elapsed_time'), 0.0),
+    ).order_by()
+
+
+def rebuild_rollups(start):
+    """
+    Recompute every rollup from ``start`` (rounded down to a UTC day) on
+    from the stored answers, replacing what is there. Used to backfill and
+    to repair drift, e.g. after conversations were deleted; answers saved
+    while it runs may be missed until the next rebuild. Returns the number
+    of rollup rows written.
+    """
+    start = bucket_start(start, 'day')
+    answers = Conversation.objects.filter(role='assistant', timestamp__gte=start)
+
+    rows = []
+    for period in PERIODS:
+        for row in _aggregate(answers, period).iterator(chunk_size=5000):
+            rows.append(UsageRollup(
+                period=period, bucket=row['rollup_bucket'], username=row['username'], model_name=row['rollup_model'],
+                requests=row['total_requests'], cache_hits=row['total_cache_hits'], tokens=row['total_tokens'],
+                prompt_tokens=row['total_prompt_tokens'], completion_tokens=row['total_completion_tokens'],
+                elapsed_time=row['total_elapsed_time']
+            ))
+
+    with transaction.atomic():
+        UsageRollup.objects.filter(bucket__gte=start).delete()
+        UsageRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def prune_hourly_rollups(now=None):
+    """
+    Drop hourly rollups older than LLM_ROLLUP_HOURLY_RETENTION_DAYS; the
+    daily rows cover that range. Returns the number deleted.
+    """
+    cutoff = bucket_start((now or timezone.now()) - timedelta(days=settings.LLM_ROLLUP_HOURLY_RETENTION_DAYS), 'day')
+    deleted, _ = UsageRollup.objects.filter(period='hour', bucket__lt=cutoff).delete()
+    return deleted
+
+
+def usage_summary(start, period='day', username=None):
+    """
+    Everything the usage dashboard shows from ``start`` on, read from the
+    rollups only: totals, a series per bucket and breakdowns by model and
+    (without ``username``) by user.
+    """
+    rollups = UsageRollup.objects.filter(period=period, bucket__gte=bucket_start(start, period))
+    if username is not None:
+        rollups = rollups.filter(username=username)
+    # Annotations may not reuse the field names
+    sums = {f'total_{name}': Sum(name) for name in COUNTERS}
+
+    def grouped(field, order, limit=None):
+        rows = rollups.values(field).annotate(**sums).order_by(order)
+        return [_summary_row(row, field) for row in rows[:limit]]
+
+    return {
+        'totals': _summary_row(rollups.aggregate(**sums)),
+        'series': grouped('bucket', 'bucket'),
+        'models': grouped('model_name', '-total_tokens'),
+        'users': grouped('username', '-total_tokens', 20) if username is None else [],
+    }
+
+
+def _summary_row(row, field=None):
+    summary = {name: row[f'total_{name}'] or 0 for name in COUNTERS}
+    if field:
+        summary[field] = row[field]
+    summary['avg_elapsed_time'] = summary['elapsed_time'] / summary['requests'] if summary['requests'] else None
+    summary['cache_hit_rate'] = summary['cache_hits'] / summary['requests'] if summary['requests'] else None
+    return summary
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from django.conf import settings
+
+# Weight of the newest sample in a backend's latency average
+EWMA_ALPHA = 0.3
+# Seconds between checks while an async request waits for a free backend
+ASYNC_WAIT_INTERVAL = 0.05
+
+
+class Backend:
+    """
+    One OpenAI-compatible server from LLM_BACKENDS, with the load and health
+    state the router keeps for it in this process.
+    """
+
+    def __init__(self, name, url=None, key=None, key_env=None, models=None, max_concurrency=0, weight=1):
+        self.name = name
+        self._url = url
+        self._key = key
+        self.key_env = key_env
+        self.models = set(models) if models else None  # None serves every model
+        self.max_concurrency = max_concurrency  # 0 means unlimited
+        self.weight = weight or 1
+
+        self.in_flight = 0
+        self.latency_ewma = None
+        self.failures = 0
+        self.opened_at = None  # Circuit opened at (monotonic), None when closed
+        self.probing = False
+
+    @property
+    def url(self):
+        # The default backend follows API_URL so it can be changed at runtime
+        return self._url or os.getenv('API_URL')
+
+    def headers(self):
+        key = self._key or os.getenv(self.key_env or 'API_KEY')
+        return {"Authorization": f"Bearer {key}"}
+
+    def serves(self, model):
+        return self.models is None or model in self.models
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= settings.LLM_CIRCUIT_COOLDOWN:
+            return 'half-open'
+        return 'open'
+
+    def __repr__(self):
+        return f"<Backend {self.name} {self.state} in_flight={self.in_flight}>"
+
+
+class Router:
+    """
+    Picks a backend for each request: among healthy backends serving the
+    model and below their concurrency limit, the one with the lowest
+    weighted load, where load is in-flight requests ('least_in_flight') or
+    in-flight requests times the latency EWMA ('ewma'). A backend that fails
+    LLM_CIRCUIT_FAILURES times in a row is skipped for LLM_CIRCUIT_COOLDOWN
+    seconds, then gets a single probe request before it is trusted again.
+    When every backend is at its concurrency limit, requests wait up to
+    LLM_ROUTER_WAIT_TIMEOUT seconds for one to be released.
+    """
+
+    def __init__(self, backends, strategy='least_in_flight'):
+        self.backends = backends
+        self.strategy = strategy
+        self.lock = threading.Lock()
+        # Notified whenever a backend is released
+        self.released = threading.Condition(self.lock)
+
+    def _load(self, backend):
+        load = (backend.in_flight + 1) / backend.weight
+        if self.strategy == 'ewma':
+            # Backends without samples yet look as fast as the fastest one
+            known = [b.latency_ewma for b in self.backends if b.latency_ewma is not None]
+            load *= backend.latency_ewma if backend.latency_ewma is not None else min(known, default=1.0)
+        return load
+
+    def acquire(self, model, exclude=(), timeout=None):
+        """
+        Reserve a backend for one request. When the backends that could take
+        it are all at their max_concurrency, wait up to ``timeout`` seconds
+        (default LLM_ROUTER_WAIT_TIMEOUT) for one to be released. Returns
+        None when none frees up in time, or when no backend can take the
+        model at all. Every acquired backend must be released.
+        """
+        timeout = settings.LLM_ROUTER_WAIT_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self.released:
+            while True:
+                backend, full = self._claim(model, exclude)
+                remaining = deadline - time.monotonic()
+                if backend is not None or not full or remaining <= 0:
+                    return backend
+                self.released.wait(remaining)
+
+    async def aacquire(self, model, exclude=()):
+        # acquire() for the event loop, which mustn't block while it waits
+        deadline = time.monotonic() + settings.LLM_ROUTER_WAIT_TIMEOUT
+        while True:
+            with self.lock:
+                backend, full = self._claim(model, exclude)
+            remaining = deadline - time.monotonic()
+            if backend is not None or not full or remaining <= 0:
+                return backend
+            await asyncio.sleep(min(ASYNC_WAIT_INTERVAL, remaining))
+
+    def _claim(self, model, exclude):
+        # (reserved backend or None, whether a backend at its concurrency limit could take it later);
+        # called with the lock held
+        candidates = []
+        full = False
+        for backend in self.backends:
+            if backend in exclude or not backend.serves(model):
+                continue
+            state = backend.state
+            if state == 'open' or (state == 'half-open' and backend.probing):
+                continue
+            if backend.max_concurrency and backend.in_flight >= backend.max_concurrency:
+                full = True
+                continue
+            candidates.append(backend)
+        if not candidates:
+            return None, full
+
+        lowest = min(self._load(backend) for backend in candidates)
+        backend = random.choice([b for b in candidates if self._load(b) == lowest])
+        if backend.state == 'half-open':
+            backend.probing = True
+        backend.in_flight += 1
+        return backend, full
+
+    def release(self, backend, ok, elapsed=None):
+        with self.lock:
+            backend.in_flight -= 1
+            backend.probing = False
+            self.released.notify_all()
+            if ok:
+                backend.failures = 0
+                backend.opened_at = None
+                if elapsed is not None:
+                    backend.latency_ewma = elapsed if backend.latency_ewma is None else (
+                        EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * backend.latency_ewma
+                    )
+            else:
+                backend.failures += 1
+                if backend.opened_at is not None or backend.failures >= settings.LLM_CIRCUIT_FAILURES:
+                    # Trip the breaker, or keep it open after a failed probe
+                    backend.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                {
+                    'name': backend.name,
+                    'state': backend.state,
+                    'in_flight': backend.in_flight,
+                    'latency_ewma': backend.latency_ewma,
+                    'failures': backend.failures,
+                }
+                for backend in self.backends
+            ]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def _build_router():
+    backends = [Backend(**config) for config in settings.LLM_BACKENDS]
+    if not backends:
+        # No registry configured: a single backend at API_URL serving every model
+        backends = [Backend('default')]
+    return Router(backends, settings.LLM_ROUTER_STRATEGY)
+
+
+def get_router():
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = _build_router()
+    return _router
+
+
+def reset_router():
+    # Forget load and health state, e.g. after changing LLM_BACKENDS in tests
+    global _router
+    with _router_lock:
+        _router = None
+
+
+def model_choices():
+    """
+    Models offered by the ask form: LLM_MODELS entries served by at least
+    one configured backend.
+    """
+    backends = get_router().backends
+    return [(model, label) for model, label in settings.LLM_MODELS if any(b.serves(model) for b in backends)]
+
+
+def default_model():
+    return settings.LLM_MODELS[0][0]
+
+
+def is_backend_failure(result):
+    """
+    Whether a failed result says something about the backend's health (so
+    the request may be retried elsewhere) rather than about the request.
+    """
+    if 'error' not in result:
+        return False
+    status = result.get('status_code')
+    return status is None or status == 200 or status == 429 or status >= 500
@@ -0,0 +1,677 @@
+import ipaddress
+import math
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, time
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from .models import MetadataSchema
+from .json_documents import JSONReader, escape_pointer, json_type, parse_pointer
+
+# Keywords that describe rather than constrain a value
+ANNOTATIONS = frozenset((
+    '$schema', '$id', '$anchor', '$comment', '$defs', 'definitions', 'title', 'description', 'default',
+    'examples', 'deprecated', 'readOnly', 'writeOnly', 'contentEncoding', 'contentMediaType', 'contentSchema',
+))
+UNSUPPORTED = frozenset((
+    '$dynamicRef', '$dynamicAnchor', '$recursiveRef', '$recursiveAnchor', 'unevaluatedProperties', 'unevaluatedItems',
+))
+# A container whose schema uses only these can be checked child by child,
+# without loading it; any other keyword needs the whole value
+STREAMABLE = frozenset((
+    'type', 'properties', 'patternProperties', 'additionalProperties', 'propertyNames', 'required',
+    'dependentRequired', 'minProperties', 'maxProperties', 'items', 'prefixItems', 'additionalItems',
+    'minItems', 'maxItems', 'minLength', 'maxLength', 'pattern', 'format', 'minimum', 'maximum',
+    'exclusiveMinimum', 'exclusiveMaximum', 'multipleOf',
+)) | ANNOTATIONS
+
+_PYTHON_TYPES = {
+    'null': (type(None),), 'boolean': (bool,), 'object': (dict,), 'array': (list,),
+    'string': (str,), 'number': (int, float), 'integer': (int,),
+}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _is_number(value):
+    return type(value) in (int, float)
+
+
+def _is_count(value):
+    # Non-negative integers; 2.0 counts as 2
+    return _is_number(value) and value >= 0 and (type(value) is int or value.is_integer())
+
+
+def _is_names(value):
+    return type(value) is list and all(type(name) is str for name in value)
+
+
+# What each keyword's value must be: (test, description)
+KEYWORD_TYPES = {
+    '$ref': (lambda value: type(value) is str, 'a string'),
+    'type': (lambda value: type(value) is str or _is_names(value), 'a string or an array of strings'),
+    'enum': (lambda value: type(value) is list, 'an array'),
+    'pattern': (lambda value: type(value) is str, 'a string'),
+    'format': (lambda value: type(value) is str, 'a string'),
+    'properties': (lambda value: type(value) is dict, 'an object'),
+    'patternProperties': (lambda value: type(value) is dict, 'an object'),
+    'dependentSchemas': (lambda value: type(value) is dict, 'an object'),
+    'dependencies': (lambda value: type(value) is dict and all(
+        type(item) is not list or _is_names(item) for item in value.values()), 'an object of schemas or arrays of strings'),
+    'dependentRequired': (lambda value: type(value) is dict and all(_is_names(item) for item in value.values()),
+                          'an object of arrays of strings'),
+    'required': (_is_names, 'an array of strings'),
+    'allOf': (lambda value: type(value) is list and value, 'a non-empty array'),
+    'anyOf': (lambda value: type(value) is list and value, 'a non-empty array'),
+    'oneOf': (lambda value: type(value) is list and value, 'a non-empty array'),
+    'prefixItems': (lambda value: type(value) is list, 'an array'),
+    'uniqueItems': (lambda value: type(value) is bool, 'a boolean'),
+    'minimum': (_is_number, 'a number'),
+    'maximum': (_is_number, 'a number'),
+    # A boolean in draft 4
+    'exclusiveMinimum': (lambda value: _is_number(value) or type(value) is bool, 'a number'),
+    'exclusiveMaximum': (lambda value: _is_number(value) or type(value) is bool, 'a number'),
+    **{keyword: (_is_count, 'a non-negative integer') for keyword in (
+        'minLength', 'maxLength', 'minProperties', 'maxProperties', 'minItems', 'maxItems', 'minContains', 'maxContains',
+    )},
+}
+
+
+def _count(schema, keyword, default=None):
+    # A count keyword as an int; compile() has checked it is one
+    return int(schema[keyword]) if keyword in schema else default
+
+
+def _canonical(value):
+    # Hashable form of a JSON value in which 1 == 1.0 but True != 1
+    kind = type(value)
+    if kind is bool:
+        return ('boolean', value)
+    if kind is dict:
+        return ('object', frozenset((key, _canonical(item)) for key, item in value.items()))
+    if kind is list:
+        return ('array', tuple(_canonical(item) for item in value))
+    return (json_type(value), value)
+
+
+def _pointer(path):
+    # Errors carry their location as nested (parent, key) pairs, formatted only when reported
+    tokens = []
+    while path is not None:
+        path, key = path
+        tokens.append(escape_pointer(key))
+    return ''.join('/' + token for token in reversed(tokens))
+
+
+def _short(value):
+    text = repr(value)
+    return text if len(text) <= 60 else text[:57] + '...'
+
+
+def _date_time(value):
+    match = re.fullmatch(r'\d{4}-\d{2}-\d{2}[Tt]\d{2}:\d{2}:\d{2}(\.\d+)?([Zz]|[+-]\d{2}:\d{2})', value)
+    try:
+        return bool(match) and bool(datetime.fromisoformat(value.upper().replace('Z', '+00:00')))
+    except ValueError:
+        return False
+
+
+def _parses(parse, pattern=None):
+    def check(value):
+        if pattern and not re.fullmatch(pattern, value):
+            return False
+        try:
+            parse(value)
+        except ValueError:
+            return False
+        return True
+    return check
+
+
+# Formats that are checked; others are annotations only
+FORMATS = {
+    'date-time': _date_time,
+    'date': _parses(date.fromisoformat, r'\d{4}-\d{2}-\d{2}'),
+    'time': _parses(time.fromisoformat, r'\d{2}:\d{2}:\d{2}(\.\d+)?([Zz]|[+-]\d{2}:\d{2})?'),
+    'email': lambda value: re.fullmatch(r'[^@\s]+@[^@\s]+\.[^@\s]+', value) is not None,
+    'uri': lambda value: bool(urlsplit(value).scheme) and not re.search(r'\s', value),
+    'uuid': _parses(uuid.UUID, r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'),
+    'ipv4': _parses(ipaddress.IPv4Address),
+    'ipv6': _parses(ipaddress.IPv6Address),
+}
+
+# additionalProperties/items: false
+FORBIDDEN = object()
+
+
+class _Node:
+    """
+    A compiled (sub)schema. Keywords on the whole value become a list of
+    checks; object and array keywords are kept as attributes so that large
+    stored containers can also be checked one child at a time.
+    """
+
+    def __init__(self, pointer):
+        self.pointer = pointer
+        self.types = None
+        self.python_types = ()
+        self.integer = False
+        self.checks = []
+        self.enum = None
+        self.streamable = True
+        self.has_object = self.has_array = False
+        self.properties = {}
+        self.pattern_properties = []
+        self.additional_properties = None
+        self.property_names = None
+        self.required = ()
+        self.dependent_required = {}
+        self.min_properties = self.max_properties = None
+        self.prefix_items = []
+        self.items = None
+        self.min_items = self.max_items = None
+
+    def validate(self, value, path, errors):
+        # Append an error (path, keyword, message) for each violation
+        if self.types is not None and type(value) not in self.python_types and not (
+                self.integer and type(value) is float and value.is_integer()):
+            errors.append((path, 'type', f"{_short(value)} is not of type {' or '.join(self.types)}"))
+        for check in self.checks:
+            check(value, path, errors)
+        if self.has_object and type(value) is dict:
+            properties = self.properties
+            for key, child in value.items():
+                node = properties.get(key)
+                if node is not None and not self.pattern_properties:
+                    node.validate(child, (path, key), errors)
+                else:
+                    for node in self.property_nodes(key, path, errors):
+                        node.validate(child, (path, key), errors)
+            self.check_object(value.keys(), path, errors)
+        elif self.has_array and type(value) is list:
+            self.check_array(len(value), path, errors)
+            for index, child in enumerate(value):
+                node = self.item_node(index)
+                if node is not None and node is not FORBIDDEN:
+                    node.validate(child, (path, index), errors)
+
+    def property_nodes(self, key, path, errors):
+        # The schemas the property ``key`` must match
+        nodes = []
+        node = self.properties.get(key)
+        if node is not None:
+            nodes.append(node)
+        for regex, node in self.pattern_properties:
+            if regex.search(key):
+                nodes.append(node)
+        if not nodes and self.additional_properties is not None:
+            if self.additional_properties is FORBIDDEN:
+                errors.append(((path, key), 'additionalProperties', f"Additional property '{key}' is not allowed"))
+            else:
+                nodes.append(self.additional_properties)
+        return nodes
+
+    def check_object(self, keys, path, errors):
+        # Keywords on an object's keys (a set or a dict's keys)
+        for name in self.required:
+            if name not in keys:
+                errors.append((path, 'required', f"'{name}' is a required property"))
+        for name, dependents in self.dependent_required.items():
+            if name in keys:
+                for dependent in dependents:
+                    if dependent not in keys:
+                        errors.append((path, 'dependentRequired', f"'{dependent}' is required when '{name}' is present"))
+        if self.min_properties is not None and len(keys) < self.min_properties:
+            errors.append((path, 'minProperties', f"Expected at least {self.min_properties} properties, got {len(keys)}"))
+        if self.max_properties is not None and len(keys) > self.max_properties:
+            errors.append((path, 'maxProperties', f"Expected at most {self.max_properties} properties, got {len(keys)}"))
+        if self.property_names is not None:
+            for key in keys:
+                self.property_names.validate(key, path, errors)
+
+    def item_node(self, index):
+        return self.prefix_items[index] if index < len(self.prefix_items) else self.items
+
+    def check_array(self, length, path, errors):
+        if self.min_items is not None and length < self.min_items:
+            errors.append((path, 'minItems', f"Expected at least {self.min_items} items, got {length}"))
+        if self.max_items is not None and length > self.max_items:
+            errors.append((path, 'maxItems', f"Expected at most {self.max_items} items, got {length}"))
+        if self.items is FORBIDDEN and length > len(self.prefix_items):
+            errors.append((path, 'items', f"Expected at most {len(self.prefix_items)} items, got {length}"))
+
+
+def _matches(node, value, path):
+    errors = []
+    node.validate(value, path, errors)
+    return not errors
+
+
+class _Compiler:
+    # Turns a schema into _Nodes once; local $refs resolve to the node of their target
+
+    def __init__(self, root):
+        self.root = root
+        self.nodes = {}
+        self.resolving = set()
+
+    def resolve(self, ref):
+        if not ref.startswith('#'):
+            raise SchemaError(f"Only local $refs are supported, got '{ref}'.")
+        pointer = ref[1:]
+        if pointer in self.nodes:
+            return self.nodes[pointer]
+        target = self.root
+        try:
+            for token in parse_pointer(pointer):
+                target = target[int(token)] if isinstance(target, list) else target[token]
+        except (LookupError, ValueError, TypeError):
+            raise SchemaError(f"Unresolvable $ref '{ref}'.")
+        return self.compile(target, pointer)
+
+    def compile(self, schema, pointer=''):
+        if pointer in self.nodes:
+            return self.nodes[pointer]
+        if schema is True or schema == {}:
+            node = self.nodes[pointer] = _Node(pointer)
+            return node
+        if schema is False:
+            node = self.nodes[pointer] = _Node(pointer)
+            node.checks.append(lambda value, path, errors: errors.append((path, 'false', 'No value is allowed here')))
+            return node
+        if not isinstance(schema, dict):
+            raise SchemaError(f"Schema at '{pointer or '/'}' must be an object or a boolean.")
+        unsupported = UNSUPPORTED.intersection(schema)
+        if unsupported:
+            raise SchemaError(f"Unsupported keyword {', '.join(sorted(unsupported))} at '{pointer or '/'}'.")
+        # Checked here, so that a mistyped keyword fails now rather than on every value
+        for keyword in KEYWORD_TYPES.keys() & schema.keys():
+            valid, expected = KEYWORD_TYPES[keyword]
+            if not valid(schema[keyword]):
+                raise SchemaError(f"{keyword} at '{pointer or '/'}' must be {expected}.")
+
+        # A schema that is only a $ref is its target
+        if '$ref' in schema and not set(schema) - ANNOTATIONS - {'$ref'}:
+            if pointer in self.resolving:
+                raise SchemaError(f"Circular $ref at '{pointer or '/'}'.")
+            self.resolving.add(pointer)
+            node = self.nodes[pointer] = self.resolve(schema['$ref'])
+            self.resolving.discard(pointer)
+            return node
+
+        node = self.nodes[pointer] = _Node(pointer)
+        node.streamable = STREAMABLE.issuperset(schema)
+        try:
+            self._compile_keywords(node, schema, pointer)
+        except (TypeError, ValueError, re.error) as e:
+            if isinstance(e, SchemaError):
+                raise
+            raise SchemaError(f"Invalid schema at '{pointer or '/'}': {e}")
+        return node
+
+    def child(self, schema, pointer, *tokens):
+        return self.compile(schema, pointer + ''.join('/' + escape_pointer(token) for token in tokens))
+
+    def _compile_keywords(self, node, schema, pointer):
+        checks = node.checks
+        if 'type' in schema:
+            types = [schema['type']] if isinstance(schema['type'], str) else schema['type']
+            unknown = [name for name in types if name not in _PYTHON_TYPES]
+            if unknown:
+                raise SchemaError(f"Unknown type {', '.join(unknown)} at '{pointer or '/'}'.")
+            node.types = types
+            node.python_types = {python_type for name in types for python_type in _PYTHON_TYPES[name]}
+            node.integer = 'integer' in types and 'number' not in types
+        if '$ref' in schema:
+            target = self.resolve(schema['$ref'])
+            checks.append(lambda value, path, errors: target.validate(value, path, errors))
+        if 'enum' in schema:
+            node.enum = list(schema['enum'])
+            allowed = {_canonical(value) for value in schema['enum']}
+            message = f"is not one of {_short(schema['enum'])}"
+            checks.append(lambda value, path, errors: _canonical(value) in allowed or errors.append(
+                (path, 'enum', f"{_short(value)} {message}")))
+        if 'const' in schema:
+            expected = _canonical(schema['const'])
+            message = f"was expected to be {_short(schema['const'])}"
+            checks.append(lambda value, path, errors: _canonical(value) == expected or errors.append(
+                (path, 'const', f"{_short(value)} {message}")))
+
+        self._compile_string(node, schema)
+        self._compile_number(node, schema)
+        self._compile_object(node, schema, pointer)
+        self._compile_array(node, schema, pointer)
+        self._compile_combinators(node, schema, pointer)
+
+    def _compile_string(self, node, schema):
+        checks = node.checks
+        if 'minLength' in schema:
+            minimum = _count(schema, 'minLength')
+            checks.append(lambda value, path, errors: type(value) is not str or len(value) >= minimum or errors.append(
+                (path, 'minLength', f"{_short(value)} is shorter than {minimum} characters")))
+        if 'maxLength' in schema:
+            maximum = _count(schema, 'maxLength')
+            checks.append(lambda value, path, errors: type(value) is not str or len(value) <= maximum or errors.append(
+                (path, 'maxLength', f"{_short(value)} is longer than {maximum} characters")))
+        if 'pattern' in schema:
+            regex = re.compile(schema['pattern'])
+            checks.append(lambda value, path, errors: type(value) is not str or regex.search(value) or errors.append(
+                (path, 'pattern', f"{_short(value)} does not match {regex.pattern!r}")))
+        if schema.get('format') in FORMATS:
+            name, check = schema['format'], FORMATS[schema['format']]
+            checks.append(lambda value, path, errors: type(value) is not str or check(value) or errors.append(
+                (path, 'format', f"{_short(value)} is not a valid {name}")))
+
+    def _compile_number(self, node, schema):
+        bounds = []
+        for keyword, strict, below in (('minimum', False, True), ('maximum', False, False),
+                                       ('exclusiveMinimum', True, True), ('exclusiveMaximum', True, False)):
+            if keyword not in schema or isinstance(schema[keyword], bool):
+                continue
+            # Not cast to float, so integer bounds past 2**53 compare exactly
+            bounds.append((keyword, schema[keyword], strict, below))
+        # Draft 4 spells exclusive bounds as booleans next to minimum/maximum
+        for keyword, bound in (('exclusiveMinimum', 'minimum'), ('exclusiveMaximum', 'maximum')):
+            if schema.get(keyword) is True and bound in schema:
+                bounds = [(keyword, limit, True, below) if name == bound else (name, limit, strict, below)
+                          for name, limit, strict, below in bounds]
+
+        def check_bounds(value, path, errors):
+            if type(value) not in (int, float):
+                return
+            for keyword, limit, strict, below in bounds:
+                if below and (value <= limit if strict else value < limit):
+                    errors.append((path, keyword, f"{value} is less than {'or equal to ' if strict else ''}the minimum of {limit:g}"))
+                elif not below and (value >= limit if strict else value > limit):
+                    errors.append((path, keyword, f"{value} is greater than {'or equal to ' if strict else ''}the maximum of {limit:g}"))
+
+        if bounds:
+            node.checks.append(check_bounds)
+        if 'multipleOf' in schema:
+            divisor = schema['multipleOf']
+            if not isinstance(divisor, (int, float)) or isinstance(divisor, bool) or divisor <= 0:
+                raise SchemaError('multipleOf must be a positive number.')
+
+            def check_multiple(value, path, errors):
+                if type(value) not in (int, float):
+                    return
+                if type(value) is int and type(divisor) is int:
+                    multiple = value % divisor == 0
+                else:
+                    quotient = value / divisor
+                    multiple = math.isfinite(quotient) and abs(quotient - round(quotient)) <= 1e-9 * max(1.0, abs(quotient))
+                if not multiple:
+                    errors.append((path, 'multipleOf', f"{value} is not a multiple of {divisor}"))
+
+            node.checks.append(check_multiple)
+
+    def _compile_object(self, node, schema, pointer):
+        for name, subschema in schema.get('properties', {}).items():
+            node.properties[name] = self.child(subschema, pointer, 'properties', name)
+        for pattern, subschema in schema.get('patternProperties', {}).items():
+            node.pattern_properties.append((re.compile(pattern), self.child(subschema, pointer, 'patternProperties', pattern)))
+        if 'additionalProperties' in schema:
+            additional = schema['additionalProperties']
+            node.additional_properties = FORBIDDEN if additional is False else self.child(additional, pointer, 'additionalProperties')
+        if 'propertyNames' in schema:
+            node.property_names = self.child(schema['propertyNames'], pointer, 'propertyNames')
+        node.required = tuple(schema.get('required', ()))
+        node.dependent_required = {name: tuple(names) for name, names in schema.get('dependentRequired', {}).items()}
+        dependent_schemas = dict(schema.get('dependentSchemas', {}))
+        # Draft 7 'dependencies' holds both
+        for name, dependency in schema.get('dependencies', {}).items():
+            if isinstance(dependency, list):
+                node.dependent_required[name] = tuple(dependency)
+            else:
+                dependent_schemas[name] = dependency
+        node.min_properties = _count(schema, 'minProperties')
+        node.max_properties = _count(schema, 'maxProperties')
+        node.has_object = bool(
+            node.properties or node.pattern_properties or node.additional_properties is not None or node.required
+            or node.dependent_required or node.property_names is not None
+            or node.min_properties is not None or node.max_properties is not None
+        )
+
+        if dependent_schemas:
+            keyword = 'dependentSchemas' if 'dependentSchemas' in schema else 'dependencies'
+            dependents = [(name, self.child(subschema, pointer, keyword, name)) for name, subschema in dependent_schemas.items()]
+
+            def check_dependents(value, path, errors):
+                if type(value) is dict:
+                    for name, dependent in dependents:
+                        if name in value:
+                            dependent.validate(value, path, errors)
+
+            node.checks.append(check_dependents)
+
+    def _compile_array(self, node, schema, pointer):
+        items = schema.get('items')
+        if isinstance(items, list):
+            # Draft 7 tuples: items is a list and additionalItems the rest
+            node.prefix_items = [self.child(item, pointer, 'items', index) for index, item in enumerate(items)]
+            items, items_keyword = schema.get('additionalItems'), 'additionalItems'
+        else:
+            node.prefix_items = [self.child(item, pointer, 'prefixItems', index) for index, item in enumerate(schema.get('prefixItems', ()))]
+            items_keyword = 'items'
+        if items is not None:
+            node.items = FORBIDDEN if items is False else self.child(items, pointer, items_keyword)
+        node.min_items = _count(schema, 'minItems')
+        node.max_items = _count(schema, 'maxItems')
+        node.has_array = bool(node.prefix_items or node.items is not None or node.min_items is not None or node.max_items is not None)
+
+        if schema.get('uniqueItems'):
+            def check_unique(value, path, errors):
+                if type(value) is list:
+                    seen = set()
+                    for index, item in enumerate(value):
+                        key = _canonical(item)
+                        if key in seen:
+                            errors.append(((path, index), 'uniqueItems', f"{_short(item)} is a duplicate"))
+                        seen.add(key)
+
+            node.checks.append(check_unique)
+
+        if 'contains' in schema:
+            contains = self.child(schema['contains'], pointer, 'contains')
+            minimum = _count(schema, 'minContains', 1)
+            maximum = _count(schema, 'maxContains')
+
+            def check_contains(value, path, errors):
+                if type(value) is list:
+                    count = sum(1 for index, item in enumerate(value) if _matches(contains, item, (path, index)))
+                    if count < minimum or (maximum is not None and count > maximum):
+                        bounds = f"at least {minimum}" + (f" and at most {maximum}" if maximum is not None else '')
+                        errors.append((path, 'contains', f"Expected {bounds} matching items, found {count}"))
+
+            node.checks.append(check_contains)
+
+    def _compile_combinators(self, node, schema, pointer):
+        checks = node.checks
+        if 'allOf' in schema:
+            nodes = [self.child(subschema, pointer, 'allOf', index) for index, subschema in enumerate(schema['allOf'])]
+
+            def check_all(value, path, errors):
+                for subnode in nodes:
+                    subnode.validate(value, path, errors)
+
+            checks.append(check_all)
+        if 'anyOf' in schema:
+            nodes = [self.child(subschema, pointer, 'anyOf', index) for index, subschema in enumerate(schema['anyOf'])]
+            checks.append(lambda value, path, errors: any(_matches(subnode, value, path) for subnode in nodes) or errors.append(
+                (path, 'anyOf', f"{_short(value)} does not match any of the allowed schemas")))
+        if 'oneOf' in schema:
+            nodes = [self.child(subschema, pointer, 'oneOf', index) for index, subschema in enumerate(schema['oneOf'])]
+
+            def check_one(value, path, errors):
+                matched = sum(1 for subnode in nodes if _matches(subnode, value, path))
+                if matched != 1:
+                    errors.append((path, 'oneOf', f"{_short(value)} matches {matched} of the schemas, expected exactly one"))
+
+            checks.append(check_one)
+        if 'not' in schema:
+            excluded = self.child(schema['not'], pointer, 'not')
+            checks.append(lambda value, path, errors: not _matches(excluded, value, path) or errors.append(
+                (path, 'not', f"{_short(value)} should not match the schema")))
+        if 'if' in schema:
+            condition = self.child(schema['if'], pointer, 'if')
+            then = self.child(schema['then'], pointer, 'then') if 'then' in schema else None
+            otherwise = self.child(schema['else'], pointer, 'else') if 'else' in schema else None
+
+            def check_condition(value, path, errors):
+                branch = then if _matches(condition, value, path) else otherwise
+                if branch is not None:
+                    branch.validate(value, path, errors)
+
+            checks.append(check_condition)
+
+
+def _report(path, keyword, message):
+    return {'path': _pointer(path), 'keyword': keyword, 'message': message}
+
+
+class Validator:
+    """
+    A JSON Schema compiled once into checks that are reused for every
+    value. Covers the validation keywords of drafts 4 to 2020-12 with
+    local $refs; the formats in FORMATS are checked.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.root = _Compiler(schema).compile(schema)
+
+    def errors(self, value):
+        # Every violation as {'path', 'keyword', 'message'}, with path a JSON pointer
+        errors = []
+        self.root.validate(value, None, errors)
+        return [_report(*error) for error in errors]
+
+    def is_valid(self, value):
+        return _matches(self.root, value, None)
+
+    def iter_document_errors(self, reader, path=''):
+        """
+        Yield the violations of the value at ``path`` of a JSONReader's
+        document. Indexed containers are walked one child at a time, so a
+        large array of records is checked in bounded memory as long as the
+        schemas of the containers on the way use only STREAMABLE keywords.
+        """
+        base = None
+        for token in parse_pointer(path):
+            base = (base, token)
+        yield from self._stream(reader, self.root, path, base)
+
+    def _stream(self, reader, node, pointer, path):
+        info = reader.document.containers.get(pointer)
+        if info is None or not node.streamable:
+            errors = []
+            node.validate(reader.value(pointer), path, errors)
+            yield from (_report(*error) for error in errors)
+            return
+
+        errors = []
+        if node.types is not None and info['type'] not in node.types:
+            errors.append((path, 'type', f"{info['type']} is not of type {' or '.join(node.types)}"))
+        is_object = info['type'] == 'object'
+        if not is_object:
+            node.check_array(info['length'], path, errors)
+        yield from (_report(*error) for error in errors)
+
+        keys = set()
+        for key, child_pointer, value in reader.children(pointer):
+            errors = []
+            if is_object:
+                keys.add(key)
+                nodes = node.property_nodes(key, path, errors) if node.has_object else []
+            else:
+                item = node.item_node(key) if node.has_array else None
+                nodes = [] if item is None or item is FORBIDDEN else [item]
+            for child in nodes:
+                if child_pointer is not None:
+                    yield from self._stream(reader, child, child_pointer, (path, key))
+                else:
+                    child.validate(value, (path, key), errors)
+            yield from (_report(*error) for error in errors)
+
+        if is_object and node.has_object:
+            errors = []
+            node.check_object(keys, path, errors)
+            yield from (_report(*error) for error in errors)
+
+
+def validate_document(document, validator, path='', max_errors=None):
+    """
+    Validate the value at ``path`` of a stored JSONDocument. Returns the
+    number of violations and the first ``max_errors`` of them (default
+    JSON_SCHEMA_MAX_ERRORS).
+    """
+    max_errors = settings.JSON_SCHEMA_MAX_ERRORS if max_errors is None else max_errors
+    errors, count = [], 0
+    with JSONReader(document) as reader:
+        for error in validator.iter_document_errors(reader, path):
+            if count < max_errors:
+                errors.append(error)
+            count += 1
+    return {'valid': count == 0, 'error_count': count, 'errors': errors}
+
+
+def add_schema_version(name, schema, username='', description=''):
+    """
+    Save ``schema`` as the next version of the named MetadataSchema,
+    unless it is the same as the latest version, which is then returned.
+    Raises SchemaError for schemas that don't compile.
+    """
+    Validator(schema)
+    for _ in range(3):
+        latest = MetadataSchema.objects.filter(name=name).order_by('-version').first()
+        if latest is not None and latest.schema == schema:
+            return latest
+        try:
+            with transaction.atomic():
+                return MetadataSchema.objects.create(
+                    name=name, version=latest.version + 1 if latest else 1, schema=schema,
+                    description=description, created_by=username
+                )
+        except IntegrityError:  # Another version was saved meanwhile
+            continue
+    raise SchemaError(f"Could not save a new version of '{name}'; try again.")
+
+
+def find_schema(name, version=None):
+    # The given version of a named schema, or its latest; raises MetadataSchema.DoesNotExist
+    schemas = MetadataSchema.objects.filter(name=name)
+    if version is not None:
+        return schemas.get(version=version)
+    latest = schemas.order_by('-version').first()
+    if latest is None:
+        raise MetadataSchema.DoesNotExist(f"No schema named '{name}'.")
+    return latest
+
+
+_validators = OrderedDict()
+_validators_lock = threading.Lock()
+
+
+def get_validator(metadata_schema):
+    """
+    The compiled Validator of a MetadataSchema version, compiled on first
+    use and kept for JSON_SCHEMA_CACHE versions per process.
+    """
+    key = (metadata_schema.pk, metadata_schema.version)
+    with _validators_lock:
+        validator = _validators.pop(key, None)
+        if validator is not None:
+            _validators[key] = validator
+            return validator
+
+    validator = Validator(metadata_schema.schema)
+    with _validators_lock:
+        _validators[key] = validator
+        while len(_validators) > settings.JSON_SCHEMA_CACHE:
+            _validators.popitem(last=False)
+    return validator
@@ -0,0 +1,324 @@
+import json
+import threading
+import time
+import warnings
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from . import metrics
+from .llm_cache import sampling_params
+from .models import SemanticCacheEntry, SemanticCacheHit
+from .retrieval import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # optional; the semantic cache is off without it
+    np = None
+
+if np is None and settings.LLM_SEMANTIC_CACHE_ENABLED:
+    warnings.warn("LLM_SEMANTIC_CACHE_ENABLED is set but NumPy isn't installed; the semantic cache stays off.")
+
+# Buckets of hashing_embedder's vectors
+HASH_DIMENSIONS = 1024
+DEFAULT_EMBEDDER = 'LLM_Metadata.semantic_cache.hashing_embedder'
+
+
+def hashing_embedder(texts):
+    """
+    Dependency-free embedder: hashed counts of a text's words (stopwords
+    left out) and of their character trigrams. It matches rewordings that
+    keep the words, such as changed case, punctuation, word order or
+    inflection; configure a sentence-embedding model to match paraphrases.
+    """
+    vectors = np.zeros((len(texts), HASH_DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in tokenize(text):
+            vectors[row, zlib.crc32(word.encode('utf-8')) % HASH_DIMENSIONS] += 1.0
+            padded = f' {word} '
+            for start in range(len(padded) - 2):
+                vectors[row, zlib.crc32(padded[start:start + 3].encode('utf-8')) % HASH_DIMENSIONS] += 0.5
+    return vectors
+
+
+def embedder_path():
+    return settings.LLM_SEMANTIC_CACHE_EMBEDDER or settings.LLM_RETRIEVAL_EMBEDDER or DEFAULT_EMBEDDER
+
+
+def enabled():
+    return settings.LLM_SEMANTIC_CACHE_ENABLED and np is not None
+
+
+def eligible(api_messages, document=None):
+    # Only standalone questions: an answer shaped by earlier turns or an uploaded file can't be reused
+    return enabled() and document is None and not any(message['role'] == 'assistant' for message in api_messages)
+
+
+def embed(text):
+    vector = np.asarray(import_string(embedder_path())([text])[0], dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1)
+
+
+def sampling_key(temperature, max_tokens, top_k, top_p):
+    # Answers are only reused for the sampling settings they were generated with, like exact cache hits
+    return json.dumps(sampling_params(temperature, max_tokens, top_k, top_p), sort_keys=True, separators=(',', ':'))
+
+
+def _scope(username):
+    # Answers may draw on passages retrieved from the asker's own files, so they stay per user unless shared
+    return '' if settings.LLM_SEMANTIC_CACHE_SHARED else username
+
+
+class SemanticIndex:
+    """
+    The cached questions of one model, scope and set of sampling settings as
+    a matrix of normalized embeddings, oldest first; a lookup is one matrix-vector product.
+    Entries saved by other workers are loaded on the next lookup.
+    """
+
+    def __init__(self, model, scope, embedder, sampling):
+        self.model = model
+        self.scope = scope
+        self.embedder = embedder
+        self.sampling = sampling
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.matrix = None
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + (self.matrix.nbytes if self.matrix is not None else 0)
+
+    def entries(self):
+        return SemanticCacheEntry.objects.filter(
+            model_name=self.model, username=self.scope, embedder=self.embedder, sampling=self.sampling
+        )
+
+    def refresh(self):
+        rows = self.entries().filter(pk__gt=self.last_id).order_by('pk').values_list('pk', 'embedding')
+        keys, vectors = [], []
+        for pk, embedding in rows.iterator(chunk_size=500):
+            keys.append(pk)
+            vectors.append(np.frombuffer(embedding, dtype=np.float32))
+        if keys:
+            self.add(keys, vectors)
+
+    def add(self, keys, vectors):
+        self.last_id = max(self.last_id, keys[-1])
+        block = np.vstack(vectors)
+        self.matrix = block if self.matrix is None else np.vstack([self.matrix, block])
+        self.keys = np.concatenate([self.keys, np.asarray(keys, dtype=np.int64)])
+        # Only the newest LLM_SEMANTIC_CACHE_MAX_ENTRIES are searched; remember() deletes the rest
+        overflow = len(self.keys) - settings.LLM_SEMANTIC_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            self.keys = self.keys[overflow:].copy()
+            self.matrix = self.matrix[overflow:].copy()
+
+    def remove(self, pk):
+        keep = self.keys != pk
+        self.keys, self.matrix = self.keys[keep], self.matrix[keep]
+
+    def nearest(self, vector):
+        # (entry pk, cosine similarity) of the most similar question, or (None, None)
+        if not len(self.keys) or self.matrix.shape[1] != vector.shape[0]:
+            return None, None
+        scores = self.matrix @ vector
+        position = int(np.argmax(scores))
+        return int(self.keys[position]), float(scores[position])
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(username, model, sampling):
+    # Least recently used indexes are dropped beyond LLM_SEMANTIC_CACHE_MAX_INDEXES
+    key = (model, _scope(username), embedder_path(), sampling)
+    with _indexes_lock:
+        index = _indexes.pop(key, None) or SemanticIndex(*key)
+        _indexes[key] = index
+        while len(_indexes) > settings.LLM_SEMANTIC_CACHE_MAX_INDEXES:
+            _indexes.popitem(last=False)
+        return index
+
+
+def _record_index_size():
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    metrics.record_semantic_index(sum(len(index) for index in indexes), sum(index.nbytes for index in indexes))
+
+
+def _expired(entry):
+    ttl = settings.LLM_SEMANTIC_CACHE_TTL
+    return bool(ttl) and entry.created_at < timezone.now() - timedelta(seconds=ttl)
+
+
+# A failing embedder or database must never fail the question, so errors count as misses.
+
+def lookup(username, model, question, sampling):
+    """
+    Find an earlier answer of ``model``, generated with the same
+    ``sampling`` settings (see sampling_key), to a question at least
+    LLM_SEMANTIC_CACHE_THRESHOLD similar to ``question``. Returns
+    (response, vector): the stored answer as a query_api cache hit, or
+    None, and the question's embedding for remember().
+    """
+    start = time.monotonic()
+    try:
+        vector = embed(question)
+        index = get_index(username, model, sampling)
+        with index.lock:
+            index.refresh()
+            pk, score = index.nearest(vector)
+            entry = None
+            if pk is not None and score >= settings.LLM_SEMANTIC_CACHE_THRESHOLD:
+                entry = SemanticCacheEntry.objects.filter(pk=pk).first()
+                if entry is None or _expired(entry):
+                    # Deleted by another worker, or too old to serve
+                    SemanticCacheEntry.objects.filter(pk=pk).delete()
+                    index.remove(pk)
+                    entry = None
+        _record_index_size()
+        metrics.record_semantic_lookup(model, entry is not None, score)
+        if entry is None:
+            return None, vector
+        SemanticCacheEntry.objects.filter(pk=pk).update(hits=F('hits') + 1, last_hit_at=timezone.now())
+    except Exception:
+        return None, None
+
+    response = {
+        "content": entry.content,
+        "elapsed_time": time.monotonic() - start,
+        "response_tokens": entry.response_tokens,
+        "cache_hit": True,
+        "semantic_entry": entry.pk,
+        "semantic_score": score,
+    }
+    metrics.record_request(model, 'semantic_cache', response)
+    return response, vector
+
+
+def remember(username, model, question, response, vector, sampling):
+    """
+    Store a newly generated answer for later similar questions. Answers
+    that came from a cache, and questions lookup() didn't embed, are skipped.
+    """
+    if vector is None or response.get('cache_hit') or 'error' in response:
+        return
+    try:
+        SemanticCacheEntry.objects.create(
+            username=_scope(username), model_name=model, embedder=embedder_path(), sampling=sampling, question=question,
+            content=response['content'], response_tokens=response.get('response_tokens') or 0,
+            embedding=vector.astype(np.float32).tobytes(),
+        )
+        index = get_index(username, model, sampling)
+        with index.lock:
+            index.refresh()
+            stale = index.entries()
+            if settings.LLM_SEMANTIC_CACHE_TTL:
+                cutoff = timezone.now() - timedelta(seconds=settings.LLM_SEMANTIC_CACHE_TTL)
+                stale.filter(created_at__lt=cutoff).delete()
+            if len(index) >= settings.LLM_SEMANTIC_CACHE_MAX_ENTRIES:
+                stale.filter(pk__lt=index.keys[0]).delete()
+        _record_index_size()
+    except Exception:
+        pass
+
+
+def record_hit(message, response):
+    # Link an answer saved from a semantic cache hit to the entry it came from
+    entry_id = response['semantic_entry']
+    if not SemanticCacheEntry.objects.filter(pk=entry_id).exists():
+        entry_id = None
+    return SemanticCacheHit.objects.create(
+        message=message, entry_id=entry_id, username=message.username,
+        model_name=message.model_name or '', score=response['semantic_score'], timestamp=message.timestamp,
+    )
+
+
+def report_false_hit(hit):
+    """
+    Mark a served answer as not answering the question. Its entry is
+    deleted, so the next similar question gets a fresh answer.
+    """
+    if hit.false_hit:
+        return
+    hit.false_hit = True
+    hit.save(update_fields=['false_hit'])
+    metrics.record_semantic_false_hit(hit.model_name, hit.score)
+    entry = hit.entry
+    if entry is None:
+        return
+    entry_id = entry.pk
+    entry.delete()
+    # Other workers drop it from their indexes when it is next found
+    with _indexes_lock:
+        index = _indexes.get((entry.model_name, entry.username, entry.embedder, entry.sampling))
+    if index is not None:
+        with index.lock:
+            index.remove(entry_id)
+
+
+def _quantiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {f'p{round(q * 100)}': round(values[min(len(values) - 1, int(q * len(values)))], 4) for q in (0.1, 0.5, 0.9)}
+
+
+def cache_stats(days=30):
+    """
+    Per model: stored entries and, for answers served in the last ``days``,
+    hits, user-reported false hits and the score distribution of both; plus
+    this worker's lookups and index size.
+    """
+    since = timezone.now() - timedelta(days=days)
+    models = {}
+
+    def model_stats(name):
+        return models.setdefault(name, {'entries': 0, 'hits': 0, 'false_hits': 0, 'scores': [], 'false_hit_scores': []})
+
+    for row in SemanticCacheEntry.objects.values('model_name').annotate(entries=Count('pk')).order_by():
+        model_stats(row['model_name'])['entries'] = row['entries']
+    hits = SemanticCacheHit.objects.filter(timestamp__gte=since).values_list('model_name', 'score', 'false_hit')
+    for model, score, false_hit in hits.iterator(chunk_size=2000):
+        stats = model_stats(model)
+        stats['hits'] += 1
+        stats['scores'].append(score)
+        if false_hit:
+            stats['false_hits'] += 1
+            stats['false_hit_scores'].append(score)
+    for stats in models.values():
+        stats['false_hit_rate'] = round(stats['false_hits'] / stats['hits'], 4) if stats['hits'] else None
+        stats['scores'] = _quantiles(stats['scores'])
+        stats['false_hit_scores'] = _quantiles(stats['false_hit_scores'])
+
+    lookups = {}
+    with metrics._lock:
+        for labels, count in metrics.SEMANTIC_LOOKUPS.series.items():
+            labels = dict(labels)
+            lookups.setdefault(labels['model'], {'hit': 0, 'miss': 0})[labels['outcome']] = count
+    for counts in lookups.values():
+        counts['hit_rate'] = round(counts['hit'] / (counts['hit'] + counts['miss']), 4)
+
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    return {
+        'days': days,
+        'threshold': settings.LLM_SEMANTIC_CACHE_THRESHOLD,
+        'embedder': embedder_path(),
+        'models': models,
+        'worker': {
+            'lookups': lookups,
+            'indexes': len(indexes),
+            'index_entries': sum(len(index) for index in indexes),
+            'index_bytes': sum(index.nbytes for index in indexes),
+        },
+    }
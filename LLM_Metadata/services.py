@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Conversation, Thread, Turn
+from .context import build_context
+from .ingestion import document_context_message
+from .retrieval import retrieval_context_message
+from .rollups import record_usage
+from .semantic_cache import record_hit
+
+
+def build_api_messages(conversation_id, question, document=None, reply_tokens=0, username=None):
+    """
+    Build the message list sent to the LLM: the stored history of the
+    conversation followed by the new question, the parts of an uploaded
+    file most relevant to it and, for a known user, passages retrieved from
+    their other files and conversations. Older turns are left out when the
+    history doesn't fit the context budget; see context.build_context.
+    """
+    new_messages = [{"role": "user", "content": question}]
+
+    if document:
+        file_message = document_context_message(document, question)
+        if file_message:
+            new_messages.append(file_message)
+
+    if username and settings.LLM_RETRIEVAL_ENABLED:
+        retrieved = retrieval_context_message(username, question, conversation_id, document)
+        if retrieved:
+            new_messages.append(retrieved)
+
+    return build_context(conversation_id, new_messages, reply_tokens)
+
+
+def save_exchange(username, conversation_id, question, response, model, temperature, top_k, top_p, file_upload=None, document=None, queue_wait=None):
+    """
+    Persist a question and the model's answer as a user/assistant pair of
+    Conversation rows linked by a Turn, and count it in the usage rollups.
+    Returns the two saved rows.
+    """
+    with transaction.atomic():
+        user_message, assistant_message = _create_exchange(
+            username, conversation_id, question, response, model, temperature, top_k, top_p, file_upload, document, queue_wait
+        )
+        record_turn(user_message, assistant_message)
+        record_usage([assistant_message])
+        if response.get('semantic_entry'):
+            record_hit(assistant_message, response)
+    return user_message, assistant_message
+
+
+def _create_exchange(username, conversation_id, question, response, model, temperature, top_k, top_p, file_upload, document, queue_wait):
+    # Save user question
+    user_message = Conversation.objects.create(
+        role='user',
+        content=question,
+        username=username,
+        conversation_id=conversation_id,
+        timestamp=timezone.now(),
+        model_name=model,
+        token_usage=response['response_tokens'],
+        elapsed_time=round(response['elapsed_time'], 2),
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        file_upload=file_upload,
+        document=document,
+        cache_hit=response.get('cache_hit', False)
+    )
+    # Save AI response
+    assistant_message = Conversation.objects.create(
+        role='assistant',
+        content=response['content'],
+        username=username,
+        conversation_id=conversation_id,
+        timestamp=timezone.now(),
+        model_name=model,
+        token_usage=response['response_tokens'],
+        elapsed_time=round(response['elapsed_time'], 2),
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        cache_hit=response.get('cache_hit', False),
+        **telemetry_fields(response, queue_wait)
+    )
+    return user_message, assistant_message
+
+
+def telemetry_fields(response, queue_wait=None):
+    # Conversation fields describing how the answer was produced
+    ttfb = response.get('ttfb')
+    return {
+        'prompt_tokens': response.get('prompt_tokens'),
+        'completion_tokens': response.get('completion_tokens'),
+        'ttfb': round(ttfb, 3) if ttfb is not None else None,
+        'queue_wait': round(queue_wait, 3) if queue_wait is not None else None,
+        'backend': 'cache' if response.get('cache_hit') else response.get('backend'),
+    }
+
+
+def record_turn(user_message, assistant_message=None):
+    """
+    Link a question to its reply and update the thread's aggregates.
+    """
+    reply_time = (assistant_message or user_message).timestamp
+    tokens = (assistant_message.token_usage or 0) if assistant_message else 0
+
+    thread, _ = Thread.objects.get_or_create(
+        conversation_id=user_message.conversation_id,
+        defaults={'username': user_message.username, 'created_at': user_message.timestamp}
+    )
+    turn = Turn.objects.create(
+        thread=thread,
+        user_message=user_message,
+        assistant_message=assistant_message,
+        username=user_message.username,
+        timestamp=reply_time,
+        tokens=tokens
+    )
+    Thread.objects.filter(pk=thread.pk).update(
+        turn_count=F('turn_count') + 1,
+        total_tokens=F('total_tokens') + tokens,
+        last_activity=reply_time
+    )
+    return turn
+
+
+def prefetch_assistant_replies(conversation_ids):
+    """
+    Resolve the latest assistant reply of every given conversation in one
+    query. Returns {str(conversation_id): Conversation} for the
+    get_assistant_for_user template filter.
+    """
+    replies = {}
+    assistant_messages = Conversation.objects.filter(
+        conversation_id__in=set(conversation_ids), role='assistant'
+    ).order_by('conversation_id', '-timestamp')
+    for message in assistant_messages:
+        replies.setdefault(str(message.conversation_id), message)
+    return replies
@@ -4,5 +4,12 @@ from LLM_Metadata.models import Conversation
 register = template.Library()
 
 @register.filter
-def get_assistant_for_user(conversation_id):
-    return Conversation.objects.filter(conversation_id=conversation_id, role='assistant').first()
\ No newline at end of file
+def get_assistant_for_user(conversation_id, assistant_replies=None):
+    """
+    Assistant reply for a conversation. Pass the map built by
+    services.prefetch_assistant_replies to avoid one query per call:
+    {{ convo.conversation_id|get_assistant_for_user:assistant_replies }}
+    """
+    if assistant_replies is not None:
+        return assistant_replies.get(str(conversation_id))
+    return Conversation.objects.filter(conversation_id=conversation_id, role='assistant').first()
@@ -1,3 +1,1302 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Conversation, ExtractionResult, JobModelLock, JSONDocument, KeepAlive, LLMJob, MetadataSchema, SemanticCacheEntry, SemanticCacheHit, Thread,
+    Turn, UsageRollup,
+)
+from .context import build_context, count_tokens
+from .fake_llm import FakeLLMServer
+from .jobs import claim_job, requeue_stale_jobs, run_job
+from .management.commands.run_llm_worker import Command as RunLLMWorker
+from .ingestion import ingest_upload, relevant_chunks
+from . import exports, health, json_tables, metrics, retrieval, rollups, schemas, semantic_cache, urls, utils, views
+from .router import Backend, Router, reset_router
+from .llm_cache import response_cache_key
+from .utils import aquery_api, query_api
+from .services import prefetch_assistant_replies, record_turn, save_exchange
+
+
+class QueryBudgetMixin:
+    """
+    assertMaxQueries(n) fails when the block runs more than n queries. Unlike
+    assertNumQueries it tolerates small changes below the budget, so tests
+    catch per-row (N+1) queries without pinning an exact count.
+    """
+
+    @contextmanager
+    def assertMaxQueries(self, limit, using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > limit:
+            queries = '\n'.join(
+                f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail(f"{executed} queries executed, at most {limit} expected\n{queries}")
+
+
+def create_turns(username, count, conversation_id=None):
+    # One conversation per turn unless a conversation_id is given
+    now = timezone.now()
+    for i in range(count):
+        cid = conversation_id or uuid.uuid4()
+        question = Conversation.objects.create(
+            role='user', content=f'question {i}', username=username,
+            conversation_id=cid, timestamp=now - timedelta(minutes=2 * i + 1)
+        )
+        answer = Conversation.objects.create(
+            role='assistant', content=f'answer {i}', username=username, token_usage=3,
+            conversation_id=cid, timestamp=now - timedelta(minutes=2 * i)
+        )
+        record_turn(question, answer)
+
+
+class PageQueryCountTests(QueryBudgetMixin, TestCase):
+    # Session, user, page data, plus slack for middleware; must not grow with the number of turns
+    PAGE_QUERY_BUDGET = 6
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='password')
+        self.client.force_login(self.user)
+
+    def test_conversation_page(self):
+        create_turns(self.user.username, 40)
+        with self.assertMaxQueries(self.PAGE_QUERY_BUDGET):
+            response = self.client.get(reverse('conversation'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_conversation_history_endpoint(self):
+        create_turns(self.user.username, 60)
+        cursor = self.client.get(reverse('conversation')).context['next_cursor']
+        with self.assertMaxQueries(self.PAGE_QUERY_BUDGET):
+            response = self.client.get(reverse('conversation_history'), {'cursor': cursor})
+        self.assertEqual(len(response.json()['pairs']), 20)
+
+    def test_unanswered_turns_load_without_an_assistant(self):
+        create_turns(self.user.username, 20)
+        question = Conversation.objects.create(
+            role='user', content='unanswered', username='alice', conversation_id=uuid.uuid4(),
+            timestamp=timezone.now() - timedelta(days=1)
+        )
+        record_turn(question)
+        cursor = self.client.get(reverse('conversation')).context['next_cursor']
+        pair = self.client.get(reverse('conversation_history'), {'cursor': cursor}).json()['pairs'][0]
+        self.assertEqual((pair['user']['content'], pair['assistant']), ('unanswered', None))
+
+    @mock.patch('LLM_Metadata.views.query_api')
+    def test_ask_page(self, query_api):
+        query_api.return_value = {
+            'content': 'answer', 'elapsed_time': 0.1, 'response_tokens': 1, 'cache_hit': False
+        }
+        conversation_id = str(uuid.uuid4())
+        create_turns(self.user.username, 30, conversation_id=conversation_id)
+        session = self.client.session
+        session['current_conversation_id'] = conversation_id
+        session.save()
+
+        # Loading history, saving the exchange and rendering all turns
+        with self.assertMaxQueries(self.PAGE_QUERY_BUDGET + 10):
+            response = self.client.post(reverse('ask_question'), {
+                'question': 'another question', 'model': 'mistral-small3.1:latest',
+                'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+            })
+        self.assertEqual(len(response.context['paired_conversations']), 31)
+
+
+class AssistantFilterTests(QueryBudgetMixin, TestCase):
+
+    def test_prefetched_replies_need_no_queries(self):
+        create_turns('bob', 25)
+        questions = list(Conversation.objects.filter(role='user'))
+        template = Template(
+            "{% load conversation_filters %}{% for convo in questions %}"
+            "{% with reply=convo.conversation_id|get_assistant_for_user:assistant_replies %}{{ reply.content }};{% endwith %}"
+            "{% endfor %}"
+        )
+
+        with self.assertMaxQueries(1):
+            replies = prefetch_assistant_replies(q.conversation_id for q in questions)
+            rendered = template.render(Context({'questions': questions, 'assistant_replies': replies}))
+
+        self.assertEqual(rendered.count('answer'), 25)
+
+
+@override_settings(LLM_CACHE_ENABLED=False, LLM_RETRIEVAL_ENABLED=False)
+class StreamingTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeLLMServer(latency=0, reply='Streamed answer in words').start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        reset_router()
+        self.addCleanup(reset_router)
+        self.client.force_login(User.objects.create_user('sam', password='password'))
+
+    def events(self, response):
+        # (event, data) of each Server-Sent Event, checking the framing on the way
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.endswith('\n\n'))
+        events = []
+        for block in body[:-2].split('\n\n'):
+            event, data = block.split('\n')
+            self.assertTrue(event.startswith('event: ') and data.startswith('data: '))
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def test_tokens_are_streamed_then_the_exchange_is_saved(self):
+        with override_settings(LLM_BACKENDS=[{'name': 'fake', 'url': self.server.url}]):
+            reset_router()
+            response = self.client.post(reverse('ask_question_stream'), {
+                'question': 'stream this', 'model': 'mistral-small3.1:latest',
+                'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+            })
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = self.events(response)
+
+        self.assertEqual([event for event, _ in events], ['token'] * 4 + ['done'])
+        self.assertEqual(''.join(data['content'] for _, data in events[:-1]), 'Streamed answer in words ')
+        self.assertEqual(events[-1][1]['model_name'], 'mistral-small3.1:latest')
+        question, answer = Conversation.objects.order_by('pk')
+        self.assertEqual((question.role, question.content), ('user', 'stream this'))
+        self.assertEqual((answer.role, answer.content.strip()), ('assistant', 'Streamed answer in words'))
+        self.assertEqual(Turn.objects.get().assistant_message, answer)
+
+    def test_backend_errors_end_the_stream_with_an_error_event(self):
+        with override_settings(LLM_BACKENDS=[{'name': 'down', 'url': 'http://127.0.0.1:9/v1/chat/completions'}], LLM_MAX_RETRIES=0):
+            reset_router()
+            response = self.client.post(reverse('ask_question_stream'), {
+                'question': 'stream this', 'model': 'mistral-small3.1:latest',
+                'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+            })
+            events = self.events(response)
+        self.assertEqual([event for event, _ in events], ['error'])
+        self.assertFalse(Conversation.objects.exists())
+
+
+@override_settings(LLM_CACHE_ENABLED=False, LLM_RETRIEVAL_ENABLED=False)
+class AsyncAskTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeLLMServer(latency=0.2, reply='Async answer').start()
+        cls.stream_server = FakeLLMServer(latency=0, reply='Streamed answer in words', chunk_delay=0.1).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.stream_server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.reset_stats()
+        self.settings_override = override_settings(LLM_BACKENDS=[{'name': 'fake', 'url': self.server.url}])
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        reset_router()
+        self.addCleanup(reset_router)
+
+    def test_async_view_answers_and_saves_the_exchange(self):
+        self.client.force_login(User.objects.create_user('ada', password='password'))
+        # Serve /ask/ with the async view, as LLM_ASYNC_VIEWS does
+        pattern = next(pattern for pattern in urls.urlpatterns if pattern.name == 'ask_question')
+        with mock.patch.object(pattern, 'callback', views.ask_question_async_view):
+            response = self.client.post(reverse('ask_question'), {
+                'question': 'async question', 'model': 'mistral-small3.1:latest',
+                'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Async answer')
+        answer = Conversation.objects.get(role='assistant')
+        self.assertEqual((answer.content, answer.backend), ('Async answer', 'fake'))
+        self.assertEqual(Turn.objects.get().assistant_message, answer)
+
+    def test_async_stream_sends_chunks_as_they_arrive(self):
+        self.async_client.force_login(User.objects.create_user('ada', password='password'))
+
+        async def read_stream():
+            response = await self.async_client.post(reverse('ask_question_stream'), {
+                'question': 'stream this', 'model': 'mistral-small3.1:latest',
+                'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+            })
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return [(time.monotonic(), chunk) async for chunk in response.streaming_content]
+
+        # Serve /ask/stream/ with the async view, as LLM_ASYNC_VIEWS does
+        pattern = next(pattern for pattern in urls.urlpatterns if pattern.name == 'ask_question_stream')
+        with mock.patch.object(pattern, 'callback', views.ask_question_stream_async_view), \
+                override_settings(LLM_BACKENDS=[{'name': 'fake', 'url': self.stream_server.url}]):
+            reset_router()
+            arrivals = async_to_sync(read_stream)()
+
+        events = [chunk.split(b'\n')[0] for _, chunk in arrivals]
+        self.assertEqual(events, [b'event: token'] * 4 + [b'event: done'])
+        # The backend sends a word every 0.1s; the first one reaches the client long before the last
+        self.assertGreater(arrivals[-1][0] - arrivals[0][0], 0.25)
+        answer = Conversation.objects.get(role='assistant')
+        self.assertEqual((answer.content.strip(), answer.backend), ('Streamed answer in words', 'fake'))
+        self.assertEqual(Turn.objects.get().assistant_message, answer)
+
+    def test_requests_share_one_event_loop(self):
+        async def ask_many():
+            return await asyncio.gather(*(
+                aquery_api([{'role': 'user', 'content': f'question {n}'}], 'mistral-small3.1:latest') for n in range(5)
+            ))
+
+        started = time.monotonic()
+        results = asyncio.run(ask_many())
+        self.assertEqual([result['content'] for result in results], ['Async answer'] * 5)
+        # Awaited concurrently, not one after another
+        self.assertEqual(self.server.peak_in_flight, 5)
+        self.assertLess(time.monotonic() - started, 5 * 0.2)
+
+
+@override_settings(LLM_MAX_RETRIES=2, LLM_HTTP_POOL_SIZE=7, LLM_RETRY_BACKOFF=0.25)
+class LLMSessionTests(TestCase):
+
+    def setUp(self):
+        utils._session = None
+        self.addCleanup(setattr, utils, '_session', None)
+
+    def test_pooled_session_retries_busy_backends(self):
+        session = utils.get_session()
+        self.assertIs(utils.get_session(), session)
+        for url in ('http://gpu-1/v1/chat/completions', 'https://api.example.com/v1/chat/completions'):
+            adapter = session.get_adapter(url)
+            self.assertEqual(adapter._pool_maxsize, 7)
+            retry = adapter.max_retries
+            self.assertEqual((retry.total, retry.connect, retry.status, retry.read), (2, 2, 2, 0))
+            self.assertEqual(set(retry.status_forcelist), set(utils.RETRY_STATUSES))
+            self.assertIn('POST', retry.allowed_methods)
+            self.assertEqual(retry.backoff_factor, 0.25)
+
+    @override_settings(LLM_CACHE_ENABLED=False)
+    def test_requests_reuse_a_kept_alive_connection(self):
+        server = FakeLLMServer(latency=0, reply='pong').start()
+        self.addCleanup(server.stop)
+        with override_settings(LLM_BACKENDS=[{'name': 'fake', 'url': server.url}]):
+            reset_router()
+            self.addCleanup(reset_router)
+            for _ in range(3):
+                self.assertEqual(query_api([{'role': 'user', 'content': 'ping'}], 'mistral-small3.1:latest')['content'], 'pong')
+        pools = utils.get_session().get_adapter(server.url).poolmanager.pools
+        self.assertEqual([pools[key].num_connections for key in pools.keys()], [1])
+
+
+@override_settings(LLM_CACHE_ENABLED=True, LLM_BACKENDS=[])
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        reset_router()
+        self.addCleanup(reset_router)
+        caches[settings.LLM_CACHE_ALIAS].clear()
+        self.addCleanup(caches[settings.LLM_CACHE_ALIAS].clear)
+
+    @mock.patch('LLM_Metadata.utils._post_completion')
+    def test_repeated_prompts_hit_and_changed_ones_miss(self, post):
+        post.return_value = {'content': 'cached answer', 'elapsed_time': 1.0, 'response_tokens': 2}
+        question = [{'role': 'user', 'content': 'What is BM25?'}]
+
+        first = query_api(question, 'mistral-small3.1:latest', 0.5, 100, 40, 0.9)
+        self.assertFalse(first['cache_hit'])
+        # Whitespace and line endings don't change the key
+        again = query_api([{'role': 'user', 'content': 'What is BM25?  \r\n'}], 'mistral-small3.1:latest', 0.5, 100, 40, 0.9)
+        self.assertEqual((again['content'], again['cache_hit']), ('cached answer', True))
+        self.assertEqual(post.call_count, 1)
+
+        # Any other parameter, a different question, or use_cache=False goes to the model
+        query_api(question, 'mistral-small3.1:latest', 0.7, 100, 40, 0.9)
+        query_api(question, 'mistral-small3.1:latest', 0.5, 200, 40, 0.9)
+        query_api([{'role': 'user', 'content': 'What is TF-IDF?'}], 'mistral-small3.1:latest', 0.5, 100, 40, 0.9)
+        query_api(question, 'mistral-small3.1:latest', 0.5, 100, 40, 0.9, use_cache=False)
+        self.assertEqual(post.call_count, 5)
+
+        # Errors are not cached
+        post.return_value = {'error': 'Error: overloaded', 'status_code': 500}
+        query_api(question, 'mistral-small3.1:latest', 0.1, 100, 40, 0.9)
+        query_api(question, 'mistral-small3.1:latest', 0.1, 100, 40, 0.9)
+        self.assertEqual(post.call_count, 7)
+
+
+class ThreadBackfillTests(TestCase):
+
+    def message(self, conversation_id, role, minutes, username='olga', tokens=None):
+        return Conversation.objects.create(
+            role=role, content=f'{role} at {minutes}', username=username, conversation_id=conversation_id,
+            timestamp=timezone.now() - timedelta(minutes=60 - minutes), token_usage=tokens
+        )
+
+    def test_messages_are_paired_into_threads_and_turns(self):
+        first, second = uuid.uuid4(), uuid.uuid4()
+        q1 = self.message(first, 'user', 1)
+        a1 = self.message(first, 'assistant', 2, tokens=5)
+        q2 = self.message(first, 'user', 3)
+        a2 = self.message(first, 'assistant', 4, tokens=7)
+        # A question followed by another question, and one never answered
+        q3 = self.message(second, 'user', 5, username='pia')
+        q4 = self.message(second, 'user', 6, username='pia')
+        a4 = self.message(second, 'assistant', 7, username='pia', tokens=3)
+        q5 = self.message(second, 'user', 8, username='pia')
+
+        backfill = import_module('LLM_Metadata.migrations.0006_backfill_threads')
+        state = MigrationExecutor(connections[DEFAULT_DB_ALIAS]).loader.project_state(('LLM_Metadata', '0006_backfill_threads'))
+        backfill.backfill_threads(state.apps, None)
+
+        turns = {turn.user_message_id: turn for turn in Turn.objects.all()}
+        self.assertEqual(
+            {question.pk: turns[question.pk].assistant_message_id for question in (q1, q2, q3, q4, q5)},
+            {q1.pk: a1.pk, q2.pk: a2.pk, q3.pk: None, q4.pk: a4.pk, q5.pk: None}
+        )
+        self.assertEqual(turns[q5.pk].timestamp, q5.timestamp)
+        threads = {thread.conversation_id: thread for thread in Thread.objects.all()}
+        self.assertEqual((threads[first].turn_count, threads[first].total_tokens, threads[first].username), (2, 12, 'olga'))
+        self.assertEqual((threads[second].turn_count, threads[second].total_tokens), (3, 3))
+        self.assertEqual(threads[second].last_activity, q5.timestamp)
+        self.assertEqual(threads[first].created_at, q1.timestamp)
+
+
+class ContextBuilderTests(QueryBudgetMixin, TestCase):
+
+    def test_only_new_rows_are_read(self):
+        conversation_id = str(uuid.uuid4())
+        create_turns('carol', 50, conversation_id=conversation_id)
+        question = [{'role': 'user', 'content': 'next'}]
+        self.assertEqual(len(build_context(conversation_id, question)), 101)
+
+        create_turns('carol', 1, conversation_id=conversation_id)
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as context:
+            messages = build_context(conversation_id, question)
+        self.assertEqual(len(messages), 103)
+        self.assertEqual(len(context.captured_queries), 1)
+
+    @override_settings(LLM_CONTEXT_TOKEN_BUDGET=200)
+    def test_old_turns_are_dropped_to_fit_budget(self):
+        conversation_id = str(uuid.uuid4())
+        create_turns('dave', 100, conversation_id=conversation_id)
+        messages = build_context(conversation_id, [{'role': 'user', 'content': 'next'}], reply_tokens=50)
+
+        used = sum(count_tokens(message['content']) + 4 for message in messages)
+        self.assertLessEqual(used, 150)
+        self.assertEqual(messages[0]['role'], 'system')
+        self.assertEqual(messages[1]['role'], 'user')
+        self.assertEqual(messages[-1]['content'], 'next')
+        # The newest turn is kept (create_turns numbers turns newest first)
+        self.assertEqual(messages[-2]['content'], 'answer 0')
+
+
+@override_settings(LLM_UPLOAD_CHUNK_TOKENS=40, LLM_UPLOAD_CONTEXT_TOKENS=80)
+class IngestionTests(TestCase):
+
+    def upload(self, name, content):
+        upload = SimpleUploadedFile(name, content)
+        # Force several read blocks so values and lines cross block boundaries
+        upload.DEFAULT_CHUNK_SIZE = 64
+        return upload
+
+    def test_csv_is_chunked_with_header(self):
+        rows = ''.join(f'{i},"sample {i}, batch",{i * 1.5}\n' for i in range(200))
+        document = ingest_upload(self.upload('data.csv', ('id,name,value\n' + rows).encode('utf-8')), 'erin')
+
+        chunks = list(document.chunks.all())
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual(document.chunk_count, len(chunks))
+        for chunk in chunks:
+            self.assertTrue(chunk.content.startswith('id,name,value\n'))
+            self.assertLessEqual(chunk.tokens, 40)
+        self.assertIn('"sample 3, batch"', chunks[0].content)
+
+    def test_same_content_is_stored_once(self):
+        first = ingest_upload(self.upload('a.txt', b'line one\nline two\n'), 'erin')
+        second = ingest_upload(self.upload('b.txt', b'line one\nline two\n'), 'frank')
+        self.assertEqual(first.pk, second.pk)
+
+    def test_json_array_and_encoding(self):
+        items = [{'name': f'caf\u00e9 {i}', 'tags': ['x'] * 3} for i in range(50)]
+        document = ingest_upload(self.upload('items.json', json.dumps(items, ensure_ascii=False).encode('latin-1')), 'erin')
+
+        self.assertNotEqual(document.encoding, 'utf-8')
+        text = ''.join(chunk.content for chunk in document.chunks.all())
+        self.assertEqual([json.loads(line) for line in text.splitlines()], items)
+
+    def test_relevant_chunks_match_question(self):
+        lines = ''.join(f'Paragraph {i} talks about nothing in particular.\n' for i in range(100))
+        lines += 'The boiling point of the reagent is 78 degrees.\n'
+        document = ingest_upload(self.upload('notes.txt', lines.encode('utf-8')), 'erin')
+
+        chunks = relevant_chunks(document, 'What is the boiling point of the reagent?')
+        self.assertEqual(len(chunks), 1)
+        self.assertIn('boiling point', chunks[0].content)
+
+
+class RetrievalTests(TestCase):
+
+    def setUp(self):
+        retrieval._indexes.clear()
+
+    def save_message(self, content, conversation_id, username='grace'):
+        return Conversation.objects.create(role='user', content=content, username=username, conversation_id=conversation_id)
+
+    @override_settings(LLM_RETRIEVAL_MIN_SCORE=0)  # Passages of a three-passage index score low
+    def test_top_passages_from_files_and_conversations(self):
+        old_conversation = uuid.uuid4()
+        self.save_message('My sourdough starter needs feeding with rye flour every day.', old_conversation)
+        self.save_message('How do I tune a guitar?', old_conversation)
+        upload = SimpleUploadedFile('baking.txt', b'Sourdough loaves bake at 250 degrees for 40 minutes.\n')
+        ingest_upload(upload, 'grace')
+
+        passages = retrieval.retrieve('grace', 'How long do I bake sourdough?', k=2)
+        self.assertEqual(len(passages), 2)
+        self.assertTrue(passages[0]['source'].startswith('baking.txt'))
+        self.assertIn('starter', passages[1]['text'])
+
+    @override_settings(LLM_RETRIEVAL_MIN_SCORE=0)
+    def test_index_updates_incrementally_and_skips_current_conversation(self):
+        current = uuid.uuid4()
+        self.assertEqual(retrieval.retrieve('grace', 'photosynthesis'), [])
+
+        self.save_message('Photosynthesis happens in the chloroplasts.', uuid.uuid4())
+        self.save_message('Explain photosynthesis again.', current)
+        passages = retrieval.retrieve('grace', 'photosynthesis', exclude_conversation=current)
+        self.assertEqual([passage['text'] for passage in passages], ['Photosynthesis happens in the chloroplasts.'])
+        # Other users' messages are never returned
+        self.assertEqual(retrieval.retrieve('heidi', 'photosynthesis'), [])
+
+
+    def test_weak_matches_and_copies_of_the_question_are_dropped(self):
+        self.save_message('My sourdough starter needs rye flour.', uuid.uuid4())
+        self.save_message('Explain guitar string tuning', uuid.uuid4())
+        self.assertEqual(len(retrieval.retrieve('grace', 'Where do I buy rye flour?')), 1)
+        self.assertEqual(retrieval.retrieve('grace', 'Is sourdough healthy?'), [])
+        with override_settings(LLM_RETRIEVAL_MIN_SCORE=0):
+            self.assertEqual(retrieval.retrieve('grace', 'Explain guitar string tuning!'), [])
+
+    @override_settings(LLM_CACHE_ENABLED=True, LLM_BACKENDS=[], LLM_SEMANTIC_CACHE_ENABLED=False)
+    @mock.patch('LLM_Metadata.utils._post_completion')
+    def test_repeated_questions_hit_the_response_cache(self, post):
+        caches[settings.LLM_CACHE_ALIAS].clear()
+        self.addCleanup(caches[settings.LLM_CACHE_ALIAS].clear)
+        post.return_value = {'content': 'The capital of France is Paris.', 'elapsed_time': 1.0, 'response_tokens': 7}
+        self.client.force_login(User.objects.create_user('grace', password='password'))
+        for _ in range(3):
+            self.client.get(reverse('ask_question'))  # Starts a new conversation
+            self.client.post(reverse('ask_question'), {
+                'question': 'What is the capital of France?', 'model': 'mistral-small3.1:latest',
+                'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+            })
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(
+            list(Conversation.objects.filter(role='assistant').order_by('pk').values_list('cache_hit', flat=True)),
+            [False, True, True]
+        )
+
+        # Retrieved passages don't change the key for their user, but do scope it to them
+        question = [{'role': 'user', 'content': 'What is the capital of France?'}]
+        with override_settings(LLM_RETRIEVAL_MIN_SCORE=0):
+            passages = retrieval.retrieval_context_message('grace', 'Which city is the capital of France?')
+            other_passages = retrieval.retrieval_context_message('grace', 'Tell me about France')
+        self.assertIsNotNone(passages)
+        key = response_cache_key(question + [passages], 'm', 0.5, 100, 40, 0.9, username='grace')
+        self.assertEqual(key, response_cache_key(question + [other_passages], 'm', 0.5, 100, 40, 0.9, username='grace'))
+        self.assertNotEqual(key, response_cache_key(question + [passages], 'm', 0.5, 100, 40, 0.9, username='mallory'))
+        self.assertNotEqual(key, response_cache_key(question, 'm', 0.5, 100, 40, 0.9))
+        # Without a user the passages stay in the key
+        self.assertNotEqual(
+            response_cache_key(question + [passages], 'm', 0.5, 100, 40, 0.9), response_cache_key(question, 'm', 0.5, 100, 40, 0.9)
+        )
+
+
+@override_settings(LLM_JOB_DEFAULT_CONCURRENCY=1, LLM_JOB_MAX_ATTEMPTS=2, LLM_JOB_MAX_QUEUE_DEPTH=3)
+class JobQueueTests(TestCase):
+    form_data = {
+        'question': 'queued question', 'model': 'mistral-small3.1:latest',
+        'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user('ivan', password='password')
+        self.client.force_login(self.user)
+
+    @mock.patch('LLM_Metadata.jobs.query_api')
+    def test_job_is_queued_run_and_reported(self, query_api):
+        query_api.return_value = {'content': 'queued answer', 'elapsed_time': 0.2, 'response_tokens': 2}
+        response = self.client.post(reverse('ask_question_job'), self.form_data)
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], 'queued')
+
+        job = run_job(claim_job('test'))
+        self.assertEqual(job.status, 'succeeded')
+        status = self.client.get(status_url).json()
+        self.assertEqual(status['status'], 'succeeded')
+        self.assertEqual(status['result']['content'], 'queued answer')
+        self.assertEqual(Conversation.objects.filter(username='ivan').count(), 2)
+
+    @mock.patch('LLM_Metadata.jobs.query_api')
+    def test_failed_job_is_retried_then_failed(self, query_api):
+        query_api.return_value = {'error': 'upstream timeout', 'status_code': 504}
+        self.client.post(reverse('ask_question_job'), self.form_data)
+
+        job = run_job(claim_job('test'))
+        self.assertEqual(job.status, 'queued')
+        self.assertIsNone(claim_job('test'))  # Waiting for its backoff
+        LLMJob.objects.update(run_after=timezone.now())
+        job = run_job(claim_job('test'))
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 2)
+
+    @mock.patch('LLM_Metadata.management.commands.run_llm_worker.close_old_connections')
+    @mock.patch('LLM_Metadata.jobs.save_exchange', side_effect=RuntimeError('database went away'))
+    @mock.patch('LLM_Metadata.jobs.query_api')
+    def test_worker_survives_a_job_that_raises(self, query_api, save_exchange, close_old_connections):
+        query_api.return_value = {'content': 'lost answer', 'elapsed_time': 0.2, 'response_tokens': 2}
+        self.client.post(reverse('ask_question_job'), self.form_data)
+        stderr = io.StringIO()
+        command = RunLLMWorker(stdout=io.StringIO(), stderr=stderr)
+        # Returns once the queue is empty instead of dying with the job
+        command._loop('test', {'burst': True, 'poll_interval': 0})
+
+        job = LLMJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertEqual(job.error, 'RuntimeError: database went away')
+        self.assertIn('database went away', stderr.getvalue())
+
+    @override_settings(LLM_JOB_STALE_AFTER=60)
+    def test_stale_jobs_are_requeued_until_out_of_attempts(self):
+        for _ in range(2):
+            self.client.post(reverse('ask_question_job'), self.form_data)
+        first, second = LLMJob.objects.order_by('created_at')
+        # Both workers died mid-request; the second job was on its last attempt
+        LLMJob.objects.update(status='running', worker='gone', started_at=timezone.now() - timedelta(minutes=5))
+        LLMJob.objects.filter(pk=first.pk).update(attempts=1)
+        LLMJob.objects.filter(pk=second.pk).update(attempts=2)
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, first.worker), ('queued', ''))
+        self.assertEqual((second.status, second.worker), ('failed', ''))
+        self.assertIsNotNone(second.finished_at)
+        self.assertIn('stopped responding', second.error)
+
+    def test_model_concurrency_and_queue_depth(self):
+        for _ in range(3):
+            self.assertEqual(self.client.post(reverse('ask_question_job'), self.form_data).status_code, 202)
+        self.assertEqual(self.client.post(reverse('ask_question_job'), self.form_data).status_code, 503)
+
+        self.assertIsNotNone(claim_job('test'))
+        # One job of this model is already running
+        self.assertIsNone(claim_job('test'))
+
+        # Jobs of other models are still claimed, past the busy model's older ones
+        LLMJob.objects.create(
+            username='ivan', conversation_id=uuid.uuid4(), question='q', api_messages=[], model_name='other-model',
+            max_tokens=100, temperature=0.5, top_k=40, top_p=0.9
+        )
+        self.assertEqual(claim_job('test').model_name, 'other-model')
+        self.assertEqual(JobModelLock.objects.count(), 2)
+
+
+@override_settings(LLM_BATCH_CONCURRENCY=4)
+class BatchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('judy', password='password')
+        self.client.force_login(self.user)
+
+    def post(self, spec, **params):
+        url = reverse('ask_batch') + ('?format=csv' if params.get('csv') else '')
+        return self.client.post(url, json.dumps(spec), content_type='application/json')
+
+    def test_grid_runs_concurrently_and_is_saved(self):
+        in_flight = peak = 0
+        lock = threading.Lock()
+
+        def slow_answer(messages, model, temperature, max_tokens, top_k, top_p):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight -= 1
+            return {'content': f"{messages[0]['content']} @ {temperature}", 'elapsed_time': 0.05, 'response_tokens': 4}
+
+        with mock.patch('LLM_Metadata.batch.query_api', side_effect=slow_answer):
+            response = self.post({'questions': ['a?', 'b?', 'c?', 'd?'], 'temperatures': [0.1, 0.9]})
+
+        table = response.json()
+        self.assertEqual(len(table['rows']), 8)
+        answer = table['columns'].index('answer')
+        self.assertEqual(table['rows'][1][answer], 'a? @ 0.9')
+        self.assertEqual(peak, 4)
+        self.assertEqual(Conversation.objects.filter(username='judy').count(), 16)
+        self.assertEqual(Turn.objects.filter(username='judy', assistant_message__isnull=False).count(), 8)
+
+    def test_invalid_combination_is_rejected(self):
+        response = self.post({'questions': ['a?'], 'temperatures': [0.5, 3]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('temperature', response.json()['error'])
+
+    @mock.patch('LLM_Metadata.batch.query_api')
+    def test_failed_items_are_reported_not_saved(self, query_api):
+        query_api.side_effect = [{'error': 'boom'}, {'content': 'ok', 'elapsed_time': 0.1, 'response_tokens': 1}]
+        response = self.post({'questions': ['a?'], 'top_k': [10, 20], 'concurrency': 1}, csv=True)
+        lines = response.content.decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn(',error,boom,', lines[1])
+        self.assertEqual(Conversation.objects.filter(username='judy').count(), 2)
+
+
+@override_settings(LLM_CIRCUIT_FAILURES=2, LLM_CIRCUIT_COOLDOWN=60)
+class RouterTests(TestCase):
+
+    def test_least_in_flight_and_model_filter(self):
+        a, b = Backend('a'), Backend('b', models=['other'])
+        router = Router([a, b])
+        self.assertIs(router.acquire('mistral'), a)  # Only a serves it
+        self.assertIs(router.acquire('other'), b)  # a is busier now
+        router.release(a, ok=True)
+        self.assertIs(router.acquire('other'), a)
+
+    def test_circuit_breaker_opens_and_probes(self):
+        a, b = Backend('a'), Backend('b', weight=0.5)
+        router = Router([a, b])
+        for _ in range(2):
+            router.release(router.acquire('m'), ok=False)
+        self.assertEqual(a.state, 'open')
+        self.assertIs(router.acquire('m', exclude=[b]), None)
+
+        a.opened_at -= 60  # Cooldown over: one probe request is let through
+        self.assertIs(router.acquire('m', exclude=[b]), a)
+        self.assertIs(router.acquire('m', exclude=[b]), None)
+        router.release(a, ok=True, elapsed=0.2)
+        self.assertEqual(a.state, 'closed')
+
+    def test_full_backends_are_waited_for(self):
+        a = Backend('a', max_concurrency=1)
+        router = Router([a])
+        router.acquire('m')
+        releaser = threading.Timer(0.2, router.release, (a, True))
+        releaser.start()
+        self.addCleanup(releaser.cancel)
+        started = time.monotonic()
+        self.assertIs(router.acquire('m', timeout=5), a)
+        self.assertLess(time.monotonic() - started, 5)
+
+        # Still full: give up once the wait times out
+        self.assertIs(router.acquire('m', timeout=0.1), None)
+        with override_settings(LLM_ROUTER_WAIT_TIMEOUT=0.1):
+            self.assertIs(asyncio.run(router.aacquire('m')), None)
+        router.release(a, ok=True)
+        self.assertIs(asyncio.run(router.aacquire('m')), a)
+
+    @override_settings(LLM_CACHE_ENABLED=False, LLM_BACKENDS=[{'name': 'down'}, {'name': 'up'}])
+    def test_query_fails_over_to_the_next_backend(self):
+        reset_router()
+        self.addCleanup(reset_router)
+
+        def post(backend, payload):
+            if backend.name == 'down':
+                return {'error': 'Request failed: connection refused', 'status_code': None}
+            return {'content': 'hello', 'elapsed_time': 0.1, 'response_tokens': 1}
+
+        with mock.patch('LLM_Metadata.utils._post_completion', side_effect=post):
+            results = [query_api([{'role': 'user', 'content': 'hi'}], 'm') for _ in range(4)]
+        self.assertEqual({result['backend'] for result in results}, {'up'})
+
+
+@override_settings(LLM_CACHE_ENABLED=False, LLM_BACKENDS=[], METRICS_TOKEN='secret')
+class TelemetryTests(TestCase):
+
+    def setUp(self):
+        reset_router()
+        metrics.reset()
+        self.addCleanup(reset_router)
+        self.user = User.objects.create_user('kim', password='password')
+        self.client.force_login(self.user)
+
+    @mock.patch('LLM_Metadata.utils._post_completion')
+    def test_usage_is_stored_and_exported(self, post):
+        post.return_value = {
+            'content': 'four words of answer', 'elapsed_time': 1.5, 'ttfb': 0.4,
+            'prompt_tokens': 12, 'completion_tokens': 5, 'response_tokens': 5,
+        }
+        self.client.post(reverse('ask_question'), {
+            'question': 'measured question', 'model': 'mistral-small3.1:latest',
+            'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+        })
+
+        answer = Conversation.objects.get(username='kim', role='assistant')
+        self.assertEqual((answer.prompt_tokens, answer.completion_tokens, answer.token_usage), (12, 5, 5))
+        self.assertEqual((answer.ttfb, answer.backend), (0.4, 'default'))
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        body = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        labels = 'model="mistral-small3.1:latest",backend="default"'
+        self.assertIn(f'llm_request_duration_seconds_bucket{{{labels},le="2.5"}} 1', body)
+        self.assertIn(f'llm_time_to_first_byte_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'llm_prompt_tokens_total{{{labels}}} 12', body)
+
+        out = io.StringIO()
+        call_command('llm_latency_report', stdout=out)
+        self.assertIn('1.50/1.50/1.50', out.getvalue())
+
+
+class UsageRollupTests(QueryBudgetMixin, TestCase):
+
+    def ask(self, username, model, tokens, cache_hit=False):
+        response = {'content': 'answer', 'response_tokens': tokens, 'elapsed_time': 2.0,
+                    'prompt_tokens': 10, 'completion_tokens': tokens, 'cache_hit': cache_hit}
+        save_exchange(username, uuid.uuid4(), 'question', response, model, 0.5, 40, 0.9)
+
+    def rollup_values(self):
+        return sorted(UsageRollup.objects.values_list(
+            'period', 'username', 'model_name', 'requests', 'cache_hits', 'tokens', 'prompt_tokens', 'elapsed_time'
+        ))
+
+    def test_rollups_follow_saves_and_match_a_rebuild(self):
+        self.ask('kim', 'model-a', 5)
+        self.ask('kim', 'model-a', 7, cache_hit=True)
+        self.ask('lee', 'model-b', 3)
+
+        rollup = UsageRollup.objects.get(period='day', username='kim')
+        self.assertEqual((rollup.requests, rollup.cache_hits, rollup.tokens, rollup.elapsed_time), (2, 1, 12, 4.0))
+        self.assertEqual(UsageRollup.objects.filter(period='hour').count(), 2)
+
+        incremental = self.rollup_values()
+        call_command('compact_usage_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollup_values(), incremental)
+
+    def test_large_batches_are_upserted_in_chunks(self):
+        now = timezone.now()
+        answers = [
+            Conversation(role='assistant', username=f'user{i}', model_name='m', token_usage=2, timestamp=now)
+            for i in range(5)
+        ]
+        # 5 users x 2 periods = 10 rollups, in statements of at most 4 rows
+        with mock.patch('LLM_Metadata.rollups.UPSERT_BATCH_ROWS', 4):
+            for _ in range(2):
+                with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as context:
+                    rollups.record_usage(answers)
+                inserts = [query['sql'] for query in context.captured_queries if query['sql'].startswith('INSERT')]
+                self.assertEqual(len(inserts), 3)
+        self.assertEqual(UsageRollup.objects.count(), 10)
+        self.assertEqual({rollup.tokens for rollup in UsageRollup.objects.all()}, {4})
+
+    def test_dashboard_reads_only_rollups(self):
+        self.ask('kim', 'model-a', 5)
+        self.ask('lee', 'model-b', 3)
+        staff = User.objects.create_user('admin', password='password', is_staff=True)
+        self.client.force_login(staff)
+
+        with self.assertMaxQueries(8) as context:
+            response = self.client.get(reverse('usage_dashboard'), {'days': 7})
+        self.assertFalse(any('"conversations"' in query['sql'] for query in context.captured_queries))
+        summary = response.context['summary']
+        self.assertEqual((summary['totals']['requests'], summary['totals']['tokens']), (2, 8))
+        self.assertEqual([row['username'] for row in summary['users']], ['kim', 'lee'])
+
+        # Other users only see their own usage
+        self.client.force_login(User.objects.create_user('lee', password='password'))
+        summary = self.client.get(reverse('usage_dashboard'), {'user': 'kim'}).context['summary']
+        self.assertEqual((summary['totals']['tokens'], summary['users']), (3, []))
+
+
+@override_settings(JSON_VIEWER_NODE_BYTES=200)
+class JSONViewerTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        json_tables._tables.clear()
+        schemas._validators.clear()
+        self.client.force_login(User.objects.create_user('ivy', password='password'))
+
+    def upload(self, data):
+        content = data if isinstance(data, bytes) else json.dumps(data).encode()
+        return self.client.post(reverse('json_viewer'), {'jsonFile': SimpleUploadedFile('data.json', content)})
+
+    def test_large_values_are_served_by_path_and_page(self):
+        records = [{'id': i, 'title': f'record {i}', 'tags': ['a', 'b']} for i in range(50)]
+        response = self.upload({'meta': {'version': 2}, 'records': records})
+        document = JSONDocument.objects.get()
+        self.assertRedirects(response, reverse('json_document', args=[document.key]))
+        # The records array is larger than JSON_VIEWER_NODE_BYTES, so its items are indexed
+        self.assertEqual(document.containers['/records']['length'], 50)
+        self.assertContains(self.client.get(response.url), '&quot;record 42&quot;')
+
+        node_url = reverse('json_document_node', args=[document.key])
+        root = self.client.get(node_url).json()
+        self.assertEqual([child['key'] for child in root['children']], ['meta', 'records'])
+        page = self.client.get(node_url, {'path': '/records', 'offset': 10, 'limit': 5}).json()
+        self.assertEqual([child['key'] for child in page['children']], [10, 11, 12, 13, 14])
+        self.assertEqual(page['next_offset'], 15)
+        self.assertEqual(self.client.get(node_url, {'path': '/records/42/title'}).json()['value'], 'record 42')
+        self.assertEqual(self.client.get(node_url, {'path': '/records/99'}).status_code, 404)
+
+        rows = self.client.get(reverse('json_document_rows', args=[document.key]), {'path': '/records', 'limit': 2}).json()
+        self.assertEqual(rows['columns'], ['id', 'title', 'tags'])
+        self.assertEqual((rows['total'], rows['rows'][1]), (50, [1, 'record 1', ['a', 'b']]))
+
+    def test_table_filters_sorts_and_aggregates(self):
+        records = [{'id': i, 'group': 'even' if i % 2 == 0 else 'odd', 'score': i * 1.5} for i in range(40)]
+        records[3]['score'] = None
+        self.upload({'records': records})
+        document = JSONDocument.objects.get()
+        table_url = reverse('json_document_table', args=[document.key])
+
+        page = self.client.get(table_url, {
+            'path': '/records', 'filter': ['group:eq:odd', 'id:lt:10'], 'sort': 'score', 'order': 'desc'
+        }).json()
+        self.assertEqual(page['total'], 5)
+        # Nulls sort last in either direction
+        self.assertEqual([row[0] for row in page['rows']], [9, 7, 5, 1, 3])
+        self.assertEqual(self.client.get(table_url, {'path': '/records', 'sort': 'nope'}).status_code, 400)
+
+        result = self.client.get(reverse('json_document_aggregate', args=[document.key]), {
+            'path': '/records', 'agg': ['count', 'count:score', 'max:score'], 'group_by': 'group'
+        }).json()
+        self.assertEqual(result['columns'], ['group', 'count', 'count(score)', 'max(score)'])
+        self.assertEqual(result['rows'], [['even', 20, 20, 57.0], ['odd', 20, 19, 58.5]])
+
+    def test_table_cache_is_bounded_by_memory(self):
+        for n in range(3):
+            self.upload([{'id': i, 'name': f'document {n} row {i}'} for i in range(100)])
+        documents = list(JSONDocument.objects.order_by('pk'))
+        size = json_tables.get_table(documents[0], '').nbytes
+        json_tables._tables.clear()
+
+        with override_settings(JSON_VIEWER_TABLE_CACHE_BYTES=int(size * 2.5)):
+            for document in documents:
+                json_tables.get_table(document, '')
+            # The least recently used table made room for the third
+            self.assertEqual([key[0] for key in json_tables._tables], [documents[1].pk, documents[2].pk])
+            with override_settings(JSON_VIEWER_TABLE_CACHE_BYTES=size // 2):
+                json_tables.get_table(documents[0], '')
+            self.assertNotIn((documents[0].pk, ''), json_tables._tables)
+
+    def test_schema_validation_streams_and_reports_paths(self):
+        record = {
+            'type': 'object', 'required': ['testName', 'materialType'], 'additionalProperties': False,
+            'properties': {
+                'testName': {'type': 'string'},
+                'materialType': {'enum': ['Metal', 'Polymer', 'Composite']},
+                'dateConducted': {'type': 'string', 'format': 'date-time'},
+            },
+        }
+        schemas.add_schema_version('tensile', {'type': 'array', 'items': record})
+        # Saving the same schema again doesn't add a version
+        self.assertEqual(schemas.add_schema_version('tensile', {'type': 'array', 'items': record}).version, 1)
+        record['properties']['dateConducted']['type'] = ['string', 'null']
+        self.assertEqual(schemas.add_schema_version('tensile', {'type': 'array', 'items': record}).version, 2)
+        with self.assertRaises(schemas.SchemaError):
+            schemas.add_schema_version('broken', {'$ref': '#/$defs/missing'})
+
+        records = [{'testName': f'test {i}', 'materialType': 'Metal', 'dateConducted': None} for i in range(30)]
+        records[4]['materialType'] = 'Steel'
+        records[7] = {'testName': 7, 'extra': True, 'dateConducted': 'yesterday'}
+        self.upload(records)
+        document = JSONDocument.objects.get()
+        # The array is indexed, so it is validated one record at a time
+        self.assertIn('', document.containers)
+
+        report = self.client.get(reverse('json_document_validate', args=[document.key]), {'schema': 'tensile'}).json()
+        self.assertEqual((report['version'], report['valid'], report['error_count']), (2, False, 5))
+        self.assertEqual(
+            [(error['path'], error['keyword']) for error in report['errors']],
+            [('/4/materialType', 'enum'), ('/7/testName', 'type'), ('/7/extra', 'additionalProperties'),
+             ('/7/dateConducted', 'format'), ('/7', 'required')]
+        )
+        # Version 1 doesn't allow null dates
+        report = self.client.get(reverse('json_document_validate', args=[document.key]), {'schema': 'tensile', 'version': 1}).json()
+        self.assertEqual(report['error_count'], 34)
+
+        self.client.force_login(User.objects.create_user('mia', password='password'))
+        response = self.client.post(
+            reverse('metadata_schema_validate', args=['tensile']),
+            json.dumps(records[3:5]), content_type='application/json'
+        ).json()
+        self.assertEqual([error['path'] for error in response['errors']], ['/1/materialType'])
+        self.assertEqual(self.client.post(reverse('metadata_schema_validate', args=['nope']), '{}', content_type='application/json').status_code, 404)
+
+    def test_mistyped_schema_keywords_are_rejected(self):
+        for schema in ({'properties': []}, {'minItems': '2'}, {'maxProperties': '1'}, {'required': 'abc'},
+                       {'minLength': -1}, {'maximum': '10'}, {'$ref': 5}, {'items': {'allOf': []}}):
+            with self.subTest(schema=schema), self.assertRaises(schemas.SchemaError):
+                schemas.Validator(schema)
+        with self.assertRaises(ValidationError):
+            MetadataSchema(name='broken', version=1, schema={'properties': []}).clean()
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump({'required': 'abc'}, f)
+            f.flush()
+            with self.assertRaisesMessage(CommandError, "required at '/' must be an array of strings."):
+                call_command('load_metadata_schema', 'broken', f.name)
+
+        # Counts may be written as 2.0, and integer bounds compare exactly past 2**53
+        self.assertEqual(schemas.Validator({'minItems': 2.0}).errors([1])[0]['keyword'], 'minItems')
+        big = schemas.Validator({'maximum': 2 ** 53 + 1})
+        self.assertTrue(big.is_valid(2 ** 53 + 1))
+        self.assertFalse(big.is_valid(2 ** 53 + 2))
+
+    def test_invalid_json_reports_where(self):
+        response = self.upload(b'[\n  {"id": 1},\n  {"id": 2,}\n]')
+        self.assertContains(response, 'line 3 column 12 (at /1)')
+        self.assertFalse(JSONDocument.objects.exists())
+
+    def test_documents_are_private_to_their_uploader(self):
+        self.upload({'secret': 1})
+        document = JSONDocument.objects.get()
+        self.assertEqual(document.uploaded_by, 'ivy')
+        self.assertEqual(self.client.get(reverse('json_document_node', args=[document.key])).status_code, 200)
+
+        # The key alone isn't enough; the same file uploaded by someone else is their own copy
+        self.client.force_login(User.objects.create_user('max', password='password'))
+        for name in ('json_document', 'json_document_node', 'json_document_download'):
+            self.assertEqual(self.client.get(reverse(name, args=[document.key])).status_code, 404)
+        self.upload({'secret': 1})
+        self.assertEqual(JSONDocument.objects.filter(sha256=document.sha256).count(), 2)
+
+        self.client.force_login(User.objects.create_user('root', password='password', is_staff=True))
+        self.assertEqual(self.client.get(reverse('json_document_node', args=[document.key])).status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('json_document_node', args=[document.key])).status_code, 302)
+
+    def test_uploads_past_the_quota_are_refused(self):
+        self.upload({'a': 'x' * 100})
+        with override_settings(JSON_VIEWER_USER_QUOTA_BYTES=150):
+            response = self.upload({'b': 'y' * 100})
+        self.assertContains(response, 'quota', status_code=413)
+        self.assertEqual(JSONDocument.objects.count(), 1)
+
+    def test_old_documents_are_pruned_with_their_files(self):
+        self.upload({'old': True})
+        self.upload({'new': True})
+        old, new = JSONDocument.objects.order_by('pk')
+        JSONDocument.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=31))
+        paths = [old.file.path, old.index.path]
+
+        output = io.StringIO()
+        call_command('prune_json_documents', stdout=output)
+        self.assertIn('Deleted 1 JSON documents', output.getvalue())
+        self.assertEqual(list(JSONDocument.objects.all()), [new])
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertTrue(os.path.exists(new.file.path))
+
+
+@override_settings(LLM_CACHE_ENABLED=False, LLM_BACKENDS=[], LLM_EXTRACTION_MAX_REASKS=1)
+class ExtractionTests(TestCase):
+
+    def setUp(self):
+        reset_router()
+        metrics.reset()
+        schemas._validators.clear()
+        self.addCleanup(reset_router)
+        self.client.force_login(User.objects.create_user('nia', password='password'))
+        schemas.add_schema_version('tensile', {
+            'type': 'object', 'required': ['testName', 'materialType'], 'additionalProperties': False,
+            'properties': {
+                'testName': {'type': 'string'},
+                'materialType': {'enum': ['Metal', 'Polymer', 'Composite']},
+                'length': {'type': 'number'},
+            },
+        })
+
+    def extract(self, text='A steel bar, 12.5 mm, tested as T-1.'):
+        return self.client.post(reverse('extract'), json.dumps({'schema': 'tensile', 'text': text}), content_type='application/json')
+
+    def reply(self, content):
+        return {'content': content, 'elapsed_time': 0.5, 'prompt_tokens': 50, 'completion_tokens': 10, 'response_tokens': 10}
+
+    @mock.patch('LLM_Metadata.utils._post_completion')
+    def test_replies_are_repaired_locally_before_reasking(self, post):
+        post.return_value = self.reply("```json\n{'testName': 'T-1', 'materialType': 'metal', 'length': '12.5', 'note': 'x',}\n```")
+        result = self.extract().json()
+        self.assertEqual(result['status'], 'valid')
+        self.assertEqual(result['data'], {'testName': 'T-1', 'materialType': 'Metal', 'length': 12.5})
+        self.assertEqual(result['attempts'], 1)
+        self.assertIn('enum_case', result['repairs'])
+        # The schema goes to the backend as the response format
+        payload = post.call_args[0][1]
+        self.assertEqual(payload['response_format']['json_schema']['schema']['required'], ['testName', 'materialType'])
+
+        # Only replies that local repair can't fix are asked again, with the violations
+        post.side_effect = [self.reply('{"testName": "T-2"}'), self.reply('{"testName": "T-2", "materialType": "Polymer"}')]
+        result = self.extract('A nylon sample T-2.').json()
+        self.assertEqual((result['status'], result['attempts']), ('valid', 2))
+        self.assertIn("'materialType' is a required property", post.call_args[0][1]['messages'][-1]['content'])
+
+        stored = ExtractionResult.objects.get(pk=result['id'])
+        self.assertEqual((stored.prompt_tokens, stored.completion_tokens), (100, 20))
+        listed = self.client.get(reverse('extractions'), {'schema': 'tensile', 'data.materialType': 'Polymer'}).json()
+        self.assertEqual([row['id'] for row in listed['results']], [result['id']])
+
+        body = metrics.render()
+        self.assertIn('llm_extractions_total{model="mistral-small3.1:latest",schema="tensile",outcome="repaired"} 1', body)
+        self.assertIn('llm_extractions_total{model="mistral-small3.1:latest",schema="tensile",outcome="reasked"} 1', body)
+
+    @mock.patch('LLM_Metadata.utils._post_completion')
+    def test_invalid_after_reasks_is_kept(self, post):
+        post.return_value = self.reply('I could not find any metadata.')
+        response = self.extract()
+        self.assertEqual(response.json()['status'], 'invalid')
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(ExtractionResult.objects.get().raw_content, 'I could not find any metadata.')
+
+
+@override_settings(LLM_CACHE_ENABLED=False, LLM_BACKENDS=[], LLM_RETRIEVAL_ENABLED=False, LLM_SEMANTIC_CACHE_ENABLED=True)
+class SemanticCacheTests(TestCase):
+
+    def setUp(self):
+        reset_router()
+        metrics.reset()
+        semantic_cache._indexes.clear()
+        self.addCleanup(reset_router)
+        self.user = User.objects.create_user('ravi', password='password', is_staff=True)
+        self.client.force_login(self.user)
+
+    def ask(self, question, **sampling):
+        self.client.get(reverse('ask_question'))  # Starts a new conversation
+        self.client.post(reverse('ask_question'), {
+            'question': question, 'model': 'mistral-small3.1:latest',
+            'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9, **sampling,
+        })
+        return Conversation.objects.filter(role='assistant').order_by('-pk').first()
+
+    @mock.patch('LLM_Metadata.utils._post_completion')
+    def test_answers_are_only_reused_with_the_same_sampling_settings(self, post):
+        post.return_value = {'content': 'Use the upload field.', 'elapsed_time': 2.0, 'response_tokens': 4}
+        self.ask('How do I upload a JSON file?')
+        for sampling in ({'temperature': 0.9}, {'max_tokens': 20}, {'top_k': 5}, {'top_p': 0.5}):
+            self.assertFalse(self.ask('how do I upload a json file', **sampling).cache_hit)
+        self.assertEqual(post.call_count, 5)
+        self.assertTrue(self.ask('how do I upload a json file').cache_hit)
+        self.assertTrue(self.ask('how do I upload a json file', top_p=0.9).cache_hit)
+        self.assertEqual(post.call_count, 5)
+
+    @mock.patch('LLM_Metadata.utils._post_completion')
+    def test_similar_questions_are_answered_from_earlier_answers(self, post):
+        post.return_value = {'content': 'Use the upload field.', 'elapsed_time': 2.0, 'response_tokens': 4}
+        self.ask('How do I upload a JSON file?')
+        answer = self.ask('how do I upload a json file')
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(answer.content, 'Use the upload field.')
+        self.assertTrue(answer.cache_hit)
+        self.assertGreater(answer.semantic_hit.score, 0.99)
+        self.assertEqual(SemanticCacheEntry.objects.get().hits, 1)
+
+        # Unrelated questions and follow-ups in a conversation still go to the model
+        self.ask('Which models can I choose from?')
+        self.assertEqual(post.call_count, 2)
+        self.client.post(reverse('ask_question'), {
+            'question': 'how do I upload a json file', 'model': 'mistral-small3.1:latest',
+            'max_tokens': 100, 'temperature': 0.5, 'top_k': 40, 'top_p': 0.9,
+        })
+        self.assertEqual(post.call_count, 3)
+
+        # Entries are per user
+        self.client.force_login(User.objects.create_user('mei', password='password'))
+        self.ask('How do I upload a JSON file?')
+        self.assertEqual(post.call_count, 4)
+        self.client.force_login(self.user)
+
+        # A reported false hit drops the entry, so the next similar question gets a fresh answer
+        self.assertEqual(self.client.post(reverse('semantic_cache_feedback', args=[answer.pk])).status_code, 200)
+        self.assertTrue(SemanticCacheHit.objects.get().false_hit)
+        self.ask('How do I upload a JSON file?')
+        self.assertEqual(post.call_count, 5)
+
+        stats = self.client.get(reverse('semantic_cache_stats')).json()
+        model = stats['models']['mistral-small3.1:latest']
+        self.assertEqual((model['hits'], model['false_hits'], model['false_hit_rate']), (1, 1, 1.0))
+        self.assertEqual(stats['worker']['lookups']['mistral-small3.1:latest']['hit'], 1)
+        self.assertGreater(stats['worker']['index_bytes'], 0)
+        body = metrics.render()
+        self.assertIn('llm_semantic_cache_lookups_total{model="mistral-small3.1:latest",outcome="hit"} 1', body)
+        self.assertIn('llm_semantic_cache_false_hit_score_count{model="mistral-small3.1:latest"} 1', body)
+
+
+@override_settings(
+    LLM_BACKENDS=[{'name': 'gpu-1', 'url': 'http://gpu-1/v1/chat/completions'}, {'name': 'gpu-2', 'url': 'http://gpu-2/v1/chat/completions'}],
+    HEALTH_LLM_PROBE_TTL=60,
+)
+class HealthTests(TestCase):
+
+    def setUp(self):
+        reset_router()
+        health._probes.clear()
+        self.addCleanup(reset_router)
+
+    def test_probes_do_not_touch_the_conversations_table(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('health_live')).status_code, 200)
+
+        for _ in range(2):
+            with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as context:
+                response = self.client.post(reverse('health_check'))
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([q['sql'] for q in context.captured_queries if 'INSERT INTO "conversations"' in q['sql']])
+        self.assertEqual(KeepAlive.objects.get().pings, 2)
+        self.assertFalse(Conversation.objects.exists())
+
+        # The endpoint is public, so only configured names get a row
+        self.assertEqual(self.client.post(reverse('health_check') + '?name=' + 'x' * 200).status_code, 400)
+        with override_settings(HEALTH_KEEPALIVE_NAMES=['health_check', 'cron']):
+            self.assertEqual(self.client.post(reverse('health_check') + '?name=cron').status_code, 200)
+        self.assertEqual(sorted(KeepAlive.objects.values_list('name', flat=True)), ['cron', 'health_check'])
+
+    @mock.patch('LLM_Metadata.health.requests.get')
+    def test_readiness_needs_a_reachable_backend(self, get):
+        get.side_effect = [mock.Mock(status_code=200), health.requests.exceptions.ConnectTimeout()]
+        response = self.client.get(reverse('health_ready'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b['reachable'] for b in response.json()['llm_backends']], [True, False])
+        self.assertEqual(get.call_args_list[0][0][0], 'http://gpu-1/v1/models')
+
+        # Probe results are reused until HEALTH_LLM_PROBE_TTL passes
+        self.client.get(reverse('health_ready'))
+        self.assertEqual(get.call_count, 2)
+
+        health._probes.clear()
+        get.side_effect = health.requests.exceptions.ConnectionError()
+        self.assertEqual(self.client.get(reverse('health_ready')).status_code, 503)
+        with override_settings(HEALTH_READY_REQUIRES_LLM=False):
+            self.assertEqual(self.client.get(reverse('health_ready')).status_code, 200)
+
+
+class ConversationExportTests(TestCase):
+
+    def setUp(self):
+        for username in ('alice', 'bob'):
+            for n in range(3):
+                conversation_id = uuid.uuid4()
+                question = Conversation.objects.create(
+                    role='user', content=f'Question {n} “é”', username=username, conversation_id=conversation_id, model_name='m'
+                )
+                answer = Conversation.objects.create(
+                    role='assistant', content=f'Answer {n}', username=username, conversation_id=conversation_id,
+                    model_name='m', token_usage=7
+                )
+                record_turn(question, answer)
+
+    def export(self, **filters):
+        return ''.join(exports.export_stream(exports.export_queryset(**filters), 'ndjson', chunk_size=4))
+
+    def test_round_trip_in_small_batches(self):
+        lines = self.export().splitlines()
+        self.assertEqual(len(lines), 12)
+        self.assertEqual(json.loads(lines[0])['content'], 'Question 0 “é”')
+        self.assertEqual(len(self.export(username='alice', model='m').splitlines()), 6)
+        self.assertEqual(self.export(since=timezone.now() + timedelta(hours=1)), '')
+
+        Conversation.objects.all().delete()
+        Thread.objects.all().delete()
+        # Batches of 5 split question/answer pairs across transactions
+        counts = exports.import_records(exports.read_ndjson(lines), batch_size=5)
+        self.assertEqual(counts, {'messages': 12, 'turns': 6})
+        self.assertEqual(Conversation.objects.count(), 12)
+        self.assertFalse(Turn.objects.filter(assistant_message=None).exists())
+        self.assertEqual(set(Thread.objects.values_list('turn_count', 'total_tokens')), {(1, 7)})
+        self.assertEqual(UsageRollup.objects.filter(period='day').get(username='bob').requests, 3)
+
+    def test_parquet_round_trip(self):
+        data = io.BytesIO(b''.join(exports.export_stream(exports.export_queryset(), 'parquet', chunk_size=4)))
+        records = list(exports.read_parquet(data, batch_size=5))
+        self.assertEqual(
+            [(record['id'], record['content']) for record in records],
+            [(record['id'], record['content']) for record in map(json.loads, self.export().splitlines())]
+        )
+
+        Conversation.objects.all().delete()
+        Thread.objects.all().delete()
+        self.assertEqual(exports.import_records(records), {'messages': 12, 'turns': 6})
+        self.assertEqual(Conversation.objects.filter(content='Question 0 “é”').count(), 2)
+
+    def test_paged_by_primary_key_without_server_side_cursors(self):
+        exported = self.export()
+        with mock.patch.dict(connections[DEFAULT_DB_ALIAS].settings_dict, DISABLE_SERVER_SIDE_CURSORS=True):
+            with self.assertNumQueries(4):  # Pages of 4, 4 and 4 rows, then an empty one
+                self.assertEqual(self.export(), exported)
+
+    def test_export_view_is_limited_to_the_users_messages(self):
+        self.client.force_login(User.objects.create_user('alice', password='x'))
+        response = self.client.get(reverse('conversation_export'), {'user': 'bob'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual({record['username'] for record in records}, {'alice'})
+        self.assertEqual(self.client.get(reverse('conversation_export'), {'since': 'soon'}).status_code, 400)
+
+
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db', AUTH_USER_CACHE_TTL=300, HISTORY_FRAGMENT_TTL=600
+)
+class PageCacheTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('lena', password='password')
+        self.client.force_login(self.user)
+
+    def test_history_fragment_is_cached_until_the_history_changes(self):
+        create_turns(self.user.username, 5)
+        self.assertContains(self.client.get(reverse('conversation')), 'answer 4')
+
+        # Session, user and history all come from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('conversation'))
+        self.assertContains(response, 'answer 4')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            save_exchange(self.user.username, uuid.uuid4(), 'new question', {
+                'content': 'fresh answer', 'elapsed_time': 0.1, 'response_tokens': 2
+            }, 'mistral-small3.1:latest', 0.5, 40, 0.9)
+        self.assertContains(self.client.get(reverse('conversation')), 'fresh answer')
+
+        question = Conversation.objects.get(content='new question')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_conversation', args=[question.pk]))
+        self.assertNotContains(self.client.get(reverse('conversation')), 'fresh answer')
+
+    def test_cached_user_is_dropped_when_saved(self):
+        self.client.get(reverse('conversation'))
+        self.user.set_password('changed')
+        self.user.save()
+        # The session's auth hash no longer matches, so it is signed out
+        response = self.client.get(reverse('conversation'))
+        self.assertEqual(response.status_code, 302)
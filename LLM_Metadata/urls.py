@@ -1,12 +1,38 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('conversation/', views.conversation_view, name='conversation'),
+    path('conversation/history/', views.conversation_history_view, name='conversation_history'),
+    path('conversation/export/', views.conversation_export_view, name='conversation_export'),
     # path('delete_conversation/<uuid:conversation_id>/', views.delete_conversation, name='delete_conversation'),
-    path('ask/', views.ask_question_view, name='ask_question'),
+    path('ask/', views.ask_question_async_view if settings.LLM_ASYNC_VIEWS else views.ask_question_view, name='ask_question'),
+    path(
+        'ask/stream/', views.ask_question_stream_async_view if settings.LLM_ASYNC_VIEWS else views.ask_question_stream_view,
+        name='ask_question_stream'
+    ),
+    path('ask/jobs/', views.ask_question_job_view, name='ask_question_job'),
+    path('ask/batch/', views.ask_batch_view, name='ask_batch'),
+    path('ask/jobs/<uuid:job_id>/', views.job_status_view, name='job_status'),
+    path('ask/<int:message_id>/not-similar/', views.semantic_cache_feedback_view, name='semantic_cache_feedback'),
+    path('semantic-cache/', views.semantic_cache_stats_view, name='semantic_cache_stats'),
+    path('extract/', views.extract_view, name='extract'),
+    path('extractions/', views.extractions_view, name='extractions'),
+    path('usage/', views.usage_dashboard_view, name='usage_dashboard'),
     path('json-viewer/', views.json_viewer, name='json_viewer'),
+    path('json-viewer/<uuid:key>/', views.json_document_view, name='json_document'),
+    path('json-viewer/<uuid:key>/node/', views.json_document_node_view, name='json_document_node'),
+    path('json-viewer/<uuid:key>/rows/', views.json_document_rows_view, name='json_document_rows'),
+    path('json-viewer/<uuid:key>/table/', views.json_document_table_view, name='json_document_table'),
+    path('json-viewer/<uuid:key>/table/aggregate/', views.json_document_aggregate_view, name='json_document_aggregate'),
+    path('json-viewer/<uuid:key>/validate/', views.json_document_validate_view, name='json_document_validate'),
+    path('schemas/<str:name>/validate/', views.metadata_schema_validate_view, name='metadata_schema_validate'),
+    path('json-viewer/<uuid:key>/download/', views.json_document_download_view, name='json_document_download'),
         path('delete_conversation/<int:user_convo_id>/', views.delete_conversation, name='delete_conversation'),
     path('health/', views.health_check, name='health_check'),
+    path('health/live/', views.health_live_view, name='health_live'),
+    path('health/ready/', views.health_ready_view, name='health_ready'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
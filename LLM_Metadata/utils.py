@@ -1,9 +1,25 @@
-import os
+import json
+import time
+import asyncio
+import weakref
+import threading
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from .llm_cache import (
+    response_cache_key, get_cached_response, cache_response,
+    aget_cached_response, acache_response,
+)
+from .router import get_router, is_backend_failure
+from .metrics import record_request
 
-def query_api(messages, model, temperature=0.7, max_tokens=600, top_k=40, top_p=0.9):
-    url = os.getenv('API_URL')
-    headers = {"Authorization": f"Bearer {os.getenv('API_KEY')}"}
+# Upstream statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _payload(messages, model, temperature, max_tokens, top_k, top_p, **extra):
     payload = {
         "model": model,
         "messages": messages,
@@ -12,8 +28,142 @@ def query_api(messages, model, temperature=0.7, max_tokens=600, top_k=40, top_p=
         "top_k": top_k,
         "top_p": top_p
     }
+    payload.update(extra)
+    return payload
+
+
+def _timeout():
+    return (settings.LLM_CONNECT_TIMEOUT, settings.LLM_READ_TIMEOUT)
+
+
+def _usage(body):
+    # OpenAI-compatible servers report usage; Ollama's native API reports eval counts
+    usage = body.get('usage') or {}
+    prompt_tokens = usage.get('prompt_tokens', body.get('prompt_eval_count'))
+    completion_tokens = usage.get('completion_tokens', body.get('eval_count'))
+    return prompt_tokens, completion_tokens
+
+
+def _answer(body, elapsed_time, ttfb):
+    content = body.get('choices', [])[0].get('message', {}).get('content', '')
+    prompt_tokens, completion_tokens = _usage(body)
+    return {
+        "content": content,
+        "elapsed_time": elapsed_time,
+        "ttfb": ttfb,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        # Word count only when the backend doesn't report usage
+        "response_tokens": completion_tokens if completion_tokens is not None else len(content.split())
+    }
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the worker-wide requests.Session used for the LLM backends. Its
+    connection pools keep connections to each backend alive between requests
+    and retry 429/5xx responses with exponential backoff.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=settings.LLM_MAX_RETRIES,
+                    connect=settings.LLM_MAX_RETRIES,
+                    # A read timeout means the model was generating; retrying would pay for it twice
+                    read=0,
+                    status=settings.LLM_MAX_RETRIES,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=frozenset(['POST']),
+                    backoff_factor=settings.LLM_RETRY_BACKOFF,
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=settings.LLM_HTTP_POOL_SIZE,
+                    pool_maxsize=settings.LLM_HTTP_POOL_SIZE,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def _cache_key(messages, model, temperature, max_tokens, top_k, top_p, use_cache, response_format=None, username=None):
+    if not (use_cache and settings.LLM_CACHE_ENABLED):
+        return None
+    return response_cache_key(messages, model, temperature, max_tokens, top_k, top_p, response_format, username)
+
+
+def query_api(messages, model, temperature=0.7, max_tokens=600, top_k=40, top_p=0.9, use_cache=True, response_format=None,
+              username=None):
+    """
+    Send a chat completion request, answering from the response cache when
+    the same messages and parameters were asked before. The result carries
+    ``cache_hit`` so callers can record it. ``response_format`` is passed
+    to the backend as is, e.g. to ask for JSON output. ``username`` is the
+    user the messages were built for; see response_cache_key.
+    """
+    cache_key = _cache_key(messages, model, temperature, max_tokens, top_k, top_p, use_cache, response_format, username)
+    if cache_key:
+        cached = get_cached_response(cache_key)
+        if cached:
+            record_request(model, 'cache', cached)
+            return cached
+
+    result = _request_completion(messages, model, temperature, max_tokens, top_k, top_p, response_format)
+    if 'error' not in result:
+        result['cache_hit'] = False
+        if cache_key:
+            cache_response(cache_key, result)
+    return result
 
-    response = requests.post(url, json=payload, headers=headers)
+
+def _no_backend(model):
+    return {"error": f"No backend available for model {model}", "status_code": 503}
+
+
+def _request_completion(messages, model, temperature, max_tokens, top_k, top_p, response_format=None):
+    # Try backends in the router's order of preference until one answers
+    extra = {"response_format": response_format} if response_format else {}
+    payload = _payload(messages, model, temperature, max_tokens, top_k, top_p, **extra)
+    router = get_router()
+    tried = []
+    result = _no_backend(model)
+    while True:
+        backend = router.acquire(model, exclude=tried)
+        if backend is None:
+            if not tried:
+                record_request(model, None, result)
+            return result
+        tried.append(backend)
+        start = time.monotonic()
+        result = None
+        try:
+            result = _post_completion(backend, payload)
+        finally:
+            failed = result is None or is_backend_failure(result)
+            router.release(backend, ok=not failed, elapsed=time.monotonic() - start if result and 'error' not in result else None)
+        record_request(model, backend.name, result or {"error": "exception"})
+        if not failed:
+            if 'error' not in result:
+                result['backend'] = backend.name
+            return result
+
+
+def _post_completion(backend, payload):
+    start = time.monotonic()
+    try:
+        response = get_session().post(backend.url, json=payload, headers=backend.headers(), timeout=_timeout())
+    except requests.exceptions.RequestException as e:
+        return {"error": f"Request failed: {e}", "status_code": None}
 
     try:
         response_json = response.json()  # Try to parse JSON response
@@ -23,12 +173,395 @@ def query_api(messages, model, temperature=0.7, max_tokens=600, top_k=40, top_p=
         return {"error": f"Non-JSON response: {response.text}", "status_code": response.status_code}
 
     if response.status_code == 200:
-        choice = response_json.get('choices', [])[0].get('message', {}).get('content', '')
-        return {
-            "content": choice,
-            "elapsed_time": response.elapsed.total_seconds(),
-            "response_tokens": len(choice.split())
-        }
+        # response.elapsed stops when the headers arrive; without streaming that is
+        # after generation, so it approximates the time to first byte
+        return _answer(response_json, time.monotonic() - start, response.elapsed.total_seconds())
+    else:
+        error_message = response_json.get('error', 'Unknown error occurred')
+        return {"error": f"Error: {error_message}", "status_code": response.status_code}
+
+
+# One pooled AsyncClient per event loop. Under an ASGI server there is a single
+# loop per worker, so every request in that worker shares the same connections.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the shared, connection-pooled httpx.AsyncClient for the running
+    event loop, creating it on first use.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.LLM_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_ASYNC_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(settings.LLM_READ_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _backoff(attempt, retry_after=None):
+    # Same schedule as urllib3's Retry: backoff_factor * 2 ** (attempt - 1), honouring Retry-After
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return settings.LLM_RETRY_BACKOFF * (2 ** (attempt - 1))
+
+
+async def aquery_api(messages, model, temperature=0.7, max_tokens=600, top_k=40, top_p=0.9, use_cache=True, username=None):
+    """
+    Async variant of query_api. The request goes through the shared
+    AsyncClient, so awaiting the LLM does not block the worker.
+    """
+    cache_key = _cache_key(messages, model, temperature, max_tokens, top_k, top_p, use_cache, username=username)
+    if cache_key:
+        cached = await aget_cached_response(cache_key)
+        if cached:
+            record_request(model, 'cache', cached)
+            return cached
+
+    result = await _arequest_completion(messages, model, temperature, max_tokens, top_k, top_p)
+    if 'error' not in result:
+        result['cache_hit'] = False
+        if cache_key:
+            await acache_response(cache_key, result)
+    return result
+
+
+async def _arequest_completion(messages, model, temperature, max_tokens, top_k, top_p):
+    payload = _payload(messages, model, temperature, max_tokens, top_k, top_p)
+    router = get_router()
+    tried = []
+    result = _no_backend(model)
+    while True:
+        backend = await router.aacquire(model, exclude=tried)
+        if backend is None:
+            if not tried:
+                record_request(model, None, result)
+            return result
+        tried.append(backend)
+        start = time.monotonic()
+        result = None
+        try:
+            result = await _apost_completion(backend, payload)
+        finally:
+            failed = result is None or is_backend_failure(result)
+            router.release(backend, ok=not failed, elapsed=time.monotonic() - start if result and 'error' not in result else None)
+        record_request(model, backend.name, result or {"error": "exception"})
+        if not failed:
+            if 'error' not in result:
+                result['backend'] = backend.name
+            return result
+
+
+async def _apost_completion(backend, payload):
+    client = get_async_client()
+    attempt = 0
+    while True:
+        start = time.monotonic()
+        try:
+            request = client.build_request('POST', backend.url, json=payload, headers=backend.headers())
+            # Send without reading the body so the time to the headers can be measured
+            response = await client.send(request, stream=True)
+            ttfb = time.monotonic() - start
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+        except httpx.HTTPError as e:
+            if isinstance(e, httpx.ConnectError) and attempt < settings.LLM_MAX_RETRIES:
+                attempt += 1
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            return {"error": f"Request failed: {e}", "status_code": None}
+        if response.status_code in RETRY_STATUSES and attempt < settings.LLM_MAX_RETRIES:
+            attempt += 1
+            await asyncio.sleep(_backoff(attempt, response.headers.get('Retry-After')))
+            continue
+        break
+
+    try:
+        response_json = response.json()
+    except ValueError:
+        print("Non-JSON response received:", response.text)
+        return {"error": f"Non-JSON response: {response.text}", "status_code": response.status_code}
+
+    if response.status_code == 200:
+        return _answer(response_json, time.monotonic() - start, ttfb)
     else:
         error_message = response_json.get('error', 'Unknown error occurred')
-        return {"error": f"Error: {error_message}", "status_code": response.status_code}
\ No newline at end of file
+        return {"error": f"Error: {error_message}", "status_code": response.status_code}
+
+
+def _stream_delta(chunk):
+    # OpenAI-compatible servers send choices[0].delta; Ollama's native API sends message
+    choices = chunk.get('choices') or [{}]
+    delta = choices[0].get('delta') or choices[0].get('message') or chunk.get('message') or {}
+    return delta.get('content') or ''
+
+
+def query_api_stream(messages, model, temperature=0.7, max_tokens=600, top_k=40, top_p=0.9, use_cache=True, username=None):
+    """
+    Streaming variant of query_api. Sends the request with ``stream: true`` and
+    yields ``{"content": ...}`` for every chunk the backend produces, followed
+    by a final ``{"done": True, ...}`` summary. Errors are yielded as a single
+    ``{"error": ...}`` dict, mirroring query_api. A cached answer is yielded as
+    one chunk.
+    """
+    cache_key = _cache_key(messages, model, temperature, max_tokens, top_k, top_p, use_cache, username=username)
+    if cache_key:
+        cached = get_cached_response(cache_key)
+        if cached:
+            record_request(model, 'cache', cached)
+            yield {"content": cached["content"]}
+            yield dict(cached, done=True, first_chunk_time=cached["elapsed_time"])
+            return
+
+    extra = {"stream_options": {"include_usage": True}} if settings.LLM_STREAM_INCLUDE_USAGE else {}
+    payload = _payload(messages, model, temperature, max_tokens, top_k, top_p, stream=True, **extra)
+    router = get_router()
+    tried = []
+    error = _no_backend(model)
+    start = time.monotonic()
+    # Fail over only until a backend starts answering; a started stream can't move
+    while True:
+        backend = router.acquire(model, exclude=tried)
+        if backend is None:
+            if not tried:
+                record_request(model, None, error)
+            yield error
+            return
+        tried.append(backend)
+        response, error = _open_stream(backend, payload)
+        if error is None:
+            break
+        router.release(backend, ok=not is_backend_failure(error))
+        record_request(model, backend.name, error)
+        if not is_backend_failure(error):
+            yield error
+            return
+
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+
+    ttfb = time.monotonic() - start
+    parts = []
+    first_chunk_time = None
+    usage = (None, None)
+    failed = completed = False
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            chunk, finished = _stream_chunk(line)
+            if finished:
+                break
+            if chunk is None:
+                continue
+            if chunk.get('error'):
+                failed = True
+                error = {"error": f"Error: {chunk['error']}", "status_code": response.status_code}
+                record_request(model, backend.name, error)
+                yield error
+                return
+            if chunk.get('usage') or chunk.get('eval_count') is not None:
+                usage = _usage(chunk)
+            delta = _stream_delta(chunk)
+            if delta:
+                if first_chunk_time is None:
+                    first_chunk_time = time.monotonic() - start
+                parts.append(delta)
+                yield {"content": delta}
+            if chunk.get('done') is True:
+                break
+        completed = True
+    except requests.exceptions.RequestException as e:
+        # e.g. the read timeout expiring between two chunks
+        failed = True
+        error = {"error": f"Request failed: {e}", "status_code": None}
+        record_request(model, backend.name, error)
+        yield error
+        return
+    finally:
+        # A client that disconnects mid-stream says nothing about the backend
+        response.close()
+        router.release(backend, ok=not failed, elapsed=time.monotonic() - start if completed else None)
+
+    result = _stream_result(parts, usage, start, ttfb, first_chunk_time, backend)
+    record_request(model, backend.name, result)
+    if cache_key:
+        cache_response(cache_key, result)
+    yield result
+
+
+def _stream_chunk(line):
+    # (chunk, finished) for one line of a streamed response; chunk is None for lines to skip
+    # Server-Sent Events prefix each payload with "data:"; NDJSON streams don't
+    if not line or line.startswith(':'):
+        return None, False
+    if line.startswith('data:'):
+        line = line[len('data:'):].strip()
+    if line == '[DONE]':
+        return None, True
+    try:
+        return json.loads(line), False
+    except ValueError:
+        return None, False
+
+
+def _stream_result(parts, usage, start, ttfb, first_chunk_time, backend):
+    # The final {"done": True, ...} summary of a finished stream
+    content = ''.join(parts)
+    prompt_tokens, completion_tokens = usage
+    return {
+        "done": True,
+        "content": content,
+        "elapsed_time": time.monotonic() - start,
+        "ttfb": ttfb,
+        "first_chunk_time": first_chunk_time,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "response_tokens": completion_tokens if completion_tokens is not None else len(content.split()),
+        "cache_hit": False,
+        "backend": backend.name
+    }
+
+
+def _open_stream(backend, payload):
+    # Returns (response, None) once the backend has accepted the request, else (None, error)
+    try:
+        response = get_session().post(
+            backend.url, json=payload, headers=backend.headers(), stream=True, timeout=_timeout()
+        )
+    except requests.exceptions.RequestException as e:
+        return None, {"error": f"Request failed: {e}", "status_code": None}
+
+    if response.status_code != 200:
+        try:
+            error_message = response.json().get('error', 'Unknown error occurred')
+        except requests.exceptions.JSONDecodeError:
+            error_message = response.text
+        response.close()
+        return None, {"error": f"Error: {error_message}", "status_code": response.status_code}
+    return response, None
+
+
+async def aquery_api_stream(messages, model, temperature=0.7, max_tokens=600, top_k=40, top_p=0.9, use_cache=True,
+                            username=None):
+    """
+    Async variant of query_api_stream for ASGI workers. Chunks are read from
+    the shared AsyncClient as they arrive, so each one can be sent to the
+    browser before the backend has finished.
+    """
+    cache_key = _cache_key(messages, model, temperature, max_tokens, top_k, top_p, use_cache, username=username)
+    if cache_key:
+        cached = await aget_cached_response(cache_key)
+        if cached:
+            record_request(model, 'cache', cached)
+            yield {"content": cached["content"]}
+            yield dict(cached, done=True, first_chunk_time=cached["elapsed_time"])
+            return
+
+    extra = {"stream_options": {"include_usage": True}} if settings.LLM_STREAM_INCLUDE_USAGE else {}
+    payload = _payload(messages, model, temperature, max_tokens, top_k, top_p, stream=True, **extra)
+    router = get_router()
+    tried = []
+    error = _no_backend(model)
+    start = time.monotonic()
+    # Fail over only until a backend starts answering; a started stream can't move
+    while True:
+        backend = await router.aacquire(model, exclude=tried)
+        if backend is None:
+            if not tried:
+                record_request(model, None, error)
+            yield error
+            return
+        tried.append(backend)
+        response, error = await _aopen_stream(backend, payload)
+        if error is None:
+            break
+        router.release(backend, ok=not is_backend_failure(error))
+        record_request(model, backend.name, error)
+        if not is_backend_failure(error):
+            yield error
+            return
+
+    ttfb = time.monotonic() - start
+    parts = []
+    first_chunk_time = None
+    usage = (None, None)
+    failed = completed = False
+    try:
+        async for line in response.aiter_lines():
+            chunk, finished = _stream_chunk(line)
+            if finished:
+                break
+            if chunk is None:
+                continue
+            if chunk.get('error'):
+                failed = True
+                error = {"error": f"Error: {chunk['error']}", "status_code": response.status_code}
+                record_request(model, backend.name, error)
+                yield error
+                return
+            if chunk.get('usage') or chunk.get('eval_count') is not None:
+                usage = _usage(chunk)
+            delta = _stream_delta(chunk)
+            if delta:
+                if first_chunk_time is None:
+                    first_chunk_time = time.monotonic() - start
+                parts.append(delta)
+                yield {"content": delta}
+            if chunk.get('done') is True:
+                break
+        completed = True
+    except httpx.HTTPError as e:
+        failed = True
+        error = {"error": f"Request failed: {e}", "status_code": None}
+        record_request(model, backend.name, error)
+        yield error
+        return
+    finally:
+        await response.aclose()
+        router.release(backend, ok=not failed, elapsed=time.monotonic() - start if completed else None)
+
+    result = _stream_result(parts, usage, start, ttfb, first_chunk_time, backend)
+    record_request(model, backend.name, result)
+    if cache_key:
+        await acache_response(cache_key, result)
+    yield result
+
+
+async def _aopen_stream(backend, payload):
+    # Like _open_stream, retrying connection errors and retryable statuses as _apost_completion does
+    client = get_async_client()
+    attempt = 0
+    while True:
+        try:
+            request = client.build_request('POST', backend.url, json=payload, headers=backend.headers())
+            response = await client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            if isinstance(e, httpx.ConnectError) and attempt < settings.LLM_MAX_RETRIES:
+                attempt += 1
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            return None, {"error": f"Request failed: {e}", "status_code": None}
+        if response.status_code == 200:
+            return response, None
+        try:
+            await response.aread()
+        except httpx.HTTPError as e:
+            return None, {"error": f"Request failed: {e}", "status_code": response.status_code}
+        finally:
+            await response.aclose()
+        if response.status_code in RETRY_STATUSES and attempt < settings.LLM_MAX_RETRIES:
+            attempt += 1
+            await asyncio.sleep(_backoff(attempt, response.headers.get('Retry-After')))
+            continue
+        try:
+            error_message = response.json().get('error', 'Unknown error occurred')
+        except ValueError:
+            error_message = response.text
+        return None, {"error": f"Error: {error_message}", "status_code": response.status_code}
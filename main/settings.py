@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 import dj_database_url
 if os.path.isfile('env.py'):
@@ -103,6 +104,93 @@ WSGI_APPLICATION = 'main.wsgi.application'
 DATABASES = {
     'default': dj_database_url.parse(os.environ.get("DATABASE_URL"))
 }
+# dj-database-url 0.5 still names the PostgreSQL backend by its pre-Django 3.0 alias
+if DATABASES['default'].get('ENGINE') == 'django.db.backends.postgresql_psycopg2':
+    DATABASES['default']['ENGINE'] = 'django.db.backends.postgresql'
+
+# Connection reuse. Each sync worker thread keeps its connection for
+# DB_CONN_MAX_AGE seconds instead of reconnecting to the remote host on every
+# request, and checks it is still usable before reusing it. Under ASGI
+# (LLM_ASYNC_VIEWS) persistent connections aren't reliable, so they default to
+# off; put a pooler such as pgbouncer or Supabase's Supavisor in front instead.
+# Size the pool for web workers x threads + run_llm_worker processes.
+_ASYNC_WORKERS = os.environ.get("LLM_ASYNC_VIEWS", "False").lower() in ("1", "true", "yes")
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get("DB_CONN_MAX_AGE", 0 if _ASYNC_WORKERS else 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.environ.get("DB_CONN_HEALTH_CHECKS", "True").lower() in ("1", "true", "yes")
+# 'transaction' when connecting through a transaction-mode pooler (pgbouncer,
+# or Supabase's pooler on port 6543, the default there): a connection may
+# change between transactions, so server-side cursors and prepared statements
+# can't be used. 'session' for direct connections and session-mode pools.
+DB_POOL_MODE = os.environ.get("DB_POOL_MODE") or (
+    'transaction' if DATABASES['default'].get('PORT') in (6543, '6543') else 'session'
+)
+if DB_POOL_MODE == 'transaction' and 'postgresql' in DATABASES['default']['ENGINE']:
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+    try:
+        import psycopg  # noqa: F401
+    except ImportError:  # psycopg2 never prepares statements
+        pass
+    else:
+        DATABASES['default'].setdefault('OPTIONS', {})['prepare_threshold'] = None
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# CACHE_BACKEND / LLM_CACHE_BACKEND take a dotted backend path or one of the
+# names below. The local-memory backend (the default) is an in-process LRU that
+# evicts least-recently-used entries once MAX_ENTRIES is reached; it suits a
+# single process. Point the backends at a local Redis or Memcached server
+# (e.g. CACHE_BACKEND=redis, CACHE_LOCATION=redis://127.0.0.1:6379/0) to share
+# the cache between workers.
+
+_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def _cache_backend(name):
+    return _CACHE_BACKENDS.get(name, name)
+
+
+def _cache_options(backend, max_entries):
+    # MAX_ENTRIES only applies to the local-memory backend; Redis and Memcached clients reject it
+    return {'MAX_ENTRIES': max_entries} if backend == _CACHE_BACKENDS['locmem'] else {}
+
+
+_DEFAULT_CACHE_BACKEND = _cache_backend(os.environ.get("CACHE_BACKEND", 'locmem'))
+_LLM_CACHE_BACKEND = _cache_backend(os.environ.get("LLM_CACHE_BACKEND", 'locmem'))
+
+CACHES = {
+    'default': {
+        'BACKEND': _DEFAULT_CACHE_BACKEND,
+        'LOCATION': os.environ.get("CACHE_LOCATION", 'default'),
+        'TIMEOUT': int(os.environ.get("CACHE_TTL", 300)),
+        'KEY_PREFIX': os.environ.get("CACHE_KEY_PREFIX", ''),
+        'OPTIONS': _cache_options(_DEFAULT_CACHE_BACKEND, int(os.environ.get("CACHE_MAX_ENTRIES", 5000))),
+    },
+    'llm_responses': {
+        'BACKEND': _LLM_CACHE_BACKEND,
+        'LOCATION': os.environ.get("LLM_CACHE_LOCATION", 'llm-responses'),
+        'TIMEOUT': int(os.environ.get("LLM_CACHE_TTL", 60 * 60 * 24)),
+        'OPTIONS': _cache_options(_LLM_CACHE_BACKEND, int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 1000))),
+    },
+}
+
+# Whether every process serving requests sees the same default cache. Cached
+# sessions, users and page fragments are only safe then: with a per-process
+# cache, a change made in one worker leaves the others serving stale copies.
+# True for Redis/Memcached; set CACHE_SHARED=True for a single-process
+# deployment on the local-memory backend.
+CACHE_SHARED = os.environ.get(
+    "CACHE_SHARED", str(_DEFAULT_CACHE_BACKEND not in (_CACHE_BACKENDS['locmem'], _CACHE_BACKENDS['dummy']))
+).lower() in ("1", "true", "yes")
+
+# Sessions are read from the cache and written through to the database
+SESSION_ENGINE = os.environ.get("SESSION_ENGINE") or (
+    'django.contrib.sessions.backends.cached_db' if CACHE_SHARED else 'django.contrib.sessions.backends.db'
+)
 
 CSRF_TRUSTED_ORIGINS = [
     "https://*.codeinstitute-ide.net/",
@@ -167,7 +255,10 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Add the authentication backends
 AUTHENTICATION_BACKENDS = (
-    
+    # The default and allauth backends, with the signed-in user cached (auth_backends.py)
+    'LLM_Metadata.auth_backends.CachedModelBackend',
+    'LLM_Metadata.auth_backends.CachedAuthenticationBackend',
+    # Kept so sessions signed in before the cached backends existed stay valid
     'django.contrib.auth.backends.ModelBackend',  # Default
     'allauth.account.auth_backends.AuthenticationBackend',  # Allauth
 )
@@ -218,3 +309,157 @@ EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+
+# LLM backend HTTP client
+# Timeouts are in seconds; the read timeout has to cover a full generation.
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 5))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 300))
+# Keep-alive connections to the backend pooled per sync worker (one per thread is enough)
+LLM_HTTP_POOL_SIZE = int(os.environ.get("LLM_HTTP_POOL_SIZE", 10))
+# Retries for connection errors and 429/5xx responses, with exponential backoff
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+LLM_RETRY_BACKOFF = float(os.environ.get("LLM_RETRY_BACKOFF", 0.5))
+# Exact-match cache of LLM answers (see CACHES['llm_responses'] for TTL and size)
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "True").lower() in ("1", "true", "yes")
+LLM_CACHE_ALIAS = 'llm_responses'
+# Upper bound on concurrent upstream connections held by one ASGI worker
+LLM_ASYNC_MAX_CONNECTIONS = int(os.environ.get("LLM_ASYNC_MAX_CONNECTIONS", 200))
+# Serve /ask/ with the async view (set this when running under the ASGI profile)
+LLM_ASYNC_VIEWS = os.environ.get("LLM_ASYNC_VIEWS", "False").lower() in ("1", "true", "yes")
+# Token budget for the prompt (history + question + reserved reply tokens).
+# Older turns are dropped once a conversation outgrows it. Counts are
+# approximate: tiktoken isn't in requirements.txt, and even when installed its
+# encodings aren't the tokenizers of the Ollama models, so set this somewhat
+# below the model's real context window.
+LLM_CONTEXT_TOKEN_BUDGET = int(os.environ.get("LLM_CONTEXT_TOKEN_BUDGET", 8192))
+# tiktoken encoding used for counting when tiktoken is installed; otherwise
+# four characters count as one token
+LLM_TOKENIZER_ENCODING = os.environ.get("LLM_TOKENIZER_ENCODING", "cl100k_base")
+# Seconds a conversation's prepared message list stays in the default cache
+LLM_CONTEXT_CACHE_TTL = int(os.environ.get("LLM_CONTEXT_CACHE_TTL", 3600))
+# Uploaded context files are stored as chunks of at most this many tokens,
+# and at most LLM_UPLOAD_CONTEXT_TOKENS of the most relevant chunks go into a prompt
+LLM_UPLOAD_CHUNK_TOKENS = int(os.environ.get("LLM_UPLOAD_CHUNK_TOKENS", 500))
+LLM_UPLOAD_CONTEXT_TOKENS = int(os.environ.get("LLM_UPLOAD_CONTEXT_TOKENS", 2000))
+# Largest single JSON value (in characters) buffered while parsing; larger ones are chunked as text
+LLM_UPLOAD_JSON_VALUE_LIMIT = int(os.environ.get("LLM_UPLOAD_JSON_VALUE_LIMIT", 1024 * 1024))
+# Retrieval of passages from a user's other uploads and conversations (retrieval.py).
+# BM25 by default; set LLM_RETRIEVAL_EMBEDDER to the dotted path of a callable
+# mapping a list of texts to vectors to use a NumPy cosine-similarity index instead.
+LLM_RETRIEVAL_ENABLED = os.environ.get("LLM_RETRIEVAL_ENABLED", "True").lower() in ("1", "true", "yes")
+LLM_RETRIEVAL_TOP_K = int(os.environ.get("LLM_RETRIEVAL_TOP_K", 5))
+LLM_RETRIEVAL_CONTEXT_TOKENS = int(os.environ.get("LLM_RETRIEVAL_CONTEXT_TOKENS", 1500))
+LLM_RETRIEVAL_EMBEDDER = os.environ.get("LLM_RETRIEVAL_EMBEDDER", "")
+# Passages need at least this BM25 score, or this cosine similarity with an
+# embedder, and are dropped when this share of their words (Jaccard) are the
+# question's own, like an earlier copy of the same question
+LLM_RETRIEVAL_MIN_SCORE = float(os.environ.get("LLM_RETRIEVAL_MIN_SCORE", 1.0))
+LLM_RETRIEVAL_MIN_SIMILARITY = float(os.environ.get("LLM_RETRIEVAL_MIN_SIMILARITY", 0.35))
+LLM_RETRIEVAL_DUPLICATE_OVERLAP = float(os.environ.get("LLM_RETRIEVAL_DUPLICATE_OVERLAP", 0.8))
+# Per-user indexes kept in memory by each worker
+LLM_RETRIEVAL_MAX_INDEXES = int(os.environ.get("LLM_RETRIEVAL_MAX_INDEXES", 100))
+# Job mode (/ask/jobs/): questions queued in the database and answered by
+# `python manage.py run_llm_worker` processes
+LLM_JOB_MAX_QUEUE_DEPTH = int(os.environ.get("LLM_JOB_MAX_QUEUE_DEPTH", 500))
+# Jobs running at once per model across all workers, e.g. '{"mistral-small3.1:latest": 8}'
+LLM_JOB_MODEL_CONCURRENCY = json.loads(os.environ.get("LLM_JOB_MODEL_CONCURRENCY", "{}"))
+LLM_JOB_DEFAULT_CONCURRENCY = int(os.environ.get("LLM_JOB_DEFAULT_CONCURRENCY", 4))
+# Attempts per job, retried after LLM_JOB_RETRY_BACKOFF seconds, doubled each time
+LLM_JOB_MAX_ATTEMPTS = int(os.environ.get("LLM_JOB_MAX_ATTEMPTS", 3))
+LLM_JOB_RETRY_BACKOFF = float(os.environ.get("LLM_JOB_RETRY_BACKOFF", 5))
+# Running jobs older than this (seconds) are assumed lost and requeued
+LLM_JOB_STALE_AFTER = int(os.environ.get("LLM_JOB_STALE_AFTER", 900))
+# Batch endpoint (/ask/batch/): prompts per request and how many run at once.
+# Keep the concurrency at or below LLM_HTTP_POOL_SIZE so every call reuses a pooled connection.
+LLM_BATCH_MAX_ITEMS = int(os.environ.get("LLM_BATCH_MAX_ITEMS", 100))
+LLM_BATCH_CONCURRENCY = int(os.environ.get("LLM_BATCH_CONCURRENCY", 8))
+# Models offered in the ask form, as [id, label] pairs
+LLM_MODELS = json.loads(os.environ.get("LLM_MODELS", '[["mistral-small3.1:latest", "mistral-small3.1"]]'))
+# Backend registry, a JSON list of objects with name, url, key or key_env, models
+# (omit to serve all), max_concurrency (0 = unlimited) and weight. When empty, a
+# single backend at API_URL/API_KEY serves every model.
+LLM_BACKENDS = json.loads(os.environ.get("LLM_BACKENDS", "[]"))
+# 'least_in_flight' or 'ewma' (in-flight requests weighted by recent latency)
+LLM_ROUTER_STRATEGY = os.environ.get("LLM_ROUTER_STRATEGY", "least_in_flight")
+# Seconds a request waits for a backend when all of them are at max_concurrency,
+# before it fails with 503 "No backend available"
+LLM_ROUTER_WAIT_TIMEOUT = float(os.environ.get("LLM_ROUTER_WAIT_TIMEOUT", 10))
+# Consecutive failures that take a backend out of rotation, and for how many seconds
+LLM_CIRCUIT_FAILURES = int(os.environ.get("LLM_CIRCUIT_FAILURES", 5))
+LLM_CIRCUIT_COOLDOWN = float(os.environ.get("LLM_CIRCUIT_COOLDOWN", 30))
+# Ask streaming backends to send a final usage chunk (OpenAI's stream_options);
+# turn off for servers that reject unknown request fields
+LLM_STREAM_INCLUDE_USAGE = os.environ.get("LLM_STREAM_INCLUDE_USAGE", "True").lower() in ("1", "true", "yes")
+# Bearer token required by /metrics; leave empty to serve it without authentication
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# Usage dashboard rollups (rollups.py): hourly rows older than this many days
+# are dropped by `python manage.py compact_usage_rollups`, the daily rows remain
+LLM_ROLLUP_HOURLY_RETENTION_DAYS = int(os.environ.get("LLM_ROLLUP_HOURLY_RETENTION_DAYS", 90))
+# JSON viewer (json_documents.py): uploads are validated while streaming and
+# stored under MEDIA_ROOT/json_documents. Containers larger than
+# JSON_VIEWER_NODE_BYTES are indexed so their children can be paged; smaller
+# values are read whole when expanded.
+JSON_VIEWER_NODE_BYTES = int(os.environ.get("JSON_VIEWER_NODE_BYTES", 1024 * 1024))
+JSON_VIEWER_PAGE_SIZE = int(os.environ.get("JSON_VIEWER_PAGE_SIZE", 100))
+# Documents up to this size are also shown in the raw and edit panes
+JSON_VIEWER_INLINE_BYTES = int(os.environ.get("JSON_VIEWER_INLINE_BYTES", 1024 * 1024))
+# Total size of the documents each user can store (0 for no limit), and how many
+# days they are kept before `python manage.py prune_json_documents` deletes them
+JSON_VIEWER_USER_QUOTA_BYTES = int(os.environ.get("JSON_VIEWER_USER_QUOTA_BYTES", 1024 * 1024 * 1024))
+JSON_VIEWER_RETENTION_DAYS = int(os.environ.get("JSON_VIEWER_RETENTION_DAYS", 30))
+# Table view of JSON arrays (json_tables.py): largest array loaded as columns,
+# and the memory each worker spends keeping built tables. A table takes a few
+# hundred bytes per row, and about twice that while it is built.
+JSON_VIEWER_TABLE_MAX_ROWS = int(os.environ.get("JSON_VIEWER_TABLE_MAX_ROWS", 200000))
+JSON_VIEWER_TABLE_CACHE_BYTES = int(os.environ.get("JSON_VIEWER_TABLE_CACHE_BYTES", 256 * 1024 * 1024))
+# Metadata schemas (schemas.py): how many violations a validation reports
+# (all are counted), and how many compiled schema versions each worker keeps
+JSON_SCHEMA_MAX_ERRORS = int(os.environ.get("JSON_SCHEMA_MAX_ERRORS", 1000))
+JSON_SCHEMA_CACHE = int(os.environ.get("JSON_SCHEMA_CACHE", 32))
+# Metadata extraction (extraction.py): what the backend is asked for
+# ('json_schema', 'json_object', or '' for servers that reject response_format),
+# and how often an invalid reply that local repair can't fix is re-asked
+LLM_EXTRACTION_RESPONSE_FORMAT = os.environ.get("LLM_EXTRACTION_RESPONSE_FORMAT", "json_schema")
+LLM_EXTRACTION_MAX_REASKS = int(os.environ.get("LLM_EXTRACTION_MAX_REASKS", 1))
+LLM_EXTRACTION_TEMPERATURE = float(os.environ.get("LLM_EXTRACTION_TEMPERATURE", 0.0))
+LLM_EXTRACTION_MAX_TOKENS = int(os.environ.get("LLM_EXTRACTION_MAX_TOKENS", 1500))
+# Semantic cache (semantic_cache.py): first questions of a conversation without
+# an uploaded file are answered from an earlier answer of the same model when
+# the questions' embeddings have at least LLM_SEMANTIC_CACHE_THRESHOLD cosine
+# similarity. The embedder is a dotted path like LLM_RETRIEVAL_EMBEDDER (which
+# it defaults to, then to a built-in hashing embedder). Entries are per user
+# unless LLM_SEMANTIC_CACHE_SHARED; answers can quote the asker's own files.
+LLM_SEMANTIC_CACHE_ENABLED = os.environ.get("LLM_SEMANTIC_CACHE_ENABLED", "False").lower() in ("1", "true", "yes")
+LLM_SEMANTIC_CACHE_EMBEDDER = os.environ.get("LLM_SEMANTIC_CACHE_EMBEDDER", "")
+LLM_SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("LLM_SEMANTIC_CACHE_THRESHOLD", 0.9))
+LLM_SEMANTIC_CACHE_SHARED = os.environ.get("LLM_SEMANTIC_CACHE_SHARED", "False").lower() in ("1", "true", "yes")
+# Seconds an answer can be served (0 for no limit), questions searched per model
+# and scope, and indexes each worker keeps in memory
+LLM_SEMANTIC_CACHE_TTL = int(os.environ.get("LLM_SEMANTIC_CACHE_TTL", 7 * 24 * 60 * 60))
+LLM_SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_SEMANTIC_CACHE_MAX_ENTRIES", 10000))
+LLM_SEMANTIC_CACHE_MAX_INDEXES = int(os.environ.get("LLM_SEMANTIC_CACHE_MAX_INDEXES", 100))
+# Health endpoints (health.py). /health/ serves the estimated conversation
+# count (pg_class.reltuples on PostgreSQL; elsewhere an exact count cached for
+# HEALTH_STATS_TTL seconds). /health/ready/ probes each LLM backend with a
+# HEALTH_LLM_TIMEOUT-second GET, at most once per HEALTH_LLM_PROBE_TTL seconds
+# per worker, and fails without a reachable backend unless HEALTH_READY_REQUIRES_LLM is off.
+HEALTH_STATS_TTL = int(os.environ.get("HEALTH_STATS_TTL", 300))
+HEALTH_LLM_TIMEOUT = float(os.environ.get("HEALTH_LLM_TIMEOUT", 2))
+HEALTH_LLM_PROBE_TTL = float(os.environ.get("HEALTH_LLM_PROBE_TTL", 10))
+HEALTH_READY_REQUIRES_LLM = os.environ.get("HEALTH_READY_REQUIRES_LLM", "True").lower() in ("1", "true", "yes")
+# Keep-alive rows a POST to /health/?name= may touch, comma-separated; the
+# endpoint is public, so other names are refused rather than creating rows
+HEALTH_KEEPALIVE_NAMES = [name.strip() for name in os.environ.get("HEALTH_KEEPALIVE_NAMES", "health_check").split(",") if name.strip()]
+# Seconds the signed-in user is cached between requests, and the conversation
+# history fragment per user (0 turns either off). Both are invalidated on
+# changes, so they default to on only when CACHE_SHARED.
+AUTH_USER_CACHE_TTL = int(os.environ.get("AUTH_USER_CACHE_TTL", 300 if CACHE_SHARED else 0))
+HISTORY_FRAGMENT_TTL = int(os.environ.get("HISTORY_FRAGMENT_TTL", 600 if CACHE_SHARED else 0))
+# Conversation export and import (exports.py): rows fetched per query while
+# exporting (and per NDJSON write), rows per Parquet row group, and messages
+# inserted per transaction by `python manage.py import_conversations`.
+# Memory use depends on these, not on the number of rows.
+CONVERSATION_EXPORT_CHUNK_SIZE = int(os.environ.get("CONVERSATION_EXPORT_CHUNK_SIZE", 2000))
+CONVERSATION_EXPORT_ROW_GROUP_SIZE = int(os.environ.get("CONVERSATION_EXPORT_ROW_GROUP_SIZE", 10000))
+CONVERSATION_IMPORT_BATCH_SIZE = int(os.environ.get("CONVERSATION_IMPORT_BATCH_SIZE", 1000))